@@ -1,19 +1,34 @@
 import json
 from pathlib import Path
 
+try:
+    from .index import RuleIndex, DEFAULT
+except ImportError:
+    from ai_assistant.index import RuleIndex, DEFAULT
+
 class Assistant:
     """
     Простой офлайн «ИИ»-помощник на базе правил.
     На вход получает список DTC и отдаёт структурированные подсказки.
+    Правила (коды, маски P03xx, диапазоны P0300..P0312, префиксы U*)
+    при загрузке собираются в RuleIndex — см. ai_assistant/index.py.
     """
     def __init__(self, rules_path: Path):
         with open(rules_path, "r", encoding="utf-8") as f:
             self.rules = json.load(f)
+        self.index = RuleIndex(self.rules)
+
+    def rule_for(self, code: str) -> tuple[str, dict]:
+        """(шаблон, правило) — самое точное для кода, иначе default."""
+        rule = self.index.match(code)
+        if rule is None:
+            return DEFAULT, self.rules.get(DEFAULT, {})
+        return rule.pattern, rule.data
 
     def advise_for_dtcs(self, dtcs: list[str]) -> list[dict]:
         advices = []
         for code in dtcs:
-            rule = self.rules.get(code) or self.rules.get(code[:4] + "x") or self.rules.get("default")
+            _, rule = self.rule_for(code)
             advices.append({
                 "code": code,
                 "title": rule.get("title", "Рекомендации"),
@@ -26,3 +41,27 @@ class Assistant:
                 "checks": self.rules.get("default", {}).get("checks", [])
             })
         return advices
+
+    def advise_batch(self, dtcs: list[str]) -> list[dict]:
+        """
+        Подсказки для пачки кодов без повторов: одинаковые коды (с разных
+        блоков, из разных чтений) считаются один раз, коды под одним
+        правилом — одна подсказка со списком кодов.
+        """
+        grouped: dict[str, dict] = {}
+        for code in dict.fromkeys(c.strip().upper() for c in dtcs if c and c.strip()):
+            pattern, rule = self.rule_for(code)
+            advice = grouped.get(pattern)
+            if advice is None:
+                advice = grouped[pattern] = {
+                    "codes": [],
+                    "rule": pattern,
+                    "title": rule.get("title", "Рекомендации"),
+                    "checks": rule.get("checks", [])
+                }
+            advice["codes"].append(code)
+        if not grouped:
+            default = self.rules.get(DEFAULT, {})
+            return [{"codes": [], "rule": DEFAULT, "title": default.get("title", "Рекомендации"),
+                     "checks": default.get("checks", [])}]
+        return list(grouped.values())
@@ -0,0 +1,179 @@
+# ai_assistant/index.py
+"""
+Индекс правил помощника: код DTC -> самое точное правило.
+
+Ключи rules.json:
+  "P0300"          — один код;
+  "P030x", "P03xx" — x (или X) на месте любого одного символа, где угодно;
+  "P0300..P0312"   — диапазон кодов одной длины (цифры сравниваются как hex);
+  "U*", "P1A*"     — всё, что начинается с префикса;
+  "default"        — когда ничего не подошло (в индекс не входит).
+
+Ключи раскладываются при загрузке в префиксное дерево по символам.
+Точные коды и маски лежат в узле, где кончается шаблон (у маски вместо
+символа ребро x); префиксы — в своём узле; диапазон — в узле общего
+начала границ, как список непересекающихся отрезков по хвосту кода
+(пересекающиеся диапазоны разрезаются заранее, каждому отрезку — самое
+точное правило). Поиск идёт по символам кода, ветвясь только на
+рёбрах x, и в каждом узле смотрит префикс и отрезки (бинарный поиск) —
+время зависит от длины кода, а не от числа правил.
+
+Точнее то правило, под которое попадает меньше кодов (одиночный — 1,
+маска — 16 на каждый x, диапазон — его ширина, префикс — 16 на каждый
+недостающий до пяти символ); при равенстве: код, диапазон, маска, префикс,
+а дальше — кто раньше в файле.
+"""
+from __future__ import annotations
+import heapq
+from bisect import bisect_right
+from dataclasses import dataclass, field
+
+WILD = "X"          # после upper(): и x, и X
+ANY = "*"
+RANGE = ".."
+DEFAULT = "default"
+CODE_LEN = 5        # P0300: буква + 4 hex-цифры
+EXACT, SPAN, MASK, PREFIX = range(4)   # порядок при равной ширине
+
+
+@dataclass
+class Rule:
+    pattern: str
+    data: dict
+    rank: tuple = ()   # (сколько кодов подходит, вид, номер в файле) — меньше значит точнее
+
+    @property
+    def title(self) -> str:
+        return self.data.get("title", "Рекомендации")
+
+    @property
+    def checks(self) -> list[str]:
+        return self.data.get("checks", [])
+
+
+@dataclass
+class _Node:
+    children: dict[str, "_Node"] = field(default_factory=dict)
+    terminal: Rule | None = None
+    prefix: Rule | None = None
+    # длина хвоста -> [(нижняя, верхняя, правило)]; после build — (начала отрезков, правила)
+    spans: dict[int, list] = field(default_factory=dict)
+    segments: dict[int, tuple[list[int], list[Rule | None]]] = field(default_factory=dict)
+
+    def child(self, ch: str) -> "_Node":
+        node = self.children.get(ch)
+        if node is None:
+            node = self.children[ch] = _Node()
+        return node
+
+
+class RuleIndex:
+    def __init__(self, rules: dict[str, dict]):
+        self.root = _Node()
+        self.size = 0
+        for order, (pattern, data) in enumerate(rules.items()):
+            if pattern != DEFAULT:
+                self.add(pattern, data, order)
+        self._build(self.root)
+
+    def add(self, pattern: str, data: dict, order: int) -> None:
+        key = pattern.strip().upper()
+        if RANGE in key:
+            self._add_span(pattern, key, data, order)
+        elif key.endswith(ANY):
+            stem = key[:-1]
+            rule = Rule(pattern, data, (16 ** max(CODE_LEN - len(stem), 0), PREFIX, order))
+            node = self._walk(stem)
+            node.prefix = _better(node.prefix, rule)
+        else:
+            wild = key.count(WILD)
+            rule = Rule(pattern, data, (16 ** wild, MASK if wild else EXACT, order))
+            node = self._walk(key)
+            node.terminal = _better(node.terminal, rule)
+        self.size += 1
+
+    def _walk(self, key: str) -> _Node:
+        if ANY in key:
+            raise ValueError("'*' допустим только в конце шаблона")
+        node = self.root
+        for ch in key:
+            node = node.child(ch)
+        return node
+
+    def _add_span(self, pattern: str, key: str, data: dict, order: int) -> None:
+        lo, _, hi = key.partition(RANGE)
+        lo, hi = lo.strip(), hi.strip()
+        if len(lo) != len(hi) or not lo or lo[0] != hi[0]:
+            raise ValueError(f"Диапазон {pattern!r}: границы одной длины и с одной буквы, напр. P0300..P0312")
+        n = 1
+        while n < len(lo) - 1 and lo[n] == hi[n]:
+            n += 1
+        try:
+            a, b = int(lo[n:], 16), int(hi[n:], 16)
+        except ValueError:
+            raise ValueError(f"Диапазон {pattern!r}: после буквы — hex-цифры") from None
+        if a > b:
+            raise ValueError(f"Диапазон {pattern!r}: нижняя граница больше верхней")
+        rule = Rule(pattern, data, (b - a + 1, SPAN, order))
+        self._walk(lo[:n]).spans.setdefault(len(lo) - n, []).append((a, b, rule))
+
+    def _build(self, node: _Node) -> None:
+        for length, spans in node.spans.items():
+            # границы отрезков: начала диапазонов и точки сразу за концами;
+            # в куче — открытые диапазоны, сверху самый точный
+            spans.sort(key=lambda s: s[0])
+            bounds = sorted({a for a, _, _ in spans} | {b + 1 for _, b, _ in spans})
+            starts, owners, heap, j = [], [], [], 0
+            for x in bounds:
+                while j < len(spans) and spans[j][0] <= x:
+                    heapq.heappush(heap, (spans[j][2].rank, spans[j][1], spans[j][2]))
+                    j += 1
+                while heap and heap[0][1] < x:
+                    heapq.heappop(heap)
+                starts.append(x)
+                owners.append(heap[0][2] if heap else None)
+            node.segments[length] = (starts, owners)
+        node.spans = {}
+        for child in node.children.values():
+            self._build(child)
+
+    def match(self, code: str) -> Rule | None:
+        """Самое точное правило для кода или None."""
+        code = code.strip().upper()
+        best = None
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            best = _better(best, node.prefix)
+            tail = len(code) - i
+            if tail in node.segments:
+                best = _better(best, _segment(node.segments[tail], code[i:]))
+            if i == len(code):
+                best = _better(best, node.terminal)
+                continue
+            for ch in (code[i], WILD):
+                nxt = node.children.get(ch)
+                if nxt is not None:
+                    stack.append((nxt, i + 1))
+        return best
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def _segment(segments: tuple[list[int], list[Rule | None]], tail: str) -> Rule | None:
+    starts, owners = segments
+    try:
+        value = int(tail, 16)
+    except ValueError:
+        return None
+    k = bisect_right(starts, value) - 1
+    return owners[k] if k >= 0 else None
+
+
+def _better(a: Rule | None, b: Rule | None) -> Rule | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a if a.rank <= b.rank else b
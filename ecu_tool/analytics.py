@@ -0,0 +1,233 @@
+# analytics.py
+"""
+Сводка по кодам неисправностей из журналов сессий (session.jsonl).
+
+Журнал читается построчно цепочкой генераторов — файл целиком в память
+не попадает, сколько бы гигабайт в нём ни было:
+  iter_records  — записи JSON (.jsonl или .jsonl.gz); строки без нужных
+                  событий отбрасываются до json.loads;
+  iter_readings — одно чтение кодов = (время, машина/порт, коды): сырые
+                  ответы elm_resp / demo_response копятся пачками и
+                  разбираются decode_dtc_batch, fleet_read_dtc даёт чтение
+                  на каждый порт, advice — только если ответа перед ним нет;
+  DTCStats.add  — частота кодов, пары кодов в одном чтении, первое и
+                  последнее появление по каждой машине.
+Память — по числу разных кодов и машин, не по размеру журналов.
+Много файлов можно разбирать в пуле процессов: каждый процесс считает
+свой DTCStats, потом они складываются (merge).
+
+Машина — порт адаптера (из payload или из последнего elm_init в том же
+журнале), для демо-режима — "demo".
+"""
+from __future__ import annotations
+import gzip
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import combinations
+from pathlib import Path
+from typing import Iterable, Iterator
+
+try:
+    from .diag.dtc import parse_obd_dtc
+    from .diag.dtc_batch import decode_dtc_batch, np
+except ImportError:
+    from diag.dtc import parse_obd_dtc
+    from diag.dtc_batch import decode_dtc_batch, np
+
+DECODE_BATCH = 20_000   # сырых ответов на один вызов decode_dtc_batch
+DEMO = "demo"
+UNKNOWN = "?"
+# события, из которых берутся коды; остальные строки журнала даже не разбираются
+KINDS = ("elm_init", "elm_resp", "demo_response", "advice", "fleet_read_dtc")
+_MARKS = tuple(f'"{k}"' for k in KINDS)
+
+
+@dataclass
+class Reading:
+    ts: str
+    vehicle: str
+    codes: tuple[str, ...]
+
+
+@dataclass
+class Seen:
+    count: int = 0
+    first: str = ""
+    last: str = ""
+
+    def add(self, ts: str) -> None:
+        self.count += 1
+        # метки ISO 8601 в UTC — сравниваются как строки
+        if ts and (not self.first or ts < self.first):
+            self.first = ts
+        if ts > self.last:
+            self.last = ts
+
+    def merge(self, other: "Seen") -> None:
+        self.count += other.count
+        if other.first and (not self.first or other.first < self.first):
+            self.first = other.first
+        if other.last > self.last:
+            self.last = other.last
+
+
+@dataclass
+class DTCStats:
+    files: int = 0
+    bad_lines: int = 0
+    readings: int = 0
+    codes: dict[str, Seen] = field(default_factory=dict)
+    vehicles: dict[str, Seen] = field(default_factory=dict)              # чтения по машине
+    by_vehicle: dict[str, dict[str, Seen]] = field(default_factory=dict)  # машина -> код
+    pairs: dict[tuple[str, str], int] = field(default_factory=dict)      # коды в одном чтении
+
+    def add(self, r: Reading) -> None:
+        self.readings += 1
+        self.vehicles.setdefault(r.vehicle, Seen()).add(r.ts)
+        per = self.by_vehicle.setdefault(r.vehicle, {})
+        codes = sorted(set(r.codes))
+        for code in codes:
+            self.codes.setdefault(code, Seen()).add(r.ts)
+            per.setdefault(code, Seen()).add(r.ts)
+        for pair in combinations(codes, 2):
+            self.pairs[pair] = self.pairs.get(pair, 0) + 1
+
+    def merge(self, other: "DTCStats") -> None:
+        self.files += other.files
+        self.bad_lines += other.bad_lines
+        self.readings += other.readings
+        _merge_seen(self.codes, other.codes)
+        _merge_seen(self.vehicles, other.vehicles)
+        for vehicle, codes in other.by_vehicle.items():
+            _merge_seen(self.by_vehicle.setdefault(vehicle, {}), codes)
+        for pair, n in other.pairs.items():
+            self.pairs[pair] = self.pairs.get(pair, 0) + n
+
+    def top_codes(self, n: int = 10) -> list[tuple[str, Seen, int]]:
+        """(код, сколько раз/когда, на скольких машинах) — самые частые."""
+        spread = {}
+        for codes in self.by_vehicle.values():
+            for code in codes:
+                spread[code] = spread.get(code, 0) + 1
+        ranked = sorted(self.codes.items(), key=lambda kv: (-kv[1].count, kv[0]))[:n]
+        return [(code, seen, spread.get(code, 0)) for code, seen in ranked]
+
+    def top_pairs(self, n: int = 10) -> list[tuple[tuple[str, str], int]]:
+        return sorted(self.pairs.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+    def to_dict(self) -> dict:
+        seen = lambda s: {"count": s.count, "first": s.first, "last": s.last}
+        return {
+            "files": self.files,
+            "bad_lines": self.bad_lines,
+            "readings": self.readings,
+            "codes": {c: seen(s) for c, s in sorted(self.codes.items())},
+            "vehicles": {v: dict(seen(s), codes={c: seen(cs) for c, cs in sorted(self.by_vehicle.get(v, {}).items())})
+                         for v, s in sorted(self.vehicles.items())},
+            "pairs": [{"codes": list(p), "count": n} for p, n in self.top_pairs(len(self.pairs))],
+        }
+
+
+def _merge_seen(into: dict[str, Seen], other: dict[str, Seen]) -> None:
+    for key, s in other.items():
+        into.setdefault(key, Seen()).merge(s)
+
+
+def open_log(path: Path):
+    """Текстовый поток журнала; .gz узнаётся по сигнатуре, а не по имени."""
+    with open(path, "rb") as f:
+        gz = f.read(2) == b"\x1f\x8b"
+    if gz:
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def iter_records(path: Path, stats: DTCStats | None = None) -> Iterator[dict]:
+    with open_log(path) as f:
+        for line in f:
+            # read_fw, link_stats и т.п. бывают длинными — их не разбираем вовсе
+            if not any(m in line for m in _MARKS):
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                if stats is not None:
+                    stats.bad_lines += 1   # оборванная последняя строка, мусор
+                continue
+            if isinstance(rec, dict) and rec.get("kind") in KINDS:
+                yield rec
+
+
+def _decode(pending: list[tuple[str, str, str]]) -> Iterator[Reading]:
+    raws = [raw for _, _, raw in pending]
+    if np is None:
+        per = [parse_obd_dtc(raw)[0] for raw in raws]
+    else:
+        per = decode_dtc_batch(raws).per_response()
+    for (ts, vehicle, _), codes in zip(pending, per):
+        yield Reading(ts, vehicle, tuple(dict.fromkeys(codes)))
+
+
+def iter_readings(records: Iterable[dict]) -> Iterator[Reading]:
+    port = None          # из последнего elm_init: старые записи elm_resp порт не содержат
+    answered = False     # после ответа идёт advice с теми же кодами — второй раз не считаем
+    pending: list[tuple[str, str, str]] = []
+    for rec in records:
+        kind, ts = rec["kind"], rec.get("ts", "")
+        payload = rec.get("payload") or {}
+        if kind == "elm_init":
+            port = payload.get("port") or port
+        elif kind in ("elm_resp", "demo_response"):
+            vehicle = DEMO if kind == "demo_response" else payload.get("port") or port or UNKNOWN
+            pending.append((ts, vehicle, payload.get("raw") or ""))
+            answered = True
+        elif kind == "advice":
+            if not answered:
+                yield Reading(ts, port or UNKNOWN, tuple(payload.get("dtcs") or ()))
+            answered = False
+        elif kind == "fleet_read_dtc":
+            for r in payload.get("results") or ():
+                if not r.get("ok"):
+                    continue
+                if "raw" in r:
+                    pending.append((ts, r["port"], r["raw"]))
+                else:
+                    yield Reading(ts, r["port"], tuple(r.get("dtcs") or ()))
+        if len(pending) >= DECODE_BATCH:
+            yield from _decode(pending)
+            pending = []
+    if pending:
+        yield from _decode(pending)
+
+
+def analyze_file(path: Path) -> DTCStats:
+    stats = DTCStats(files=1)
+    for reading in iter_readings(iter_records(Path(path), stats)):
+        stats.add(reading)
+    return stats
+
+
+def log_files(paths: Iterable[Path]) -> list[Path]:
+    """Файлы журналов; каталог раскрывается в *.jsonl и *.jsonl.gz внутри него."""
+    files = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files += sorted(f for f in p.iterdir() if f.name.endswith((".jsonl", ".jsonl.gz")))
+        else:
+            files.append(p)
+    return files
+
+
+def analyze(paths: Iterable[Path], workers: int = 1) -> DTCStats:
+    """Свести все журналы; workers > 1 — файлы разбираются параллельно в процессах."""
+    files = log_files(paths)
+    total = DTCStats()
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+            for stats in pool.map(analyze_file, files):
+                total.merge(stats)
+    else:
+        for f in files:
+            total.merge(analyze_file(f))
+    return total
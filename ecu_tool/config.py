@@ -1,7 +1,25 @@
+import json
+import os
+from datetime import datetime
 from pathlib import Path
 
 LOG_DIR = Path(__file__).parent / "logs"
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 LOG_FILE = LOG_DIR / "session.jsonl"
+CHUNK_PROFILE_FILE = LOG_DIR / "chunk_profile.json"
+FW_REPO_DIR = LOG_DIR / "fwrepo"
+DAEMON_SOCKET = Path(os.environ.get("ECU_DAEMON_SOCKET", LOG_DIR / "ecu_daemon.sock"))
 APP_NAME = "ECU CLI"
+
+
+def log_event(kind: str, payload: dict):
+    """Дописать событие в журнал сессии (одна JSON-строка: ts, kind, payload) — для CLI и GUI."""
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    record = {
+        "ts": datetime.utcnow().isoformat() + "Z",
+        "kind": kind,
+        "payload": payload,
+    }
+    with open(LOG_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,317 @@
+# daemon.py
+"""
+Фоновый процесс, который держит адаптеры открытыми.
+
+Без него каждая команда заново открывает порт, гоняет ATZ + AT-настройку,
+поднимает шину и сессию KWP — и всё это теряется на выходе. Демон
+открывает адаптер при первом обращении к порту и держит его вместе с
+сессией (KWPSession с фоновым TesterPresent); запросы к одному адаптеру
+идут строго по очереди под замком сессии, разные адаптеры — параллельно.
+
+Протокол — Unix domain socket, по строке JSON на запрос и на ответ:
+  -> {"op": "read_dtc", "port": "/dev/ttyUSB0"}
+  <- {"ok": true, "result": {...}}  или  {"ok": false, "type": "...", "error": "...", ...}
+Операции: ping, read_dtc, ecu_info, read_memory (блок для read-fw),
+status, release (закрыть адаптер), shutdown.
+
+DaemonClient.connect() возвращает None, если демон не запущен, —
+CLI и GUI тогда работают с портом напрямую, как раньше. DaemonBackend —
+MemoryBackend поверх демона: dump_firmware с ним работает как с RealBackend.
+"""
+from __future__ import annotations
+import base64
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+
+try:
+    from .config import DAEMON_SOCKET
+    from .diag.dtc import parse_obd_dtc
+    from .ecu_transport.elm327 import ELM327, OBD_HEADER, KWP_HEADER
+    from .ecu_transport.kwp2000 import KWPNegativeResponse, KWPNoResponse
+    from .firmware.io import RealBackend
+    from .firmware.map import REGIONS
+except ImportError:
+    from config import DAEMON_SOCKET
+    from diag.dtc import parse_obd_dtc
+    from ecu_transport.elm327 import ELM327, OBD_HEADER, KWP_HEADER
+    from ecu_transport.kwp2000 import KWPNegativeResponse, KWPNoResponse
+    from firmware.io import RealBackend
+    from firmware.map import REGIONS
+
+CLIENT_TIMEOUT = 30.0   # самый долгий запрос — первое открытие адаптера (ATZ + инициализация шины)
+
+
+class DaemonError(RuntimeError):
+    """Ошибка на стороне демона, которую не удалось вернуть родным типом."""
+
+
+# ---------- сервер ----------
+class _Adapter:
+    def __init__(self, port: str):
+        self.port = port
+        self.backend = RealBackend(adapter=ELM327(port), developer_mode=False)
+        self.lock = self.backend.session.lock
+        self.opened = time.time()
+        self.requests = 0
+
+    def status(self) -> dict:
+        return {"port": self.port, "ecu_id": self.backend.ecu_id, "requests": self.requests,
+                "open_s": round(time.time() - self.opened, 1), "session": self.backend.session.stats()}
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+class AdapterPool:
+    """Открытые адаптеры по портам; открываются при первом запросе."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._adapters: dict[str, _Adapter] = {}
+        self._opening: dict[str, threading.Lock] = {}
+
+    def get(self, port: str) -> _Adapter:
+        with self._lock:
+            if port in self._adapters:
+                return self._adapters[port]
+            opening = self._opening.setdefault(port, threading.Lock())
+        # инициализация адаптера долгая — другие порты в это время не ждут
+        with opening:
+            with self._lock:
+                if port in self._adapters:
+                    return self._adapters[port]
+            adapter = _Adapter(port)
+            with self._lock:
+                self._adapters[port] = adapter
+            return adapter
+
+    def release(self, port: str) -> bool:
+        with self._lock:
+            adapter = self._adapters.pop(port, None)
+        if adapter:
+            adapter.close()
+        return adapter is not None
+
+    def status(self) -> list[dict]:
+        with self._lock:
+            return [a.status() for a in self._adapters.values()]
+
+    def close_all(self) -> None:
+        with self._lock:
+            adapters, self._adapters = list(self._adapters.values()), {}
+        for a in adapters:
+            a.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # одно соединение — сколько угодно запросов (DaemonBackend читает блоки подряд)
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line)
+                reply = {"ok": True, "result": self.server.dispatch(req)}
+            except Exception as e:
+                reply = _error_reply(e)
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+# на Windows без AF_UNIX класса UnixStreamServer нет — модуль всё равно должен импортироваться
+class DaemonServer(socketserver.ThreadingMixIn, getattr(socketserver, "UnixStreamServer", socketserver.TCPServer)):
+    daemon_threads = True
+
+    def __init__(self, path: Path = DAEMON_SOCKET):
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("Демон работает через Unix-сокет — на этой системе его нет")
+        self.path = Path(path)
+        if self.path.exists():
+            if DaemonClient.connect(self.path) is not None:
+                raise RuntimeError(f"Демон уже запущен: {self.path}")
+            self.path.unlink()   # сокет остался от упавшего процесса
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(self.path), _Handler)
+        os.chmod(self.path, 0o600)
+        self.pool = AdapterPool()
+        self.started = time.time()
+
+    def dispatch(self, req: dict):
+        op = req.get("op")
+        if op == "status":
+            return {"pid": os.getpid(), "uptime_s": round(time.time() - self.started, 1),
+                    "adapters": self.pool.status()}
+        if op == "shutdown":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"stopping": True}
+        port = req.get("port")
+        if not port:
+            raise ValueError("не указан порт")
+        if op == "release":
+            return {"released": self.pool.release(port)}
+        handler = _OPS.get(op)
+        if handler is None:
+            raise ValueError(f"неизвестная операция {op!r}")
+        adapter = self.pool.get(port)
+        try:
+            with adapter.lock:
+                adapter.requests += 1
+                return handler(adapter, req)
+        except OSError:
+            # порт пропал (адаптер выдернули) — в следующий раз откроем заново
+            self.pool.release(port)
+            raise
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close_all()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _op_ping(adapter: _Adapter, req: dict) -> dict:
+    # другой заголовок (kwp-ping --header) — только на этот запрос, сессия остаётся на своём
+    t0 = time.perf_counter()
+    with adapter.backend.adapter.using_header(req.get("header") or KWP_HEADER):
+        adapter.backend.session.call(adapter.backend.kwp.tester_present)
+    return {"ms": round((time.perf_counter() - t0) * 1000, 1), "ecu_id": adapter.backend.ecu_id,
+            "session": adapter.backend.session.stats()}
+
+
+def _op_read_dtc(adapter: _Adapter, req: dict) -> dict:
+    # адаптер держит заголовок KWP (81 10 F1) — Mode 03 шлём по адресу OBD, как read-dtc без демона
+    elm = adapter.backend.adapter
+    with elm.using_header(OBD_HEADER):
+        raw = elm.send_obd("03")
+    dtcs, _ = parse_obd_dtc(raw)
+    return {"raw": raw, "dtcs": dtcs}
+
+
+def _op_ecu_info(adapter: _Adapter, req: dict) -> dict:
+    return adapter.backend.info()
+
+
+def _op_read_memory(adapter: _Adapter, req: dict) -> dict:
+    data = adapter.backend.read_block(int(req["address"]), int(req["size"]))
+    return {"data": base64.b64encode(data).decode("ascii")}
+
+
+_OPS = {"ping": _op_ping, "read_dtc": _op_read_dtc, "ecu_info": _op_ecu_info, "read_memory": _op_read_memory}
+
+# ошибки, которые клиент получает тем же типом (retry.classify смотрит на тип и nrc)
+_ERROR_TYPES = {cls.__name__: cls for cls in (RuntimeError, ValueError, PermissionError, NotImplementedError,
+                                              TimeoutError, OSError, KWPNoResponse)}
+
+
+def _error_reply(e: Exception) -> dict:
+    reply = {"ok": False, "type": type(e).__name__, "error": str(e)}
+    if isinstance(e, KWPNegativeResponse):
+        # сырой ответ, а не str(e): иначе на клиенте префикс "Negative response ..." удвоится
+        reply.update(sid=e.sid, nrc=e.nrc, resp=e.resp)
+    return reply
+
+
+def _raise_remote(reply: dict):
+    kind, msg = reply.get("type"), reply.get("error", "")
+    if kind == "KWPNegativeResponse":
+        raise KWPNegativeResponse(reply["sid"], reply["nrc"], reply.get("resp", ""))
+    raise _ERROR_TYPES.get(kind, DaemonError)(msg)
+
+
+def serve(path: Path = DAEMON_SOCKET) -> None:
+    server = DaemonServer(path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# ---------- клиент ----------
+class DaemonClient:
+    def __init__(self, sock: socket.socket, path: Path):
+        self.path = path
+        self._sock = sock
+        self._f = sock.makefile("rwb")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, path: Path = DAEMON_SOCKET, timeout: float = CLIENT_TIMEOUT) -> "DaemonClient | None":
+        """Подключиться к демону; None — демон не запущен (или нет Unix-сокетов)."""
+        path = Path(path)
+        if not hasattr(socket, "AF_UNIX") or not path.exists():
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(path))
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock, path)
+
+    def call(self, op: str, **args):
+        with self._lock:
+            self._f.write(json.dumps(dict(args, op=op)).encode("utf-8") + b"\n")
+            self._f.flush()
+            line = self._f.readline()
+        if not line:
+            raise DaemonError("Демон закрыл соединение")
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            _raise_remote(reply)
+        return reply["result"]
+
+    def close(self) -> None:
+        try:
+            self._f.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DaemonBackend:
+    """MemoryBackend через демон: адаптер и сессия остаются открытыми после close()."""
+    max_block = RealBackend.max_block
+    max_write_block = RealBackend.max_write_block
+
+    def __init__(self, client: DaemonClient, port: str, developer_mode: bool = False):
+        self.client = client
+        self.port = port
+        self.developer_mode = developer_mode
+        self.regions = list(REGIONS)
+        self.ecu_id = client.call("ecu_info", port=port).get("ecu_id")
+
+    @property
+    def profile_key(self) -> str:
+        # тот же ключ, что у RealBackend, — подобранный размер блока общий
+        return f"{self.port}:{self.ecu_id or 'unknown'}"
+
+    def read_block(self, address: int, size: int) -> bytes:
+        reply = self.client.call("read_memory", port=self.port, address=address, size=size)
+        return base64.b64decode(reply["data"])
+
+    def ensure_writable(self) -> None:
+        if not self.developer_mode:
+            raise PermissionError("Запись в реальный ЭБУ выключена (безопасность). Включи developer_mode только для тестов на стенде.")
+
+    def write_block(self, address: int, data: bytes) -> None:
+        self.ensure_writable()
+        raise NotImplementedError("WriteMemory not implemented for real backend yet.")
+
+    def info(self) -> dict:
+        return dict(self.client.call("ecu_info", port=self.port), daemon=str(self.client.path))
+
+    def close(self):
+        self.client.close()
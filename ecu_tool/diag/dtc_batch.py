@@ -0,0 +1,303 @@
+# diag/dtc_batch.py
+"""
+Пакетный разбор ответов на OBD 03 (коды неисправностей).
+
+parse_obd_dtc разбирает одну строку и не различает блоки. Здесь сразу
+много ответов склеиваются в один буфер и разбираются столбцами NumPy,
+без цикла Python по ответам:
+  символы -> строки -> hex-цифры -> байты кадров -> сообщения -> слова DTC.
+Каждый кадр относится к своему блоку по заголовку:
+  ISO 9141 / 14230 (ATH1): fmt tgt src [len] ... cs — блок = src;
+  CAN 11 бит: "7E8 06 43 ..." — блок = 0x7E8, 29 бит: "18 DA F1 10 ..." — 0x18DAF110;
+  без заголовков — блок 0.
+Многокадровые ответы CAN (первый кадр + последовательные, а без
+заголовков — строки "0:", "1:" ...) склеиваются в одно сообщение; в CAN
+после 43 идёт число кодов, на K-Line его нет, нулевые слова — заполнитель.
+
+Слово DTC (2 байта) само по себе номер кода: текст берётся из таблицы
+на 65536 строк (dtc_table). Результат — DTCBatch из трёх массивов.
+
+python -m ecu_tool.diag.dtc_batch — замер скорости (ответов/с).
+"""
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable
+
+try:
+    import numpy as np
+except ImportError:  # без NumPy пакетный разбор недоступен, parse_obd_dtc работает
+    np = None
+
+SID_DTC = 0x43          # положительный ответ на 03
+SEP, SPACE, COLON, BAD = 16, 17, 18, 19
+_LUT = None
+_TABLE = None
+
+
+def dtc_name(word: int) -> str:
+    """0x0300 -> 'P0300' (та же раскладка битов, что в parse_obd_dtc)."""
+    return f"{'PCBU'[word >> 14]}{word >> 12 & 3:X}{word >> 8 & 0xF:X}{word & 0xFF:02X}"
+
+
+def dtc_table():
+    """Текст всех 65536 кодов: dtc_table()[слово]."""
+    global _TABLE
+    if _TABLE is None:
+        _require_numpy()
+        _TABLE = np.array([dtc_name(w) for w in range(0x10000)], dtype="<U5")
+    return _TABLE
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Для пакетного разбора DTC нужен NumPy (pip install numpy)")
+
+
+def _lut():
+    global _LUT
+    if _LUT is None:
+        lut = np.full(256, BAD, np.uint8)
+        for i, c in enumerate(b"0123456789ABCDEF"):
+            lut[c] = i
+            lut[ord(chr(c).lower())] = i
+        lut[[ord(" "), ord("\t")]] = SPACE
+        lut[ord(":")] = COLON
+        lut[[0, ord("\r"), ord("\n"), ord(">")]] = SEP
+        _LUT = lut
+    return _LUT
+
+
+@dataclass
+class DTCBatch:
+    codes: "np.ndarray"       # uint16: слово DTC (номер в dtc_table)
+    ecus: "np.ndarray"        # uint32: адрес/CAN-ID блока, 0 — без заголовков
+    responses: "np.ndarray"   # uint32: номер ответа во входной последовательности
+    n_responses: int
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def names(self):
+        return dtc_table()[self.codes]
+
+    def per_response(self) -> list[list[str]]:
+        """Коды по ответам — как parse_obd_dtc для каждого (порядок блоков сохраняется)."""
+        out: list[list[str]] = [[] for _ in range(self.n_responses)]
+        for r, name in zip(self.responses.tolist(), self.names().tolist()):
+            out[r].append(name)
+        return out
+
+    def counts(self) -> Counter:
+        words, n = np.unique(self.codes, return_counts=True)
+        return Counter(dict(zip(dtc_table()[words].tolist(), n.tolist())))
+
+
+def decode_dtc_batch(responses: Iterable[str | bytes], sid: int = SID_DTC, dedup: bool = True) -> DTCBatch:
+    """Разобрать много «сырых» ответов адаптера на 03 (или 07/0A — sid 0x47/0x4A) за один проход.
+
+    В журналах один и тот же ответ повторяется тысячи раз (NO DATA, те же
+    коды с того же блока), поэтому при dedup каждый разный ответ
+    разбирается один раз, а результат размножается индексами.
+    """
+    _require_numpy()
+    responses = list(responses)
+    n = len(responses)
+    if dedup and n:
+        index: dict = {}
+        inv = np.fromiter((index.setdefault(r, len(index)) for r in responses), np.int64, n)
+        if len(index) < n:
+            codes, ecus, resp = _decode(list(index), sid)
+            per_uniq = np.bincount(resp, minlength=len(index))
+            n_per = per_uniq[inv]
+            src = np.repeat((np.cumsum(per_uniq) - per_uniq)[inv] - (np.cumsum(n_per) - n_per), n_per)
+            src += np.arange(len(src))
+            return DTCBatch(codes[src], ecus[src], np.repeat(np.arange(n, dtype=np.uint32), n_per), n)
+    return DTCBatch(*_decode(responses, sid), n)
+
+
+def _decode(responses: list, sid: int):
+    """Векторный разбор: (слова DTC, блоки, номера ответов) по возрастанию номера ответа."""
+    if not responses:
+        z = np.zeros(0, np.uint32)
+        return z.astype(np.uint16), z, z
+    if isinstance(responses[0], str):
+        blob = "\0".join(responses).encode("ascii", errors="replace")
+    else:
+        blob = b"\0".join(responses)
+    raw = np.frombuffer(blob, np.uint8)
+    v = _lut()[raw]
+
+    # ---- строки: границы, номер ответа, годность ----
+    is_sep = v == SEP
+    sep_idx = np.flatnonzero(is_sep)
+    n_lines = len(sep_idx) + 1
+    line_start = np.r_[0, sep_idx + 1]
+    resp_of_line = np.zeros(n_lines, np.uint32)
+    resp_of_line[1:] = np.cumsum(raw[sep_idx] == 0)
+    # строка с посторонними символами (NO DATA, BUS INIT, ELM327 v1.5, ...) — не кадр;
+    # таких символов мало, номер строки для них — бинарным поиском по разделителям
+    bad = np.zeros(n_lines, bool)
+    bad[np.searchsorted(sep_idx, np.flatnonzero(v == BAD))] = True
+    colons = np.flatnonzero(v == COLON)
+    colon_pos = np.full(n_lines, -1, np.int64)
+    colon_pos[np.searchsorted(sep_idx, colons)] = colons
+
+    # ---- hex-цифры годных строк; в строках "N:" — только после двоеточия ----
+    is_digit = v < 16
+    if len(colons):
+        is_digit &= np.arange(len(v)) > colon_pos[np.cumsum(is_sep)]
+    d_cnt = np.zeros(n_lines, np.int64)
+    inner = line_start < len(v)           # после завершающего разделителя строки нет
+    if inner.any():
+        d_cnt[inner] = np.add.reduceat(is_digit, line_start[inner], dtype=np.int32)
+    digits = v[is_digit]
+    if bad.any():
+        digits = digits[np.repeat(~bad, d_cnt)]
+        d_cnt[bad] = 0
+    seq = np.full(n_lines, -1, np.int16)                   # номер строки "N:" многокадрового ответа
+    with_colon = np.flatnonzero((colon_pos > 0) & ~bad)
+    seq[with_colon] = v[colon_pos[with_colon] - 1]
+    seq[seq >= 16] = -1
+
+    # ---- нечётное число цифр — впереди 11-битный CAN-ID из трёх цифр ----
+    d_start = np.cumsum(d_cnt) - d_cnt
+    odd = d_cnt % 2 == 1
+    can11 = odd & (seq < 0)
+    header = np.zeros(n_lines, np.uint32)
+    hs = d_start[can11]
+    header[can11] = (digits[hs].astype(np.uint32) << 8) | (digits[hs + 1].astype(np.uint32) << 4) | digits[hs + 2]
+    if odd.any():
+        keep = np.ones(len(digits), bool)
+        for k in range(3):
+            keep[hs + k] = False
+        keep[d_start[odd & ~can11]] = False                   # мусор: лишняя цифра не сдвигает пары
+        digits = digits[keep]
+        d_cnt -= np.where(can11, 3, odd.astype(np.int64))
+    by = (digits[0::2] << 4) | digits[1::2]
+    b_cnt = d_cnt // 2
+
+    # ---- кадры ----
+    lines = np.flatnonzero(b_cnt)
+    start = (np.cumsum(b_cnt) - b_cnt)[lines]
+    cnt = b_cnt[lines]
+    end = start + cnt
+    at = lambda off: by[np.minimum(start + off, len(by) - 1)].astype(np.int64)
+    first, second = at(0), at(1)
+    is_can11 = can11[lines]
+    is_can29 = ~is_can11 & (first == 0x18) & (second == 0xDA) & (cnt >= 5)
+    is_seq = seq[lines] >= 0
+    is_can = is_can11 | is_can29
+    plain = ~is_can & ~is_seq & (first == sid)
+    iso = ~is_can & ~is_seq & ~plain & (cnt >= 5)
+
+    ecu = np.zeros(len(lines), np.uint32)
+    ecu[is_can11] = header[lines[is_can11]]
+    ecu[is_can29] = ((first << 24) | (second << 16) | (at(2) << 8) | at(3))[is_can29].astype(np.uint32)
+    ecu[iso] = at(2)[iso].astype(np.uint32)
+
+    p_start = start.copy()
+    p_end = end.copy()
+    msg_start = plain | iso | (is_seq & (seq[lines] == 0))
+    # ISO 9141/14230: fmt tgt src [len] данные cs
+    iso_hdr = np.where((first & 0x3F) == 0, 4, 3)
+    p_start[iso] += iso_hdr[iso]
+    p_end[iso] -= 1
+    # CAN: PCI — 0x0L одиночный, 0x1L LL первый, 0x2N последовательный
+    pci_off = np.where(is_can29, 4, 0)
+    pci = by[np.minimum(start + pci_off, len(by) - 1)].astype(np.int64)
+    kind = pci >> 4
+    single = is_can & (kind == 0)
+    first_frame = is_can & (kind == 1)
+    consecutive = is_can & (kind == 2)
+    p_start[is_can] += pci_off[is_can] + 1
+    p_start[first_frame] += 1
+    sf_end = p_start + (pci & 0xF)
+    p_end[single] = np.minimum(p_end, sf_end)[single]
+    msg_start |= single | first_frame
+    frame_ok = msg_start | consecutive | (is_seq & (seq[lines] > 0))
+    frame_ok &= p_end > p_start
+    # в CAN после SID идёт число кодов; на K-Line — сразу коды
+    counted = is_can | is_seq
+
+    sel = np.flatnonzero(frame_ok)
+    if consecutive.any() or is_seq.any():
+        # продолжения относятся к началу от того же блока в том же ответе —
+        # упорядочиваем кадры по (ответ, блок), сохраняя порядок внутри
+        sel = sel[np.lexsort((sel, ecu[sel], resp_of_line[lines[sel]]))]
+    f_resp, f_ecu = resp_of_line[lines[sel]], ecu[sel]
+    f_first = msg_start[sel]
+    msg_id = np.cumsum(f_first) - 1
+    valid = msg_id >= 0
+    head = np.flatnonzero(f_first)
+    valid[valid] &= (f_resp[valid] == f_resp[head[msg_id[valid]]]) & (f_ecu[valid] == f_ecu[head[msg_id[valid]]])
+    sel, msg_id = sel[valid], msg_id[valid]
+
+    # ---- байты сообщений подряд ----
+    n_msgs = len(head)
+    seg_len = (p_end - p_start)[sel]
+    m_frame = sel[f_first[valid]]
+    if len(sel) == n_msgs:
+        # все сообщения однокадровые — слова берутся прямо из байтов кадров
+        payload, m_start, m_len = by, p_start[m_frame], seg_len
+    else:
+        total = int(seg_len.sum())
+        seg_off = np.cumsum(seg_len) - seg_len
+        payload = by[np.repeat(p_start[sel] - seg_off, seg_len) + np.arange(total)]
+        m_len = np.bincount(msg_id, weights=seg_len, minlength=n_msgs).astype(np.int64)
+        m_start = np.cumsum(m_len) - m_len
+    last = max(len(payload) - 1, 0)
+    m_counted = counted[m_frame]
+    m_ok = (m_len >= 1) & (payload[np.minimum(m_start, last)] == sid)
+    word_off = np.where(m_counted, 2, 1)
+    n_words = np.maximum(m_len - word_off, 0) // 2
+    declared = payload[np.minimum(m_start + 1, last)].astype(np.int64)
+    n_words = np.where(m_counted, np.minimum(n_words, declared), n_words)
+    n_words[~m_ok] = 0
+
+    # ---- слова DTC ----
+    w_msg = np.repeat(np.arange(n_msgs), n_words)
+    w_k = np.arange(len(w_msg)) - np.repeat(np.cumsum(n_words) - n_words, n_words)
+    w_at = m_start[w_msg] + word_off[w_msg] + 2 * w_k
+    words = (payload[w_at].astype(np.uint16) << 8) | payload[w_at + 1]
+    nz = words != 0
+    m_line = lines[m_frame]
+    return words[nz], ecu[m_frame][w_msg[nz]], resp_of_line[m_line][w_msg[nz]]
+
+
+def _benchmark(n: int = 1_000_000) -> None:
+    import time
+    try:
+        from .dtc import parse_obd_dtc
+    except ImportError:
+        from diag.dtc import parse_obd_dtc
+    samples = [
+        "43 01 71 03 00 00 00\r\r>",                                    # K-Line без заголовков
+        "48 6B 10 43 01 71 01 72 03 00 5B\r48 6B 18 43 04 20 00 00 00 00 E6\r\r>",   # два блока
+        "430171030000\r\r>",                                            # ATS0
+        "NO DATA\r\r>",
+        "7E8 06 43 02 01 71 03 00\r7E9 02 43 00\r\r>",                  # CAN, два блока
+        "7E8 10 0A 43 04 01 71 03\r7E8 21 00 04 20 01 01 00\r\r>",      # CAN, два кадра
+    ]
+    data = [samples[i % len(samples)] for i in range(n)]
+    rng = np.random.default_rng(1)
+    words = rng.integers(1, 0x10000, size=(n, 3))
+    distinct = [f"43 {a >> 8:02X} {a & 0xFF:02X} {b >> 8:02X} {b & 0xFF:02X} {c >> 8:02X} {c & 0xFF:02X}\r\r>"
+                for a, b, c in words.tolist()]
+    for title, batch_in in (("повторяющиеся", data), ("все разные", distinct)):
+        t0 = time.perf_counter()
+        batch = decode_dtc_batch(batch_in)
+        dt = time.perf_counter() - t0
+        print(f"{title}: {n / dt / 1e6:.2f} млн ответов/с ({dt:.2f} с на {n}), кодов: {len(batch)}")
+    k = 100_000
+    t0 = time.perf_counter()
+    for s in data[:k]:
+        parse_obd_dtc(s)
+    dt = time.perf_counter() - t0
+    print(f"parse_obd_dtc: {k / dt / 1e6:.2f} млн ответов/с")
+    for s, codes in zip(samples, decode_dtc_batch(samples).per_response()):
+        print(f"  {s.strip()!r:70} -> {codes}")
+
+
+if __name__ == "__main__":
+    _benchmark()
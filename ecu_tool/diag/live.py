@@ -0,0 +1,448 @@
+# diag/live.py
+"""
+Живые данные: опрос параметров двигателя на ходу.
+
+Источники:
+  obd — OBD-II режим 01 (PID). На CAN (ISO 15765-4) в одном запросе
+        до OBD_BATCH PID-ов ("01 0C 0D 11 ..."); ЭБУ отвечает одним кадром
+        или кадром на PID. На K-Line (ISO 9141 / 14230) так нельзя — там
+        по одному PID. Если ЭБУ на запрос из нескольких PID-ов ответил
+        только на часть или не ответил вовсе — тоже переходим на один.
+  kwp — KWP2000 0x21 readDataByLocalIdentifier: один запрос приносит
+        весь блок параметров, раскладка — в KWP_SIGNALS.
+
+У каждого параметра свой период опроса: обороты, дроссель, расход
+воздуха — каждый проход, температуры и напряжение — раз в секунду.
+В запрос попадают только параметры, чей срок подошёл.
+
+Отсчёты (время, номер параметра, значение) копятся в SampleRing —
+три столбца NumPy фиксированного размера — и пачками сбрасываются
+в файл .edl:
+  заголовок  "EDLG", версия (1 байт), время начала (unix, double),
+             длина JSON (4 байта), JSON со списком параметров
+  пачка      n (4 байта), t[n] float64, номер[n] uint16, значение[n] float32
+Столбцы внутри пачки лежат подряд — read_datalog читает их через
+numpy.frombuffer без разбора по строкам.
+"""
+from __future__ import annotations
+import json
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # без NumPy живые данные недоступны, остальное работает
+    np = None
+
+try:
+    from ..ecu_transport.kwp_parse import iter_frames
+    from ..ecu_transport.kwp2000 import KWP2000
+    from ..ecu_transport.session import KWPSession
+except ImportError:
+    from ecu_transport.kwp_parse import iter_frames
+    from ecu_transport.kwp2000 import KWP2000
+    from ecu_transport.session import KWPSession
+
+FAST, MEDIUM, SLOW = 0.0, 0.25, 1.0   # периоды опроса, с (0 — каждый проход)
+OBD_BATCH = 6                        # PID-ов в одном запросе режима 01 (предел ISO 15765-4, только CAN)
+RING_CAPACITY = 1 << 16              # отсчётов в кольце
+FLUSH_EVERY = 4096                   # сбрасывать в файл пачками по столько отсчётов
+
+DATALOG_MAGIC = b"EDLG"
+DATALOG_VERSION = 1
+_HEADER = struct.Struct("<4sBdI")
+_BLOCK = struct.Struct("<I")
+
+
+@dataclass(frozen=True)
+class Signal:
+    name: str
+    unit: str
+    source: str           # "obd" | "kwp"
+    pid: int              # PID режима 01 или локальный идентификатор 0x21
+    size: int = 1         # байт на значение (big-endian, без знака)
+    scale: float = 1.0    # значение = сырое * scale + offset
+    offset: float = 0.0
+    pos: int = 0          # kwp: смещение значения в блоке ответа
+    period: float = FAST
+
+    def decode(self, raw) -> float:
+        return int.from_bytes(raw, "big") * self.scale + self.offset
+
+    def encode(self, value: float) -> bytes:
+        raw = round((value - self.offset) / self.scale)
+        return max(0, min(raw, (1 << 8 * self.size) - 1)).to_bytes(self.size, "big")
+
+
+OBD_SIGNALS = [
+    Signal("rpm", "об/мин", "obd", 0x0C, 2, 0.25),
+    Signal("throttle", "%", "obd", 0x11, 1, 100 / 255),
+    Signal("load", "%", "obd", 0x04, 1, 100 / 255),
+    Signal("maf", "г/с", "obd", 0x10, 2, 0.01),
+    Signal("map", "кПа", "obd", 0x0B),
+    Signal("advance", "°", "obd", 0x0E, 1, 0.5, -64),
+    Signal("speed", "км/ч", "obd", 0x0D, period=MEDIUM),
+    Signal("stft", "%", "obd", 0x06, 1, 100 / 128, -100, period=MEDIUM),
+    Signal("coolant", "°C", "obd", 0x05, 1, 1, -40, period=SLOW),
+    Signal("iat", "°C", "obd", 0x0F, 1, 1, -40, period=SLOW),
+    Signal("voltage", "В", "obd", 0x42, 2, 0.001, period=SLOW),
+]
+
+# блоки 0x21 (раскладка J7.2 в эмуляторе): 0x02 — быстрые, 0x01 — медленные
+KWP_SIGNALS = [
+    Signal("rpm", "об/мин", "kwp", 0x02, 2, 0.25, pos=0),
+    Signal("throttle", "%", "kwp", 0x02, 1, 100 / 255, pos=2),
+    Signal("load", "%", "kwp", 0x02, 1, 100 / 255, pos=3),
+    Signal("maf", "г/с", "kwp", 0x02, 2, 0.01, pos=4),
+    Signal("map", "кПа", "kwp", 0x02, pos=6),
+    Signal("advance", "°", "kwp", 0x02, 1, 0.5, -64, pos=7),
+    Signal("speed", "км/ч", "kwp", 0x01, pos=0, period=MEDIUM),
+    Signal("coolant", "°C", "kwp", 0x01, 1, 1, -40, pos=1, period=MEDIUM),
+    Signal("iat", "°C", "kwp", 0x01, 1, 1, -40, pos=2, period=MEDIUM),
+    Signal("voltage", "В", "kwp", 0x01, 1, 0.1, pos=3, period=MEDIUM),
+]
+
+
+def signal_table(source: str) -> list[Signal]:
+    return {"obd": OBD_SIGNALS, "kwp": KWP_SIGNALS}[source]
+
+
+def select_signals(source: str, names: list[str] | None = None) -> list[Signal]:
+    table = signal_table(source)
+    if not names:
+        return list(table)
+    by_name = {s.name: s for s in table}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        raise ValueError(f"Неизвестные параметры: {', '.join(unknown)} (есть: {', '.join(by_name)})")
+    return [by_name[n] for n in names]
+
+
+# ---------- кольцевой буфер ----------
+class SampleRing:
+    """
+    Последние capacity отсчётов в трёх столбцах NumPy. head — сколько
+    отсчётов записано всего, flushed — сколько из них уже в файле; если
+    файл не успевает, старые отсчёты затираются и считаются в dropped.
+    """
+    def __init__(self, capacity: int = RING_CAPACITY):
+        if np is None:
+            raise RuntimeError("Для живых данных нужен NumPy (pip install numpy)")
+        self.capacity = capacity
+        self.t = np.zeros(capacity, np.float64)
+        self.sig = np.zeros(capacity, np.uint16)
+        self.value = np.zeros(capacity, np.float32)
+        self.head = 0
+        self.flushed = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return min(self.head, self.capacity)
+
+    @property
+    def pending(self) -> int:
+        return self.head - self.flushed
+
+    def append(self, t: float, sig: list[int], values: list[float]) -> None:
+        n = len(sig)
+        i = self.head % self.capacity
+        first = min(n, self.capacity - i)
+        self.t[i:i + first] = t
+        self.sig[i:i + first] = sig[:first]
+        self.value[i:i + first] = values[:first]
+        if first < n:
+            rest = n - first
+            self.t[:rest] = t
+            self.sig[:rest] = sig[first:]
+            self.value[:rest] = values[first:]
+        self.head += n
+        if self.pending > self.capacity:
+            self.dropped += self.pending - self.capacity
+            self.flushed = self.head - self.capacity
+
+    def window(self, start: int, stop: int):
+        """Отсчёты [start, stop) по сквозной нумерации — (t, sig, value), копии."""
+        a, b = start % self.capacity, stop % self.capacity
+        if stop - start == 0:
+            idx = slice(0, 0)
+        elif a < b:
+            idx = slice(a, b)
+        else:
+            idx = np.r_[a:self.capacity, 0:b]
+        return self.t[idx].copy(), self.sig[idx].copy(), self.value[idx].copy()
+
+    def latest(self):
+        return self.window(self.head - len(self), self.head)
+
+    def flush(self, writer: "DatalogWriter") -> int:
+        n = self.pending
+        if n:
+            writer.write(*self.window(self.flushed, self.head))
+            self.flushed = self.head
+        return n
+
+
+# ---------- файл .edl ----------
+class DatalogWriter:
+    def __init__(self, path: Path, signals: list[Signal], started: float | None = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        meta = json.dumps([{"name": s.name, "unit": s.unit, "source": s.source, "pid": s.pid}
+                           for s in signals], ensure_ascii=False).encode("utf-8")
+        self._f = open(self.path, "wb")
+        self._f.write(_HEADER.pack(DATALOG_MAGIC, DATALOG_VERSION,
+                                   time.time() if started is None else started, len(meta)))
+        self._f.write(meta)
+        self.samples = 0
+
+    def write(self, t, sig, value) -> None:
+        self._f.write(_BLOCK.pack(len(t)))
+        self._f.write(t.astype(np.float64, copy=False).tobytes())
+        self._f.write(sig.astype(np.uint16, copy=False).tobytes())
+        self._f.write(value.astype(np.float32, copy=False).tobytes())
+        self._f.flush()
+        self.samples += len(t)
+
+    def close(self) -> None:
+        if not self._f.closed:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@dataclass
+class Datalog:
+    started: float
+    signals: list[dict]
+    t: "np.ndarray"
+    sig: "np.ndarray"
+    value: "np.ndarray"
+
+    def series(self, name: str):
+        """(время, значения) одного параметра."""
+        i = [s["name"] for s in self.signals].index(name)
+        mask = self.sig == i
+        return self.t[mask], self.value[mask]
+
+
+def read_datalog(path: Path) -> Datalog:
+    if np is None:
+        raise RuntimeError("Для живых данных нужен NumPy (pip install numpy)")
+    raw = Path(path).read_bytes()
+    if len(raw) < _HEADER.size:
+        raise ValueError("Файл живых данных обрезан")
+    magic, version, started, meta_len = _HEADER.unpack_from(raw)
+    if magic != DATALOG_MAGIC or version != DATALOG_VERSION:
+        raise ValueError("Это не файл живых данных или неизвестная версия формата")
+    pos = _HEADER.size
+    signals = json.loads(raw[pos:pos + meta_len].decode("utf-8"))
+    pos += meta_len
+    ts, sigs, values = [], [], []
+    while pos + _BLOCK.size <= len(raw):
+        (n,) = _BLOCK.unpack_from(raw, pos)
+        pos += _BLOCK.size
+        if pos + n * 14 > len(raw):
+            break   # последняя пачка недописана (обрыв) — отбрасываем
+        ts.append(np.frombuffer(raw, np.float64, n, pos))
+        sigs.append(np.frombuffer(raw, np.uint16, n, pos + n * 8))
+        values.append(np.frombuffer(raw, np.float32, n, pos + n * 10))
+        pos += n * 14
+    cat = lambda parts, dt: np.concatenate(parts) if parts else np.zeros(0, dt)
+    return Datalog(started, signals, cat(ts, np.float64), cat(sigs, np.uint16), cat(values, np.float32))
+
+
+# ---------- опрос ----------
+@dataclass
+class _Request:
+    source: str
+    pid: int                   # kwp: локальный идентификатор
+    signals: list[int] = field(default_factory=list)   # номера параметров в LiveLogger.signals
+
+
+class LiveLogger:
+    def __init__(self, elm, signals: list[Signal], ring: SampleRing | None = None,
+                 batch: int = OBD_BATCH, kwp: KWP2000 | None = None):
+        self.elm = elm
+        self.signals = list(signals)
+        self.ring = ring or SampleRing()
+        self.batch = max(1, min(batch, OBD_BATCH))
+        self.kwp = kwp
+        self.session: KWPSession | None = None
+        self.requests = 0
+        self.errors = 0
+        self.counts = [0] * len(self.signals)
+        self.last: dict[str, float] = {}
+        self._obd_size = {s.pid: s.size for s in self.signals if s.source == "obd"}
+        self._next_due = [0.0] * len(self.signals)
+        self._t0 = time.monotonic()
+        self._headers: bool | None = None   # заголовки в ответах 01: None — узнавать по кадру
+
+    # ---------- подготовка ----------
+    def start(self) -> None:
+        """Открыть сессию для kwp и убрать PID-ы, которых ЭБУ не поддерживает."""
+        if any(s.source == "kwp" for s in self.signals):
+            self.kwp = self.kwp or KWP2000(self.elm)
+            # опрос непрерывный — S3 не истечёт, keepalive не нужен
+            self.session = KWPSession(self.kwp, keepalive=None)
+            self.session.open()
+        obd = [s for s in self.signals if s.source == "obd"]
+        if obd:
+            protocol = self._protocol()
+            if "CAN" not in protocol:
+                self.batch = 1
+            if "9141" in protocol or "14230" in protocol:
+                # K-Line с ATH1: в каждом кадре заголовок и контрольная сумма
+                self._headers = True
+            supported = self.supported_pids({s.pid for s in obd})
+            if supported is not None:
+                self.signals = [s for s in self.signals if s.source != "obd" or s.pid in supported]
+                self.counts = [0] * len(self.signals)
+                self._next_due = [0.0] * len(self.signals)
+
+    def _protocol(self) -> str:
+        """
+        ATDP адаптера. Несколько PID-ов в одном запросе 01 — только на CAN;
+        неизвестный протокол (старая запись, чужой адаптер) — "", по одному PID.
+        """
+        try:
+            return self.elm.describe_protocol().upper()
+        except (RuntimeError, AttributeError):
+            return ""
+
+    def supported_pids(self, wanted: set[int]) -> set[int] | None:
+        """PID-ы режима 01 по битовым картам 0100/0120/0140; None — ЭБУ карту не отдал."""
+        supported: set[int] = set()
+        for base in range(0, max(wanted), 0x20):
+            data = self._obd_frames(f"01 {base:02X}")
+            bitmap = next((f[2:6] for f in data if len(f) >= 6 and f[1] == base), None)
+            if bitmap is None:
+                return None if base == 0 else supported
+            bits = int.from_bytes(bitmap, "big")
+            supported |= {base + i for i in range(1, 33) if bits >> (32 - i) & 1}
+            if not bits & 1:   # последний бит — есть ли следующая карта
+                break
+        return supported
+
+    # ---------- планировщик ----------
+    def _plan(self, now: float) -> list[_Request]:
+        due = [i for i, t in enumerate(self._next_due) if t <= now]
+        due.sort(key=lambda i: self._next_due[i])    # самые просроченные — первыми
+        plan: list[_Request] = []
+        kwp_blocks: dict[int, _Request] = {}
+        obd: list[int] = []
+        for i in due:
+            s = self.signals[i]
+            if s.source == "kwp":
+                kwp_blocks.setdefault(s.pid, _Request("kwp", s.pid))
+            else:
+                obd.append(i)
+        for lid, req in kwp_blocks.items():
+            # блок приходит целиком — пишем все его параметры, не только просроченные
+            req.signals = [i for i, s in enumerate(self.signals) if s.source == "kwp" and s.pid == lid]
+            plan.append(req)
+        for k in range(0, len(obd), self.batch):
+            plan.append(_Request("obd", 0x01, obd[k:k + self.batch]))
+        return plan
+
+    def poll(self) -> int:
+        """Один проход: все запросы, чей срок подошёл. Вернуть число новых отсчётов."""
+        now = time.monotonic()
+        plan = self._plan(now)
+        if not plan:
+            time.sleep(max(0.0, min(self._next_due) - now))
+            return 0
+        samples = 0
+        for req in plan:
+            self.requests += 1
+            try:
+                got = self._read_kwp(req) if req.source == "kwp" else self._read_obd(req)
+            except RuntimeError:
+                got = {}
+            if not got:
+                self.errors += 1
+            t = time.monotonic()
+            for i in req.signals:
+                # без ответа — повторим на следующем проходе, не дожидаясь периода
+                if i in got:
+                    self._next_due[i] = t + self.signals[i].period
+                    self.counts[i] += 1
+                    self.last[self.signals[i].name] = got[i]
+            if got:
+                self.ring.append(t - self._t0, list(got), list(got.values()))
+                samples += len(got)
+        return samples
+
+    def _obd_frames(self, req: str) -> list[memoryview]:
+        resp = self.elm.send_obd(req)
+        return [f for f in iter_frames(resp, self._headers) if len(f) >= 2 and f[0] == 0x41]
+
+    def _read_obd(self, req: _Request) -> dict[int, float]:
+        by_pid = {self.signals[i].pid: i for i in req.signals}
+        out: dict[int, float] = {}
+        for frame in self._obd_frames("01 " + " ".join(f"{p:02X}" for p in by_pid)):
+            pos = 1
+            while pos < len(frame):
+                pid = frame[pos]
+                size = self._obd_size.get(pid)
+                if size is None or pos + 1 + size > len(frame):
+                    break
+                if pid in by_pid:
+                    i = by_pid[pid]
+                    out[i] = self.signals[i].decode(frame[pos + 1:pos + 1 + size])
+                pos += 1 + size
+        if len(out) < len(by_pid) and len(by_pid) > 1 and self.batch > 1:
+            # ЭБУ ответил только на часть PID-ов или NO DATA на весь запрос —
+            # несколько в одном запросе он не умеет; недополученные спросим по одному
+            self.batch = 1
+        return out
+
+    def _read_kwp(self, req: _Request) -> dict[int, float]:
+        block = self.session.call(self.kwp.read_local_id, req.pid)
+        out: dict[int, float] = {}
+        for i in req.signals:
+            s = self.signals[i]
+            if s.pos + s.size <= len(block):
+                out[i] = s.decode(block[s.pos:s.pos + s.size])
+        return out
+
+    # ---------- запуск ----------
+    def run(self, duration: float | None = None, writer: DatalogWriter | None = None,
+            stop: threading.Event | None = None, flush_every: int = FLUSH_EVERY) -> dict:
+        """Опрашивать duration секунд (None — до stop или Ctrl+C); вернуть сводку."""
+        self._t0 = t0 = time.monotonic()
+        try:
+            while (duration is None or time.monotonic() - t0 < duration) and not (stop and stop.is_set()):
+                self.poll()
+                if writer and self.ring.pending >= flush_every:
+                    self.ring.flush(writer)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if writer:
+                self.ring.flush(writer)
+            if self.session:
+                self.session.close()
+        return self.summary(time.monotonic() - t0)
+
+    def summary(self, elapsed: float) -> dict:
+        samples = sum(self.counts)
+        per_s = lambda n: round(n / elapsed, 1) if elapsed > 0 else 0.0
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "samples": samples,
+            "samples_per_s": per_s(samples),
+            "requests_per_s": per_s(self.requests),
+            "batch": self.batch,
+            "dropped": self.ring.dropped,
+            "signals": {s.name: {"unit": s.unit, "count": n, "per_s": per_s(n), "last": self.last.get(s.name)}
+                        for s, n in zip(self.signals, self.counts)},
+        }
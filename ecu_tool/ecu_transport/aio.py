@@ -0,0 +1,192 @@
+# ecu_transport/aio.py
+"""
+Асинхронный транспорт: AsyncELM327 / AsyncKWP2000 на asyncio.
+
+Порт открывается неблокирующим (timeout=0), чтение идёт по готовности
+дескриптора (loop.add_reader) — один цикл событий обслуживает стенд
+из 8–16 адаптеров без потоков. Где add_reader для порта недоступен
+(Windows), блокирующее чтение уходит в пул потоков.
+
+Команды к одному адаптеру выстраиваются в очередь (asyncio.Lock — FIFO),
+у каждой свой таймаут, как в ELM327. AsyncKWP2000 — те же запросы,
+проверки ответов, повторы и ожидание 7F xx 78, что у KWP2000
+(общее — в KWPServices и RequestExecutor), только с await.
+"""
+from __future__ import annotations
+import asyncio
+import time
+
+import serial
+
+try:
+    from .elm327 import (PROMPT, AT_TIMEOUT, RESET_TIMEOUT, ECU_TIMEOUT, BUS_INIT_TIMEOUT,
+                         INIT_COMMANDS)
+    from .kwp2000 import KWPServices
+    from .kwp_parse import is_pending
+    from .metrics import LINK_STATS
+except ImportError:
+    from ecu_transport.elm327 import (PROMPT, AT_TIMEOUT, RESET_TIMEOUT, ECU_TIMEOUT, BUS_INIT_TIMEOUT,
+                                      INIT_COMMANDS)
+    from ecu_transport.kwp2000 import KWPServices
+    from ecu_transport.kwp_parse import is_pending
+    from ecu_transport.metrics import LINK_STATS
+
+
+class AsyncELM327:
+    def __init__(self, port: str, baudrate: int = 38400,
+                 at_timeout: float = AT_TIMEOUT, ecu_timeout: float = ECU_TIMEOUT):
+        self.port = port
+        self.baudrate = baudrate
+        self.at_timeout = at_timeout
+        self.ecu_timeout = ecu_timeout
+        self.ser: serial.Serial | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = asyncio.Lock()
+        self._buf = bytearray()
+        self._waiter: asyncio.Future | None = None
+        self._reader = False      # чтение через add_reader (иначе — пул потоков)
+        self._bus_ready = False
+        self.queued = 0           # команд ждут своей очереди
+
+    async def open(self) -> "AsyncELM327":
+        self._loop = asyncio.get_running_loop()
+        self.ser = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=0)
+        try:
+            self._loop.add_reader(self.ser.fileno(), self._on_readable)
+            self._reader = True
+        except (NotImplementedError, AttributeError, ValueError):
+            self._reader = False
+        return self
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _on_readable(self) -> None:
+        try:
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+        except serial.SerialException as e:
+            if self._waiter and not self._waiter.done():
+                self._waiter.set_exception(e)
+            return
+        if not chunk:
+            return
+        self._buf += chunk
+        if self._waiter and not self._waiter.done() and self._buf.rstrip().endswith(PROMPT):
+            self._waiter.set_result(None)
+
+    def _read_blocking(self, timeout: float) -> None:
+        # запасной путь (пул потоков): та же логика, что у ELM327._read_until_prompt
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.ser.timeout = max(0.0, deadline - time.monotonic())
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+            if chunk:
+                self._buf += chunk
+                if self._buf.rstrip().endswith(PROMPT):
+                    break
+        self.ser.timeout = 0
+
+    async def _command(self, cmd: str, timeout: float) -> str:
+        """Отправить команду и дождаться '>' (или таймаута). Команды адаптеру — строго по очереди."""
+        self.queued += 1
+        async with self._lock:
+            self.queued -= 1
+            t0 = time.perf_counter()
+            self.ser.reset_input_buffer()
+            self._buf.clear()
+            self.ser.write((cmd.rstrip("\r") + "\r").encode("ascii", errors="ignore"))
+            out = await self._wait_prompt(timeout)
+            LINK_STATS.record_adapter(cmd, time.perf_counter() - t0, out)
+            return out
+
+    async def _wait_prompt(self, timeout: float) -> str:
+        """Дождаться '>' (или таймаута) и забрать накопленное; вызывается под self._lock."""
+        if not self._buf.rstrip().endswith(PROMPT):
+            if self._reader:
+                self._waiter = self._loop.create_future()
+                try:
+                    await asyncio.wait_for(self._waiter, timeout)
+                except asyncio.TimeoutError:
+                    pass   # как в ELM327: отдаём то, что успело прийти
+                finally:
+                    self._waiter = None
+            else:
+                await self._loop.run_in_executor(None, self._read_blocking, timeout)
+        out = self._buf.decode(errors="ignore")
+        self._buf.clear()
+        return out
+
+    async def read_pending(self, timeout: float) -> str:
+        """Дочитать ответ без новой команды (после 7F xx 78), как ELM327.read_pending."""
+        async with self._lock:
+            return await self._wait_prompt(timeout)
+
+    async def _request(self, data_hex: str) -> str:
+        timeout = self.ecu_timeout if self._bus_ready else BUS_INIT_TIMEOUT
+        resp = await self._command(data_hex, timeout)
+        self._bus_ready = True
+        return resp
+
+    async def init(self) -> str:
+        last = ""
+        for cmd in INIT_COMMANDS:
+            last = await self._command(cmd, RESET_TIMEOUT if cmd == "ATZ" else self.at_timeout)
+        self._bus_ready = False
+        return last
+
+    async def send_obd(self, data_hex: str) -> str:
+        return await self._request(data_hex)
+
+    async def send_at(self, cmd: str, timeout: float | None = None) -> str:
+        """Произвольная AT-команда (ATI, ATRV, ...)."""
+        return await self._command(cmd, self.at_timeout if timeout is None else timeout)
+
+    async def set_header(self, header: str) -> str:
+        return await self._command(f"AT SH {header}", self.at_timeout)
+
+    async def send_raw(self, data_hex: str) -> str:
+        return await self._request(data_hex)
+
+    async def close(self) -> None:
+        if self.ser is None:
+            return
+        if self._reader:
+            self._loop.remove_reader(self.ser.fileno())
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        self.ser = None
+
+
+class AsyncKWP2000(KWPServices):
+    """Те же запросы, что у KWP2000, поверх AsyncELM327: методы KWPServices возвращают корутины."""
+    async def _call(self, req: str, positive: tuple[int, ...], what: str, post=None):
+        return await self.executor.run_async(self._attempt, req, positive, what, post)
+
+    async def _attempt(self, req: str, positive: tuple[int, ...], what: str, post=None):
+        with LINK_STATS.measure("kwp", req) as sample:
+            resp = await self._await_pending(req, await self.t.send_raw(req), what)
+            data = self._parse(resp)
+            sample.rx = len(data)
+            data = self._expect(data, resp, positive, what)
+            return post(data) if post else data
+
+    async def _await_pending(self, req: str, resp: str, what: str) -> str:
+        if not is_pending(resp):
+            return resp
+        steps = self._pending_steps(resp, what, hasattr(self.t, "read_pending"))
+        try:
+            action, arg = next(steps)
+            while True:
+                if action == "read":
+                    resp = await self.t.read_pending(arg)
+                else:
+                    await asyncio.sleep(arg)
+                    resp = await self.t.send_raw(req)
+                action, arg = steps.send(resp)
+        except StopIteration as done:
+            return done.value
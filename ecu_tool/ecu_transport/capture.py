@@ -0,0 +1,177 @@
+# ecu_transport/capture.py
+"""
+Запись обмена с адаптером и воспроизведение без машины.
+
+Файл захвата (.ecap), little-endian:
+  заголовок  "ECAP", версия (1 байт), время начала (unix, double)
+  запись     направление (1 байт: 0 — TX, 1 — RX), время от начала (double, с,
+             по monotonic), длина (4 байта), байты команды/ответа как есть
+
+CaptureWriter подключается к ELM327(capture=...) и пишет каждую команду
+и ответ на неё. ReplayELM327 подставляется вместо ELM327: отдаёт
+записанные ответы (с исходными задержками или сразу), так что KWP2000,
+parse_obd_dtc и dump_firmware можно гонять на записи из поля.
+"""
+from __future__ import annotations
+import struct
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+try:
+    from .elm327 import ELM327, OBD_HEADER
+    from .metrics import LINK_STATS
+except ImportError:
+    from ecu_transport.elm327 import ELM327, OBD_HEADER
+    from ecu_transport.metrics import LINK_STATS
+
+CAPTURE_MAGIC = b"ECAP"
+CAPTURE_VERSION = 1
+_HEADER = struct.Struct("<4sBd")
+_RECORD = struct.Struct("<BdI")
+TX, RX = 0, 1
+
+
+class CaptureWriter:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "wb")
+        self._t0 = time.monotonic()
+        self._f.write(_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, time.time()))
+        self.records = 0
+
+    def write(self, direction: int, data: bytes, t: float | None = None) -> None:
+        t = (time.monotonic() if t is None else t) - self._t0
+        self._f.write(_RECORD.pack(direction, t, len(data)))
+        self._f.write(data)
+        self.records += 1
+
+    def tx(self, cmd: str, t: float | None = None) -> None:
+        self.write(TX, cmd.encode("ascii", errors="ignore"), t)
+
+    def rx(self, resp: str, t: float | None = None) -> None:
+        self.write(RX, resp.encode("ascii", errors="ignore"), t)
+        # запись из поля не должна теряться при падении — сбрасываем после каждого ответа
+        self._f.flush()
+
+    def close(self) -> None:
+        if not self._f.closed:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    direction: int
+    t: float
+    data: bytes
+
+
+def read_capture(path: Path) -> tuple[float, list[CaptureRecord]]:
+    """(время начала, записи) из файла захвата."""
+    raw = Path(path).read_bytes()
+    if len(raw) < _HEADER.size:
+        raise ValueError("Файл захвата обрезан")
+    magic, version, started = _HEADER.unpack_from(raw)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise ValueError("Это не файл захвата или неизвестная версия формата")
+    records, pos = [], _HEADER.size
+    while pos + _RECORD.size <= len(raw):
+        direction, t, size = _RECORD.unpack_from(raw, pos)
+        pos += _RECORD.size
+        if pos + size > len(raw):
+            break   # последняя запись недописана (обрыв) — отбрасываем
+        records.append(CaptureRecord(direction, t, raw[pos:pos + size]))
+        pos += size
+    return started, records
+
+
+def exchanges(records: list[CaptureRecord]) -> list[tuple[str, str, float]]:
+    """
+    Пары (команда, ответ, задержка ответа, с) по порядку. Ответ, дочитанный
+    без новой команды (ELM327.read_pending после 7F xx 78), приклеивается
+    к предыдущему.
+    """
+    out, pending = [], None
+    for r in records:
+        if r.direction == TX:
+            pending = r
+        elif pending is not None:
+            out.append((pending.data.decode("ascii", errors="ignore"),
+                        r.data.decode("ascii", errors="ignore"), r.t - pending.t))
+            last_tx, pending = pending, None
+        elif out:
+            cmd, resp, _ = out[-1]
+            out[-1] = (cmd, resp + r.data.decode("ascii", errors="ignore"), r.t - last_tx.t)
+    return out
+
+
+class ReplayError(RuntimeError):
+    """В записи нет ответа на такую команду."""
+
+
+class ReplayELM327(ELM327):
+    """
+    Вместо адаптера — записанный обмен.
+    strict=True — команды должны идти ровно в записанном порядке;
+    иначе ответ ищется по тексту команды (первый ещё не выданный, потом
+    последний), так что чтение с другим порядком блоков тоже проигрывается.
+    realtime=True — ответ выдаётся с исходной задержкой.
+    """
+    def __init__(self, path: Path, realtime: bool = False, strict: bool = False):
+        # порт не открываем: всё берётся из записи
+        self.port = f"replay:{Path(path).name}"
+        self.capture = None
+        self.realtime = realtime
+        self.strict = strict
+        self._bus_ready = False
+        self.header = OBD_HEADER
+        self.at_timeout = self.ecu_timeout = 0.0
+        _, records = read_capture(path)
+        self._seq = deque(exchanges(records))
+        self._by_cmd: dict[str, deque] = {}
+        self._last: dict[str, tuple[str, float]] = {}
+        for cmd, resp, dt in self._seq:
+            self._by_cmd.setdefault(self._key(cmd), deque()).append((resp, dt))
+
+    @staticmethod
+    def _key(cmd: str) -> str:
+        return cmd.replace(" ", "").strip().upper()
+
+    def _next(self, cmd: str) -> tuple[str, float]:
+        key = self._key(cmd)
+        if self.strict:
+            if not self._seq:
+                raise ReplayError(f"Запись закончилась, команда {cmd!r}")
+            rec_cmd, resp, dt = self._seq.popleft()
+            if self._key(rec_cmd) != key:
+                raise ReplayError(f"Ожидалась команда {rec_cmd!r}, пришла {cmd!r}")
+            return resp, dt
+        queue = self._by_cmd.get(key)
+        if queue:
+            self._last[key] = queue.popleft()
+        if key not in self._last:
+            raise ReplayError(f"В записи нет ответа на {cmd!r}")
+        return self._last[key]
+
+    def _command(self, cmd: str, timeout: float) -> str:
+        t0 = time.perf_counter()
+        resp, dt = self._next(cmd)
+        if self.realtime:
+            time.sleep(max(0.0, dt - (time.perf_counter() - t0)))
+        LINK_STATS.record_adapter(cmd, time.perf_counter() - t0, resp)
+        return resp
+
+    def read_pending(self, timeout: float) -> str:
+        # дочитанное при записи уже приклеено к ответу (см. exchanges)
+        return ""
+
+    def close(self):
+        pass
@@ -1,33 +1,91 @@
 import time
+from contextlib import contextmanager
+
 import serial
 
+try:
+    from .metrics import LINK_STATS
+except ImportError:
+    from ecu_transport.metrics import LINK_STATS
+
+PROMPT = b">"
+
+# Сколько ждать приглашения ">" (с). Ответ обычно приходит раньше —
+# читаем ровно до ">", так что запас в таймаутах скорость не съедает.
+AT_TIMEOUT = 0.5        # AT-команды адаптер выполняет сам
+RESET_TIMEOUT = 2.0     # ATZ: перезагрузка адаптера ~1 с
+# Запрос к ЭБУ: собственный таймаут ELM (ATST, по умолчанию ~200 мс) +
+# P2max ЭБУ (50 мс) + передача кадра до 255 байт на 10400 бод (~250 мс)
+ECU_TIMEOUT = 0.6
+BUS_INIT_TIMEOUT = 6.0  # первый запрос после ATSP: адаптер делает 5-бод инициализацию K-Line
+
+INIT_COMMANDS = ("ATZ", "ATE0", "ATL0", "ATS0", "ATH1", "ATSP 3")
+OBD_HEADER = "68 6A F1"   # функциональный запрос OBD по ISO 9141-2 — заголовок после ATZ
+KWP_HEADER = "81 10 F1"   # физический адрес ЭБУ для KWP2000
+
+
 class ELM327:
     """
     Минимальный слой для ELM327-совместимого адаптера.
     Протокол: ISO 9141-2 (SP=3). Подходит для быстрого старта с K-Line.
     """
 
-    def __init__(self, port: str, baudrate: int = 38400, timeout: float = 1.0):
+    def __init__(self, port: str, baudrate: int = 38400, timeout: float = 1.0,
+                 at_timeout: float = AT_TIMEOUT, ecu_timeout: float = ECU_TIMEOUT, capture=None):
         self.port = port
+        self.capture = capture  # capture.CaptureWriter: писать весь обмен в файл
         self.ser = serial.Serial(port=port, baudrate=baudrate, timeout=timeout)
+        self.at_timeout = at_timeout
+        self.ecu_timeout = ecu_timeout
+        self._bus_ready = False  # была ли уже инициализация шины (первый запрос к ЭБУ)
+        self.header = OBD_HEADER  # текущий AT SH: OBD и KWP ходят по разным адресам
 
     def _write(self, cmd: str):
         if not cmd.endswith("\r"):
             cmd += "\r"
+        # хвост ответа на прошлую команду (после таймаута) не должен попасть в новый
+        self.ser.reset_input_buffer()
         self.ser.write(cmd.encode("ascii", errors="ignore"))
         self.ser.flush()
 
-    def _read_all(self) -> str:
-        # Небольшая задержка, затем вычитываем всё, что лежит в буфере.
-        time.sleep(0.15)
-        out = []
+    def _read_until_prompt(self, timeout: float) -> str:
+        """Читать, пока адаптер не выдаст приглашение ">" или не выйдет timeout."""
+        deadline = time.monotonic() + timeout
+        buf = bytearray()
         while True:
-            chunk = self.ser.read(self.ser.in_waiting or 1)
-            if not chunk:
+            left = deadline - time.monotonic()
+            if left <= 0:
                 break
-            out.append(chunk.decode(errors="ignore"))
-            time.sleep(0.02)
-        return "".join(out)
+            self._set_timeout(left)
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+            if chunk:
+                buf += chunk
+                if buf.rstrip().endswith(PROMPT):
+                    break
+        return buf.decode(errors="ignore")
+
+    def _set_timeout(self, value: float):
+        # смена таймаута — это ioctl; не дёргаем порт, если значение почти то же
+        if abs((self.ser.timeout or 0) - value) > 0.01:
+            self.ser.timeout = value
+
+    def _command(self, cmd: str, timeout: float) -> str:
+        t0 = time.perf_counter()
+        if self.capture:
+            self.capture.tx(cmd)
+        self._write(cmd)
+        resp = self._read_until_prompt(timeout)
+        if self.capture:
+            self.capture.rx(resp)
+        LINK_STATS.record_adapter(cmd, time.perf_counter() - t0, resp)
+        return resp
+
+    def _request(self, data_hex: str) -> str:
+        """Запрос к ЭБУ: таймаут по P2, первый — с запасом на инициализацию шины."""
+        timeout = self.ecu_timeout if self._bus_ready else BUS_INIT_TIMEOUT
+        resp = self._command(data_hex, timeout)
+        self._bus_ready = True
+        return resp
 
     def init(self) -> str:
         """
@@ -35,12 +93,11 @@ class ELM327:
         ATE0 — без echo, ATL0 — без автопереносов, ATS0 — без пробелов,
         ATH1 — с заголовками (полезно для отладки), ATSP 3 — ISO 9141-2.
         """
-        init_cmds = ["ATZ", "ATE0", "ATL0", "ATS0", "ATH1", "ATSP 3"]
         last = ""
-        for cmd in init_cmds:
-            self._write(cmd)
-            time.sleep(0.25)
-            last = self._read_all()
+        for cmd in INIT_COMMANDS:
+            last = self._command(cmd, RESET_TIMEOUT if cmd == "ATZ" else self.at_timeout)
+        self._bus_ready = False
+        self.header = OBD_HEADER
         return last
 
     def send_obd(self, data_hex: str) -> str:
@@ -48,19 +105,44 @@ class ELM327:
         Отправка «сырых» OBD-команд (напр. '03' для чтения DTC).
         Возвращает «сырой» ответ адаптера.
         """
-        self._write(data_hex)
-        return self._read_all()
+        return self._request(data_hex)
+
+    def describe_protocol(self) -> str:
+        """ATDP: текущий протокол, напр. 'ISO 9141-2' или 'AUTO, ISO 15765-4 (CAN 11/500)'."""
+        return self._command("ATDP", self.at_timeout).replace(">", "").strip()
 
     # ---- KWP2000 helpers ----
     def set_header(self, header: str) -> str:
         """Установить KWP-заголовок (3 байта HEX)."""
-        self._write(f"AT SH {header}")
-        return self._read_all()
+        resp = self._command(f"AT SH {header}", self.at_timeout)
+        self.header = " ".join(header.split()).upper()
+        return resp
+
+    @contextmanager
+    def using_header(self, header: str):
+        """На время блока — другой заголовок (напр. OBD 03 посреди KWP-сессии), потом прежний."""
+        previous, header = self.header, " ".join(header.split()).upper()
+        if header != previous:
+            self.set_header(header)
+        try:
+            yield
+        finally:
+            if self.header != previous:
+                self.set_header(previous)
 
     def send_raw(self, data_hex: str) -> str:
         """Отправить произвольные байты (HEX) без интерпретации."""
-        self._write(data_hex)
-        return self._read_all()
+        return self._request(data_hex)
+
+    def read_pending(self, timeout: float) -> str:
+        """
+        Дочитать ответ без новой команды: ЭБУ прислал 7F xx 78, адаптер
+        ждёт окончательного ответа, а наш таймаут уже вышел.
+        """
+        resp = self._read_until_prompt(timeout)
+        if self.capture:
+            self.capture.rx(resp)
+        return resp
 
     def close(self):
         try:
@@ -0,0 +1,342 @@
+# ecu_transport/emulator.py
+"""
+Эмулятор адаптера ELM327 с ЭБУ KWP2000 за ним — на псевдотерминале (pty).
+
+Открывает пару master/slave; путь slave (/dev/pts/N) отдаётся как обычный
+COM-порт для ELM327(port), read-dtc, kwp-ping, read-fw --port. Так весь путь
+ELM327 -> KWP2000 -> RealBackend гоняется без железа (только Linux/macOS).
+
+Адаптер: ATZ, ATI, ATE0/1, ATL0/1, ATS0/1, ATH0/1, ATSP x, ATDP, ATRV,
+AT SH xx yy zz; прочее AT — "OK", мусор — "?".
+ЭБУ: 0x10 (сессия), 0x3E (TesterPresent), 0x1A (идентификация),
+0x21 (блоки живых данных), 0x23 (чтение памяти из SimECU),
+OBD 0x01 (текущие данные, по одному PID — как на K-Line; на запрос из
+нескольких PID-ов ЭБУ молчит, адаптер пишет NO DATA), OBD 0x03 (коды неисправностей).
+С ATH1 на ATSP 3 ответы OBD приходят кадром ISO 9141-2 (48 6B 10 ... cs),
+ответы KWP — кадром ISO 14230 (fmt tgt src [len] ... cs), как у настоящего ЭБУ.
+Живые данные — по простой модели двигателя (engine_state), раскладка —
+как в diag.live.
+Тайминги и вброс ошибок — по firmware.timing.KLineTiming.
+"""
+from __future__ import annotations
+import math
+import os
+import select
+import threading
+import time
+from pathlib import Path
+
+try:
+    from ..firmware.simulate import SimECU
+    from ..firmware.timing import KLineTiming, KLineLink, SimLinkTimeout, SimNegativeResponse
+    from ..diag.live import OBD_SIGNALS, KWP_SIGNALS
+    from .kwp_parse import NRC_PENDING
+except ImportError:
+    from firmware.simulate import SimECU
+    from firmware.timing import KLineTiming, KLineLink, SimLinkTimeout, SimNegativeResponse
+    from diag.live import OBD_SIGNALS, KWP_SIGNALS
+    from ecu_transport.kwp_parse import NRC_PENDING
+
+ELM_VERSION = "ELM327 v1.5"
+ECU_ID = b"J7.2-SIM"
+TESTER_ADDR = 0xF1
+ECU_ADDR = 0x10
+S3_TIMEOUT = 5.0   # без запросов дольше S3 ЭБУ закрывает диагностическую сессию
+PENDING_DELAY = 1.0   # вброшенный 7F xx 78: через сколько придёт настоящий ответ, с
+OBD_MODES = range(0x01, 0x0B)   # режимы OBD (01 — текущие данные, 03 — коды ...)
+ISO9141_HEADER = bytes([0x48, 0x6B, ECU_ADDR])   # ответ OBD по ISO 9141-2: без байта длины
+
+OBD_PIDS = {s.pid: s for s in OBD_SIGNALS}
+KWP_BLOCKS: dict[int, list] = {}
+for _s in KWP_SIGNALS:
+    KWP_BLOCKS.setdefault(_s.pid, []).append(_s)
+
+PROTOCOLS = {
+    "0": "AUTO", "3": "ISO 9141-2", "4": "ISO 14230-4 (KWP 5BAUD)", "5": "ISO 14230-4 (KWP FAST)",
+}
+
+
+class ELM327Emulator:
+    def __init__(self, ecu: SimECU, timing: KLineTiming | None = None,
+                 dtcs: list[str] | None = None, s3: float | None = S3_TIMEOUT,
+                 pending_delay: float = PENDING_DELAY):
+        self.ecu = ecu
+        self.link = KLineLink(timing) if timing else None
+        self.dtcs = list(dtcs if dtcs is not None else ["P0300", "P0171"])
+        self.s3 = s3
+        self.pending_delay = pending_delay
+        self._pause: tuple[int, float] | None = None   # (где в ответе, сколько) — пауза перед выдачей хвоста
+        self.started = time.monotonic()
+        self.port: str | None = None
+        self._master: int | None = None
+        self._slave: int | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self.reset()
+
+    # ---------- состояние адаптера ----------
+    def reset(self) -> None:
+        self.echo = True
+        self.linefeeds = False
+        self.spaces = True
+        self.headers = False
+        self.protocol = "0"
+        self.header = bytes([0xC1, ECU_ADDR, TESTER_ADDR])
+        self.bus_ready = False
+        self.session: int | None = None   # None — сессия не открыта (0x10 не было или истёк S3)
+        self.last_request = 0.0
+
+    @property
+    def eol(self) -> str:
+        return "\r\n" if self.linefeeds else "\r"
+
+    def handle_line(self, line: str) -> str:
+        """Ответ адаптера на одну команду — вместе с эхом и приглашением '>'."""
+        self._pause = None
+        cmd = line.strip()
+        echo = cmd + self.eol if self.echo else ""
+        if not cmd:
+            return echo + ">"
+        norm = cmd.replace(" ", "").upper()
+        if norm.startswith("AT"):
+            body = self._at(norm[2:])
+        else:
+            body = self._obd(norm)
+        if self._pause:
+            self._pause = (len(echo) + self._pause[0], self._pause[1])
+        return echo + body + self.eol + self.eol + ">"
+
+    def _at(self, a: str) -> str:
+        if a in ("Z", "WS", "D"):
+            self.reset()
+            return self.eol + ELM_VERSION
+        if a == "I":
+            return ELM_VERSION
+        if a == "@1":
+            return "OBDII to RS232 Interpreter (emulator)"
+        if a == "RV":
+            return "12.6V"
+        if a == "DP":
+            return PROTOCOLS.get(self.protocol, "AUTO")
+        if len(a) == 2 and a[0] in "ELSH" and a[1] in "01":
+            attr = {"E": "echo", "L": "linefeeds", "S": "spaces", "H": "headers"}[a[0]]
+            setattr(self, attr, a[1] == "1")
+            return "OK"
+        if a.startswith("SP") and len(a) == 3:
+            self.protocol = a[2].upper().lstrip("A") or "0"
+            self.bus_ready = False
+            return "OK"
+        if a.startswith("SH"):
+            try:
+                header = bytes.fromhex(a[2:])
+            except ValueError:
+                return "?"
+            if len(header) != 3:
+                return "?"
+            self.header = header
+            return "OK"
+        return "OK"
+
+    # ---------- ЭБУ ----------
+    def _obd(self, hexstr: str) -> str:
+        try:
+            req = bytes.fromhex(hexstr)
+        except ValueError:
+            return "?"
+        if not req:
+            return "?"
+        prefix = ""
+        if not self.bus_ready:
+            self.bus_ready = True
+            prefix = "BUS INIT: ...OK" + self.eol
+        now = time.monotonic()
+        if self.s3 is not None and now - self.last_request > self.s3:
+            self.session = None
+        self.last_request = now
+        resp = self._service(req)
+        if not resp:
+            return prefix + "NO DATA"
+        if self.link:
+            try:
+                self.link.transact(req[0], len(req), len(resp))
+            except SimLinkTimeout:
+                return prefix + "NO DATA"
+            except SimNegativeResponse as e:
+                if e.nrc == NRC_PENDING:
+                    # «подождите»: сразу 7F xx 78, настоящий ответ — через pending_delay
+                    head = prefix + self._frame(bytes([0x7F, e.sid, e.nrc])) + self.eol
+                    self._pause = (len(head), self.pending_delay)
+                    return head + self._frame(resp)
+                resp = bytes([0x7F, e.sid, e.nrc])
+        return prefix + self._frame(resp)
+
+    def _service(self, req: bytes) -> bytes:
+        sid = req[0]
+        if sid == 0x10:
+            if len(req) != 2:
+                return bytes([0x7F, sid, 0x12])
+            self.session = req[1]
+            return bytes([0x50, req[1]])
+        if sid == 0x3E:
+            return bytes([0x7E]) + req[1:2]
+        if sid == 0x1A:
+            if len(req) != 2:
+                return bytes([0x7F, sid, 0x12])
+            return bytes([0x5A, req[1]]) + ECU_ID
+        if sid == 0x23:
+            if len(req) != 5:
+                return bytes([0x7F, sid, 0x12])
+            if self.session is None:
+                return bytes([0x7F, sid, 0x80])   # serviceNotSupportedInActiveDiagnosticMode
+            address = int.from_bytes(req[1:4], "big")
+            size = req[4]
+            if not 0 < size <= 254:
+                return bytes([0x7F, sid, 0x12])
+            try:
+                data = bytes(self.ecu.read(address, size))
+            except ValueError:
+                return bytes([0x7F, sid, 0x31])   # requestOutOfRange
+            return bytes([0x63]) + data
+        if sid == 0x03:
+            return bytes([0x43]) + b"".join(_encode_dtc(c) for c in self.dtcs)
+        if sid == 0x01:
+            return self._current_data(req[1:])
+        if sid == 0x21:
+            if len(req) != 2:
+                return bytes([0x7F, sid, 0x12])
+            block = KWP_BLOCKS.get(req[1])
+            if block is None:
+                return bytes([0x7F, sid, 0x31])
+            state = engine_state(time.monotonic() - self.started)
+            data = bytearray(max(s.pos + s.size for s in block))
+            for s in block:
+                data[s.pos:s.pos + s.size] = s.encode(state[s.name])
+            return bytes([0x61, req[1]]) + bytes(data)
+        return bytes([0x7F, sid, 0x11])           # serviceNotSupported
+
+    def _current_data(self, pids: bytes) -> bytes:
+        """OBD режим 01: один PID в запросе (ISO 9141 / 14230); несколько — без ответа."""
+        if len(pids) != 1:
+            return b""
+        state = engine_state(time.monotonic() - self.started)
+        out = bytearray([0x41])
+        for pid in pids:
+            if pid % 0x20 == 0:
+                # карта поддержанных PID base+1..base+32; последний бит — есть следующая карта
+                bits = 0
+                for p in OBD_PIDS:
+                    if pid < p <= pid + 0x20:
+                        bits |= 1 << (0x20 + pid - p)
+                if any(p > pid + 0x20 for p in OBD_PIDS):
+                    bits |= 1
+                out += bytes([pid]) + bits.to_bytes(4, "big")
+            elif pid in OBD_PIDS:
+                out += bytes([pid]) + OBD_PIDS[pid].encode(state[OBD_PIDS[pid].name])
+        if len(out) == 1:
+            return bytes([0x7F, 0x01, 0x12])
+        return bytes(out)
+
+    def _frame(self, resp: bytes) -> str:
+        if self.headers:
+            # ISO 9141-2 (ATSP 3): ответ OBD — 48 6B <ЭБУ> ... контрольная сумма.
+            # KWP2000: 0x80 | длина (или 0x80 + отдельный байт длины), цель, источник ... контрольная сумма;
+            # отвечает тот, кому адресован запрос (AT SH), получатель — тестер
+            target, source = self.header[2], self.header[1]
+            sid = resp[1] if resp[0] == 0x7F else resp[0] - 0x40
+            if self.protocol == "3" and sid in OBD_MODES:
+                head = ISO9141_HEADER
+            elif len(resp) <= 63:
+                head = bytes([0x80 | len(resp), target, source])
+            else:
+                head = bytes([0x80, target, source, len(resp)])
+            frame = head + resp
+            resp = frame + bytes([sum(frame) & 0xFF])
+        sep = " " if self.spaces else ""
+        return sep.join(f"{b:02X}" for b in resp)
+
+    # ---------- pty ----------
+    def open(self) -> str:
+        """Создать псевдотерминал; вернуть путь, который передаётся в ELM327(port)."""
+        import tty  # только POSIX: на Windows эмулятор недоступен
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        return self.port
+
+    def serve_forever(self) -> None:
+        if self._master is None:
+            self.open()
+        buf = b""
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.2)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                break
+            buf += data.replace(b"\n", b"")
+            while b"\r" in buf:
+                line, buf = buf.split(b"\r", 1)
+                reply = self.handle_line(line.decode("ascii", errors="ignore"))
+                pause, self._pause = self._pause, None
+                if pause:
+                    os.write(self._master, reply[:pause[0]].encode("ascii"))
+                    time.sleep(pause[1])
+                    reply = reply[pause[0]:]
+                os.write(self._master, reply.encode("ascii"))
+
+    def start(self) -> str:
+        """Запустить эмулятор в фоновом потоке; вернуть путь порта."""
+        port = self.open()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.serve_forever, name="elm327-emulator", daemon=True)
+        self._thread.start()
+        return port
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def stats(self) -> dict:
+        return self.link.stats() if self.link else {}
+
+
+def engine_state(t: float) -> dict[str, float]:
+    """Правдоподобные значения параметров через t секунд после старта: разгоны, прогрев."""
+    pedal = 0.5 + 0.5 * math.sin(t * 0.6) * math.sin(t * 0.17)
+    rpm = 800 + 4200 * pedal + 60 * math.sin(t * 7.0)
+    load = 15 + 75 * pedal
+    return {
+        "rpm": rpm,
+        "throttle": 3 + 90 * pedal,
+        "load": load,
+        "maf": rpm * load / 1800,
+        "map": 30 + 70 * pedal,
+        "advance": 30 - 20 * pedal,
+        "speed": 3 * max(0.0, rpm - 900) / 100 * (0.5 + 0.5 * math.sin(t * 0.05)),
+        "stft": 4 * math.sin(t * 1.3),
+        "coolant": 90 - 70 * math.exp(-t / 120),
+        "iat": 25 + 10 * pedal,
+        "voltage": 14.1 - 0.4 * pedal,
+    }
+
+
+def _encode_dtc(code: str) -> bytes:
+    """'P0300' -> 03 00 (обратное к diag.dtc.parse_obd_dtc)."""
+    system = "PCBU".index(code[0].upper())
+    b1 = (system << 6) | (int(code[1], 16) << 4) | int(code[2], 16)
+    return bytes([b1, int(code[3:5], 16)])
+
+
+def open_emulator(store: Path, regions=None, timing: KLineTiming | None = None, **kw) -> ELM327Emulator:
+    return ELM327Emulator(SimECU(store, regions), timing=timing, **kw)
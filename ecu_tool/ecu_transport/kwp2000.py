@@ -1,60 +1,173 @@
 # ecu_transport/kwp2000.py
 """
-Каркас KWP2000 поверх K-Line. Реализация команд здесь нарочно-пустая,
-чтобы не трогать реальный ЭБУ до добавления легального SecurityAccess
-и выверенных таймингов.
-
-План команд:
-- start_session(level) -> 0x10
-- tester_present()     -> 0x3E
-- read_ecu_id()        -> (набор 0x1A/0x1B/0x21 по спецификации конкретного блока)
-- read_memory(addr, size) -> 0x23
+Клиент KWP2000 поверх K-Line (ELM327). Только чтение: записи и
+SecurityAccess здесь нет — реальный ЭБУ не меняется.
+
+Команды (KWPServices — общие для KWP2000 и aio.AsyncKWP2000):
+- start_session(level)    -> 0x10
+- tester_present()        -> 0x3E (ответ 7E или C0)
+- read_ecu_id()           -> 0x1A 90
+- read_local_id(lid)      -> 0x21 (блок живых данных)
+- read_memory(addr, size) -> 0x23, проверка длины ответа
+
+Ответ проверяется в _expect (7F xx -> KWPNegativeResponse, пусто ->
+KWPNoResponse). Временные ошибки (0x21, нет ответа, короткий кадр)
+повторяет RequestExecutor (retry.py); на 7F xx 78 ждём окончательного
+ответа до P2*max — _pending_steps.
 """
+import time
+from functools import partial
+
+try:
+    from .kwp_parse import parse_response, is_pending
+    from .metrics import LINK_STATS
+    from .retry import RequestExecutor
+except ImportError:
+    from ecu_transport.kwp_parse import parse_response, is_pending
+    from ecu_transport.metrics import LINK_STATS
+    from ecu_transport.retry import RequestExecutor
+
+class KWPNegativeResponse(RuntimeError):
+    """ЭБУ ответил 7F <sid> <nrc>."""
+    def __init__(self, sid: int, nrc: int, resp: str = ""):
+        super().__init__(f"Negative response 7F {sid:02X} {nrc:02X}: {resp.strip()}")
+        self.sid = sid
+        self.nrc = nrc
+        self.resp = resp
+
+
+class KWPNoResponse(RuntimeError):
+    """ЭБУ не ответил (NO DATA / таймаут адаптера)."""
+    timeout = True
+
 
-class KWP2000:
-    def __init__(self, transport):
-        self.t = transport  # низкоуровневый транспорт (ELM327 и др.)
+PENDING_RESEND = 0.2   # адаптер уже вернул '>' после 7F xx 78 — через сколько спросить снова, с
 
-    # утилита для преобразования строкового ответа ELM -> bytes
+
+class KWPServices:
+    """
+    Запросы KWP2000 и проверка ответов — общие для KWP2000 и AsyncKWP2000.
+
+    Подкласс задаёт только _call(req, positive, what, post): отправку с
+    повторами (executor) и ожиданием окончательного ответа после 7F xx 78
+    (_pending_steps). post (разбор данных, проверка длины) выполняется внутри
+    попытки — неполный ответ повторяется, как любой сбой линии. У асинхронного
+    клиента _call — корутина, и методы ниже возвращают awaitable.
+    """
+    def __init__(self, transport, executor: RequestExecutor | None = None):
+        self.t = transport  # низкоуровневый транспорт (ELM327, AsyncELM327)
+        # повторы по кодам 7F и ожидание 78; executor.stats — во что они обошлись
+        self.executor = executor or RequestExecutor()
+
+    def _call(self, req: str, positive: tuple[int, ...], what: str, post=None):
+        raise NotImplementedError
+
+    # ответ ELM (с пробелами или без, с заголовками или без) -> SID ответа + данные
     @staticmethod
-    def _parse(resp: str) -> bytes:
-        tokens = resp.replace("\r", " ").replace("\n", " ").replace(">", " ").split()
-        out = []
-        for t in tokens:
-            try:
-                if len(t) == 2:
-                    out.append(int(t, 16))
-            except ValueError:
-                continue
-        return bytes(out)
+    def _parse(resp: str) -> memoryview:
+        return parse_response(resp)
 
-    def start_session(self, level: int = 0x81):
-        resp = self.t.send_raw(f"10 {level:02X}")
-        data = self._parse(resp)
-        if not data or data[0] != 0x50:
-            raise RuntimeError(f"StartSession failed: {resp}")
+    @staticmethod
+    def _check_negative(data, resp: str):
+        if len(data) >= 3 and data[0] == 0x7F:
+            raise KWPNegativeResponse(data[1], data[2], resp)
+
+    @classmethod
+    def _expect(cls, data, resp: str, positive: tuple[int, ...], what: str):
+        """Проверить ответ: 7F -> KWPNegativeResponse, пусто -> KWPNoResponse, чужой SID -> RuntimeError."""
+        cls._check_negative(data, resp)
+        if not data:
+            raise KWPNoResponse(f"{what} failed: {resp}")
+        if data[0] not in positive:
+            raise RuntimeError(f"{what} failed: {resp}")
         return data
 
+    def _pending_steps(self, resp: str, what: str, can_read: bool):
+        """
+        7F xx 78 — запрос принят, ответ будет позже: ждать его до P2*max, а не бросать запрос.
+        Генератор без ввода-вывода: отдаёт ("read", таймаут) — дочитать без новой
+        команды, или ("resend", пауза) — повторить запрос после паузы; в send()
+        получает новый ответ; возвращает окончательный.
+        """
+        stats = self.executor.stats
+        t0 = time.monotonic()
+        deadline = t0 + self.executor.policy.pending_timeout
+        try:
+            while is_pending(resp):
+                stats.pending += 1
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise KWPNoResponse(f"{what}: no final response after 7F 78 "
+                                        f"within {self.executor.policy.pending_timeout:g} s")
+                if not resp.rstrip().endswith(">") and can_read:
+                    # адаптер ещё слушает линию — просто дочитываем
+                    resp += yield "read", left
+                else:
+                    # адаптер закончил приём — повторяем тот же запрос
+                    resp = yield "resend", min(PENDING_RESEND, left)
+            return resp
+        finally:
+            stats.pending_s += time.monotonic() - t0
+
+    def start_session(self, level: int = 0x81):
+        return self._call(f"10 {level:02X}", (0x50,), "StartSession")
+
     def tester_present(self):
-        resp = self.t.send_raw("3E 00")
-        data = self._parse(resp)
-        if not data or data[0] not in (0x7E, 0xC0):
-            raise RuntimeError(f"TesterPresent failed: {resp}")
-        return data
+        return self._call("3E 00", (0x7E, 0xC0), "TesterPresent")
 
     def read_ecu_id(self):
-        resp = self.t.send_raw("1A 90")  # локальный идентификатор 0x90 — базовый ID
-        data = self._parse(resp)
-        if not data or data[0] != 0x5A:
-            raise RuntimeError(f"ReadEcuId failed: {resp}")
-        return data[2:]
+        # локальный идентификатор 0x90 — базовый ID
+        return self._call("1A 90", (0x5A,), "ReadEcuId", _skip_id)
 
-    def read_memory(self, address: int, size: int) -> bytes:
+    def read_local_id(self, lid: int) -> memoryview:
+        # 61 lid + блок параметров (раскладка своя у каждого ЭБУ)
+        return self._call(f"21 {lid:02X}", (0x61,), "ReadLocalId", _skip_id)
+
+    def read_memory(self, address: int, size: int) -> memoryview:
         if not (0 < size <= 0xFF):
             raise ValueError("size must be 1..255")
         a2, a1, a0 = (address >> 16) & 0xFF, (address >> 8) & 0xFF, address & 0xFF
-        resp = self.t.send_raw(f"23 {a2:02X} {a1:02X} {a0:02X} {size:02X}")
-        data = self._parse(resp)
-        if len(data) < 4 or data[0] != 0x63:
-            raise RuntimeError(f"ReadMemory failed: {resp}")
-        return data[4:]
+        # 63 + данные
+        return self._call(f"23 {a2:02X} {a1:02X} {a0:02X} {size:02X}", (0x63,), "ReadMemory",
+                          partial(_memory_data, size))
+
+
+def _skip_id(data):
+    # SID ответа + идентификатор запроса -> только данные
+    return data[2:]
+
+
+def _memory_data(size: int, data):
+    if len(data) != size + 1:
+        raise RuntimeError(f"ReadMemory failed: {len(data) - 1} of {size} bytes")
+    return data[1:]
+
+
+class KWP2000(KWPServices):
+    def _call(self, req: str, positive: tuple[int, ...], what: str, post=None):
+        return self.executor.run(self._attempt, req, positive, what, post)
+
+    def _attempt(self, req: str, positive: tuple[int, ...], what: str, post=None):
+        with LINK_STATS.measure("kwp", req) as sample:
+            resp = self._await_pending(req, self.t.send_raw(req), what)
+            data = self._parse(resp)
+            sample.rx = len(data)
+            data = self._expect(data, resp, positive, what)
+            # проверка длины и т.п. — внутри попытки: короткий кадр повторяется как сбой линии
+            return post(data) if post else data
+
+    def _await_pending(self, req: str, resp: str, what: str) -> str:
+        if not is_pending(resp):
+            return resp
+        steps = self._pending_steps(resp, what, hasattr(self.t, "read_pending"))
+        try:
+            action, arg = next(steps)
+            while True:
+                if action == "read":
+                    resp = self.t.read_pending(arg)
+                else:
+                    time.sleep(arg)
+                    resp = self.t.send_raw(req)
+                action, arg = steps.send(resp)
+        except StopIteration as done:
+            return done.value
@@ -0,0 +1,164 @@
+# ecu_transport/kwp_parse.py
+"""
+Разбор ответов ELM327 на KWP-запросы.
+
+Понимает вывод с пробелами и без (ATS1/ATS0), с заголовками и без
+(ATH1/ATH0: формат, адреса, длина, контрольная сумма снимаются),
+служебные строки адаптера (BUS INIT, SEARCHING..., NO DATA) и
+многострочные ответы ISO-TP ("0:", "1:" ...). Шестнадцатеричный текст
+переводится в байты через binascii прямо из среза входного буфера,
+полезная нагрузка отдаётся memoryview без лишних копий.
+
+python -m ecu_tool.ecu_transport.kwp_parse — замер скорости (МБ/с)
+на записанном через эмулятор обмене.
+"""
+from __future__ import annotations
+import binascii
+import re
+from typing import Iterator
+
+# строка кадра: пары hex-цифр, возможно разделённые пробелами
+_HEX_LINE = re.compile(rb"[0-9A-Fa-f]{2}(?: ?[0-9A-Fa-f]{2})*")
+# строка многокадрового ответа (CAN/ISO-TP): "0:", "1:" ... и строка общей длины "00A"
+_SEQ_LINE = re.compile(rb"([0-9A-Fa-f]): *")
+_LEN_LINE = re.compile(rb"[0-9A-Fa-f]{3}")
+# непустая строка без крайних пробелов
+_LINES = re.compile(rb" *([^\r\n> ](?:[^\r\n>]*[^\r\n> ])?)")
+
+NRC_PENDING = 0x78
+# ISO 9141-2 (ATSP 3): заголовок ответа 48 6B <адрес ЭБУ>, длины в нём нет
+_ISO9141_RESPONSE = b"\x48\x6B"
+
+
+def _unhex(line: memoryview) -> bytes:
+    if line[2:3] != b" ":
+        try:
+            return binascii.a2b_hex(line)   # ATS0: без пробелов, прямо из буфера
+        except binascii.Error:
+            pass
+    return bytes.fromhex(str(line, "ascii"))
+
+
+def _strip_header(frame: bytes, headers: bool | None) -> memoryview | None:
+    """
+    Кадр ISO 14230 с заголовком: fmt [tgt src] [len] данные cs,
+    или ISO 9141-2: 48 6B src данные cs.
+    headers=None — определить самим: длина из fmt сходится (или заголовок
+    ISO 9141-2) и контрольная сумма верна.
+    None в ответе — кадр не похож на кадр с заголовком.
+
+    Ответ ЭБУ на 01 0C по ISO 9141-2 (ATSP 3, ATH1):
+
+    >>> [bytes(f).hex(" ") for f in iter_frames("48 6B 10 41 0C 1A F8 22\\r\\r>")]
+    ['41 0c 1a f8']
+    >>> [bytes(f).hex(" ") for f in iter_frames("486B10430171030000007B\\r\\r>")]
+    ['43 01 71 03 00 00 00']
+    """
+    mv = memoryview(frame)
+    if headers is False or len(frame) < 3:
+        return None if headers else mv
+    fmt = frame[0]
+    pos = 3 if fmt & 0xC0 else 1          # с адресами или без
+    size = fmt & 0x3F
+    if size == 0 and len(frame) > pos:
+        size = frame[pos]
+        pos += 1
+    checksum_ok = sum(frame[:-1]) & 0xFF == frame[-1]
+    if checksum_ok and pos + size + 1 == len(frame):
+        return mv[pos:pos + size]
+    if checksum_ok and len(frame) > 4 and frame[:2] == _ISO9141_RESPONSE:
+        return mv[3:-1]
+    if headers:
+        # заголовок не ISO 14230 (ISO 9141: три байта без длины) — адреса + контрольная сумма
+        return mv[3:-1]
+    return mv
+
+
+def iter_frames(resp: str | bytes | bytearray | memoryview, headers: bool | None = None,
+                echo: str | None = None) -> Iterator[memoryview]:
+    """Полезные нагрузки всех кадров ответа по порядку."""
+    buf = resp.encode("ascii", errors="ignore") if isinstance(resp, str) else resp
+    mv = memoryview(buf)
+    echo_hex = echo.replace(" ", "").upper().encode("ascii") if echo else None
+    seq: bytearray | None = None
+    seq_len = None
+    for m in _LINES.finditer(buf):
+        s, e = m.span(1)
+        if _HEX_LINE.fullmatch(buf, s, e):
+            line = mv[s:e]
+            if echo_hex is not None and bytes(line).replace(b" ", b"").upper() == echo_hex:
+                echo_hex = None    # эхо запроса (ATE1) — только первое совпадение
+                continue
+            frame = _strip_header(_unhex(line), headers)
+            if frame is not None:
+                yield frame
+        elif _LEN_LINE.fullmatch(buf, s, e):
+            seq, seq_len = bytearray(), int(bytes(mv[s:e]), 16)
+        elif (sm := _SEQ_LINE.match(buf, s, e)) and _HEX_LINE.fullmatch(buf, sm.end(), e):
+            if seq is None:
+                seq = bytearray()
+            seq += _unhex(mv[sm.end():e])
+            if seq_len is not None and len(seq) >= seq_len:
+                yield memoryview(seq)[:seq_len]
+                seq, seq_len = None, None
+        # прочее — служебный текст адаптера: BUS INIT, SEARCHING..., NO DATA, ?
+    if seq:
+        yield memoryview(seq)[:seq_len] if seq_len is not None else memoryview(seq)
+
+
+def parse_response(resp: str | bytes | bytearray | memoryview, headers: bool | None = None,
+                   echo: str | None = None) -> memoryview:
+    """
+    Полезная нагрузка ответа ЭБУ (SID ответа + данные). Промежуточные
+    7F xx 78 (responsePending) пропускаются, берётся последний кадр.
+    Пустой memoryview — ответа нет (NO DATA, ошибка шины и т.п.).
+    """
+    last = memoryview(b"")
+    for frame in iter_frames(resp, headers, echo):
+        if len(frame) >= 3 and frame[0] == 0x7F and frame[2] == NRC_PENDING:
+            continue
+        last = frame
+    return last
+
+
+def is_pending(resp: str | bytes | bytearray | memoryview, headers: bool | None = None) -> bool:
+    """Последний кадр ответа — 7F xx 78: ЭБУ ещё не ответил окончательно."""
+    last = None
+    for last in iter_frames(resp, headers):
+        pass
+    return last is not None and len(last) >= 3 and last[0] == 0x7F and last[2] == NRC_PENDING
+
+
+def _benchmark(seconds: float = 1.0) -> None:
+    import time
+    from pathlib import Path
+    from tempfile import TemporaryDirectory
+    try:
+        from .emulator import ELM327Emulator
+        from ..firmware.simulate import SimECU
+    except ImportError:
+        from ecu_transport.emulator import ELM327Emulator
+        from firmware.simulate import SimECU
+    with TemporaryDirectory() as tmp:
+        ecu = SimECU(Path(tmp) / "sim.bin")
+        for spaces, headers in ((True, False), (False, True)):
+            emu = ELM327Emulator(ecu, s3=None)
+            emu.handle_line("10 81")
+            emu.echo, emu.spaces, emu.headers = False, spaces, headers
+            # «запись» обмена: 256 чтений по 254 байта, как в read-fw
+            traffic = [emu.handle_line(f"23{(i * 254) & 0xFFFF:06X}FE").encode() for i in range(256)]
+            total = sum(len(t) for t in traffic)
+            n, t0 = 0, time.perf_counter()
+            while time.perf_counter() - t0 < seconds:
+                for t in traffic:
+                    parse_response(t)
+                n += 1
+            dt = time.perf_counter() - t0
+            mode = f"ATS{int(spaces)} ATH{int(headers)}"
+            print(f"{mode}: {total * n / dt / 1e6:.1f} МБ/с текста, "
+                  f"{256 * 254 * n / dt / 1e6:.2f} МБ/с данных, {256 * n / dt:.0f} ответов/с")
+        ecu.close()
+
+
+if __name__ == "__main__":
+    _benchmark()
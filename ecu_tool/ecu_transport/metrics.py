@@ -0,0 +1,193 @@
+# ecu_transport/metrics.py
+"""
+Статистика обмена с адаптером и ЭБУ.
+
+Замеры пишутся на двух уровнях:
+  elm — от отправки команды до приглашения '>' (адаптер + линия + ЭБУ);
+  kwp — весь вызов сервиса KWP2000 (плюс разбор ответа на хосте).
+Разница kwp − elm по одному сервису — это время нашего кода; elm по
+AT-командам — время самого адаптера; elm по запросам к ЭБУ — линия и ЭБУ.
+
+По каждому сервису: число запросов, ошибки, таймауты, повторы, байты
+туда/обратно (elm — символы команды и ответа адаптера, kwp — байты
+запроса и ответа ЭБУ: SID + данные), коды отрицательных ответов и гистограмма задержек
+(логарифмические корзины, ~9% точности) для p50/p95/p99.
+LINK_STATS — общий на процесс экземпляр; замеры потокобезопасны.
+"""
+from __future__ import annotations
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+HIST_MIN = 50e-6                 # нижняя граница первой корзины, с
+HIST_FACTOR = 2 ** (1 / 8)       # шаг корзин
+HIST_BUCKETS = 200               # 50 мкс * 2^(200/8) ≈ 30 минут — с запасом
+
+SERVICE_NAMES = {
+    0x01: "OBD CurrentData",
+    0x03: "OBD ReadDTC",
+    0x10: "StartSession",
+    0x1A: "ReadEcuId",
+    0x21: "ReadLocalId",
+    0x23: "ReadMemory",
+    0x3D: "WriteMemory",
+    0x3E: "TesterPresent",
+}
+
+
+def service_key(request: str) -> str:
+    """Ключ сервиса по тексту запроса: 'AT SH 81 10 F1' -> 'AT SH', '23 00 01 00 FE' -> '23'."""
+    req = request.strip().upper()
+    if req.startswith("AT"):
+        return "AT " + req[2:].replace(" ", "")[:2].rstrip("0123456789 ")
+    return req.replace(" ", "")[:2]
+
+
+def service_name(key: str) -> str:
+    try:
+        return SERVICE_NAMES.get(int(key, 16), key)
+    except ValueError:
+        return key
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * HIST_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        i = 0 if seconds <= HIST_MIN else int(math.log(seconds / HIST_MIN, HIST_FACTOR)) + 1
+        self.buckets[min(i, HIST_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попал q-й процентиль (не больше max)."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(HIST_MIN * HIST_FACTOR ** i, self.max)
+        return self.max
+
+
+class ServiceStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.bytes_tx = 0
+        self.bytes_rx = 0
+        self.nrc: Counter[int] = Counter()
+        self.latency = LatencyHistogram()
+
+    def snapshot(self) -> dict:
+        h = self.latency
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+            "bytes_tx": self.bytes_tx,
+            "bytes_rx": self.bytes_rx,
+            "nrc": {f"0x{k:02X}": v for k, v in sorted(self.nrc.items())},
+            "mean_ms": round(h.total / h.count * 1000, 3) if h.count else 0.0,
+            "p50_ms": round(h.percentile(50) * 1000, 3),
+            "p95_ms": round(h.percentile(95) * 1000, 3),
+            "p99_ms": round(h.percentile(99) * 1000, 3),
+            "max_ms": round(h.max * 1000, 3),
+        }
+
+
+@dataclass
+class Sample:
+    """Замер одного вызова (measure): rx — байт ответа, проставляет вызывающий."""
+    tx: int = 0
+    rx: int = 0
+
+
+class LinkStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._services: dict[tuple[str, str], ServiceStats] = {}
+        self._last_failed: dict[tuple[str, str], str] = {}
+        self.started = time.time()
+
+    def record(self, layer: str, request: str, seconds: float, tx: int = 0, rx: int = 0,
+               ok: bool = True, timeout: bool = False, nrc: int | None = None) -> None:
+        key = (layer, service_key(request))
+        with self._lock:
+            st = self._services.get(key)
+            if st is None:
+                st = self._services[key] = ServiceStats()
+            # тот же запрос сразу после неудачи — это повтор
+            if self._last_failed.get(key) == request:
+                st.retries += 1
+            if ok:
+                self._last_failed.pop(key, None)
+            else:
+                self._last_failed[key] = request
+            st.count += 1
+            st.bytes_tx += tx
+            st.bytes_rx += rx
+            st.latency.add(seconds)
+            if timeout:
+                st.timeouts += 1
+            if nrc is not None:
+                st.nrc[nrc] += 1
+            if not ok:
+                st.errors += 1
+
+    def record_adapter(self, cmd: str, seconds: float, resp: str) -> None:
+        """Команда адаптеру: без '>' — таймаут хоста, NO DATA — ЭБУ не ответил."""
+        prompt = resp.rstrip().endswith(">")
+        no_data = "NO DATA" in resp
+        self.record("elm", cmd, seconds, tx=len(cmd) + 1, rx=len(resp),
+                    ok=prompt and not no_data, timeout=not prompt or no_data)
+
+    @contextmanager
+    def measure(self, layer: str, request: str):
+        """
+        Замер вызова сервиса: ошибки и коды 7F берутся из исключения.
+        Отдаёт Sample: tx — байт запроса (HEX-строка), rx — проставить по ответу.
+        """
+        sample = Sample(tx=len(request.replace(" ", "")) // 2)
+        t0 = time.perf_counter()
+        try:
+            yield sample
+        except Exception as e:
+            self.record(layer, request, time.perf_counter() - t0, tx=sample.tx, rx=sample.rx, ok=False,
+                        timeout=isinstance(e, TimeoutError) or getattr(e, "timeout", False),
+                        nrc=getattr(e, "nrc", None))
+            raise
+        self.record(layer, request, time.perf_counter() - t0, tx=sample.tx, rx=sample.rx)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out: dict[str, dict] = {}
+            for (layer, key), st in sorted(self._services.items()):
+                out.setdefault(layer, {})[key] = dict(st.snapshot(), name=service_name(key))
+            return out
+
+    def empty(self) -> bool:
+        with self._lock:
+            return not self._services
+
+    def reset(self) -> None:
+        with self._lock:
+            self._services.clear()
+            self._last_failed.clear()
+            self.started = time.time()
+
+
+LINK_STATS = LinkStats()
@@ -0,0 +1,163 @@
+# ecu_transport/retry.py
+"""
+Повторы запросов KWP2000 с учётом кодов отрицательных ответов.
+
+Что делать с ошибкой, решает classify():
+  pending   — 7F xx 78: ЭБУ принял запрос и просит подождать; ждём
+              окончательного ответа до P2*max, запрос не повторяем
+              (это делает KWPServices._pending_steps);
+  transient — 0x21 busy, 0x23 routineNotComplete, нет ответа, битый
+              ответ: повторяем с растущей паузой, не больше retries раз;
+  session   — сессия потеряна (0x22/0x7F/0x80): повторять тут бессмысленно,
+              сессию переоткрывает KWPSession;
+  permanent — всё остальное (0x11, 0x12, 0x31, 0x33, ...): сразу наверх.
+Во что обошлись повторы (сколько, какие NRC, сколько секунд на паузы
+и ожидание 78) копится в RetryStats.
+"""
+from __future__ import annotations
+import asyncio
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+try:
+    from .kwp_parse import NRC_PENDING
+except ImportError:
+    from ecu_transport.kwp_parse import NRC_PENDING
+
+PENDING, TRANSIENT, SESSION, PERMANENT = "pending", "transient", "session", "permanent"
+
+P2_STAR_MAX = 5.0   # сколько ЭБУ может тянуть с ответом после 7F xx 78, с (ISO 14230-2)
+
+TRANSIENT_NRC = {
+    0x21,  # busyRepeatRequest
+    0x23,  # routineNotComplete
+}
+SESSION_NRC = {
+    0x22,  # conditionsNotCorrect
+    0x7F,  # serviceNotSupportedInActiveSession
+    0x80,  # serviceNotSupportedInActiveDiagnosticMode
+}
+
+
+def classify(exc: BaseException) -> str:
+    """Что делать с ошибкой запроса (см. описание модуля)."""
+    nrc = getattr(exc, "nrc", None)
+    if nrc is not None:
+        if nrc == NRC_PENDING:
+            return PENDING
+        if nrc in TRANSIENT_NRC:
+            return TRANSIENT
+        if nrc in SESSION_NRC:
+            return SESSION
+        return PERMANENT
+    if isinstance(exc, TimeoutError) or getattr(exc, "timeout", False):
+        return TRANSIENT
+    # чужой SID, короткий ответ — помеха на линии; ошибки порта (OSError) и аргументов — нет
+    if type(exc) is RuntimeError:
+        return TRANSIENT
+    return PERMANENT
+
+
+def retryable(exc: BaseException) -> bool:
+    return classify(exc) in (PENDING, TRANSIENT)
+
+
+@dataclass
+class RetryPolicy:
+    retries: int = 3                 # повторов после первой попытки
+    backoff: float = 0.05            # пауза перед первым повтором, с
+    factor: float = 2.0              # во сколько раз растёт пауза
+    max_backoff: float = 1.0
+    pending_timeout: float = P2_STAR_MAX
+
+    def delays(self):
+        delay = self.backoff
+        for _ in range(self.retries):
+            yield delay
+            delay = min(delay * self.factor, self.max_backoff)
+
+
+@dataclass
+class RetryStats:
+    requests: int = 0
+    retries: int = 0
+    failed: int = 0
+    timeouts: int = 0
+    pending: int = 0                 # сколько раз ждали после 7F xx 78
+    backoff_s: float = 0.0           # паузы перед повторами
+    retry_s: float = 0.0             # время неудачных попыток
+    pending_s: float = 0.0           # ожидание окончательного ответа после 78
+    nrc: Counter = field(default_factory=Counter)
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "pending": self.pending,
+            "cost_s": round(self.backoff_s + self.retry_s + self.pending_s, 3),
+            "backoff_s": round(self.backoff_s, 3),
+            "retry_s": round(self.retry_s, 3),
+            "pending_s": round(self.pending_s, 3),
+            "nrc": {f"0x{k:02X}": v for k, v in sorted(self.nrc.items())},
+        }
+
+    def note_failure(self, exc: BaseException) -> str:
+        """Учесть неудачную попытку (код NRC или таймаут); вернуть classify(exc)."""
+        kind = classify(exc)
+        nrc = getattr(exc, "nrc", None)
+        if nrc is not None:
+            self.nrc[nrc] += 1
+        elif isinstance(exc, TimeoutError) or getattr(exc, "timeout", False):
+            self.timeouts += 1
+        return kind
+
+
+class RequestExecutor:
+    def __init__(self, policy: RetryPolicy | None = None, sleep=time.sleep):
+        self.policy = policy or RetryPolicy()
+        self.stats = RetryStats()
+        self._sleep = sleep
+
+    def run(self, fn, *args):
+        """Выполнить fn(*args); временные ошибки повторить по политике, остальные — сразу наверх."""
+        self.stats.requests += 1
+        delays = self.policy.delays()
+        while True:
+            t0 = time.monotonic()
+            try:
+                return fn(*args)
+            except Exception as e:
+                delay = self._retry_delay(e, t0, delays)
+                if delay is None:
+                    raise
+                self._sleep(delay)
+                self.stats.backoff_s += delay
+
+    async def run_async(self, fn, *args):
+        """То же, что run, для корутины fn (AsyncKWP2000); пауза — asyncio.sleep."""
+        self.stats.requests += 1
+        delays = self.policy.delays()
+        while True:
+            t0 = time.monotonic()
+            try:
+                return await fn(*args)
+            except Exception as e:
+                delay = self._retry_delay(e, t0, delays)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                self.stats.backoff_s += delay
+
+    def _retry_delay(self, exc: BaseException, t0: float, delays) -> float | None:
+        """Учесть неудачную попытку; пауза перед повтором или None — повторять нельзя."""
+        kind = self.stats.note_failure(exc)
+        delay = next(delays, None) if kind in (PENDING, TRANSIENT) else None
+        if delay is None:
+            self.stats.failed += 1
+            return None
+        self.stats.retries += 1
+        self.stats.retry_s += time.monotonic() - t0
+        return delay
@@ -0,0 +1,108 @@
+# ecu_transport/session.py
+"""
+Удержание диагностической сессии KWP2000.
+
+ЭБУ закрывает сессию, если дольше S3 (обычно ~5 с) не было запросов.
+KWPSession в фоновом потоке шлёт TesterPresent (3E) в паузах между
+запросами; все обращения к адаптеру идут под одним замком, так что
+keepalive не вклинивается посреди чужого обмена. Если ЭБУ всё же
+ответил «сессия не та» — сессия открывается заново и запрос повторяется
+один раз, без полной переинициализации адаптера.
+"""
+from __future__ import annotations
+import threading
+import time
+
+try:
+    from .kwp2000 import KWP2000, KWPNegativeResponse
+    from .retry import SESSION_NRC
+except ImportError:
+    from ecu_transport.kwp2000 import KWP2000, KWPNegativeResponse
+    from ecu_transport.retry import SESSION_NRC
+
+KEEPALIVE_INTERVAL = 2.0   # заметно меньше S3 = 5 с
+# NRC, после которых имеет смысл открыть сессию заново
+SESSION_LOST_NRC = SESSION_NRC
+
+
+class KWPSession:
+    def __init__(self, kwp: KWP2000, level: int = 0x81, keepalive: float | None = KEEPALIVE_INTERVAL):
+        self.kwp = kwp
+        self.level = level
+        self.keepalive = keepalive
+        self.lock = threading.RLock()
+        self.last_activity = 0.0
+        self.keepalives = 0
+        self.reopened = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ---------- жизненный цикл ----------
+    def open(self) -> None:
+        with self.lock:
+            self.kwp.start_session(self.level)
+            self.last_activity = time.monotonic()
+        if self.keepalive and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._keepalive_loop, name="kwp-keepalive", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.keepalive or 1.0)
+            self._thread = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- запросы ----------
+    def call(self, fn, *args):
+        """Выполнить запрос KWP под замком; при потере сессии — переоткрыть и повторить."""
+        with self.lock:
+            try:
+                return self._touch(fn(*args))
+            except KWPNegativeResponse as e:
+                if e.nrc not in SESSION_LOST_NRC:
+                    raise
+                self.kwp.start_session(self.level)
+                self.reopened += 1
+                return self._touch(fn(*args))
+
+    def read_memory(self, address: int, size: int):
+        return self.call(self.kwp.read_memory, address, size)
+
+    def read_ecu_id(self):
+        return self.call(self.kwp.read_ecu_id)
+
+    def _touch(self, result):
+        self.last_activity = time.monotonic()
+        return result
+
+    def _keepalive_loop(self) -> None:
+        while not self._stop.wait(min(0.5, self.keepalive / 4)):
+            if time.monotonic() - self.last_activity < self.keepalive:
+                continue
+            # не ждём замок: если идёт запрос — keepalive не нужен
+            if not self.lock.acquire(blocking=False):
+                continue
+            try:
+                try:
+                    self.kwp.tester_present()
+                    self.keepalives += 1
+                except KWPNegativeResponse:
+                    self.kwp.start_session(self.level)
+                    self.reopened += 1
+                self.last_activity = time.monotonic()
+            except Exception:
+                # нет связи — не шумим из фона; ошибку увидит следующий запрос
+                self.last_activity = time.monotonic()
+            finally:
+                self.lock.release()
+
+    def stats(self) -> dict:
+        return {"level": f"0x{self.level:02X}", "keepalives": self.keepalives, "reopened": self.reopened}
@@ -0,0 +1,137 @@
+# firmware/adaptive.py
+"""
+Подбор размера блока чтения под конкретную линию.
+
+AdaptiveChunker стартует с самого большого блока, который принимает
+бэкенд (или с размера, запомненного для этой пары адаптер/ЭБУ), и
+двигается по «лестнице» размеров к тому, где меньше секунд на байт
+с учётом времени, потерянного на ошибки.
+ChunkProfile хранит найденный размер между сессиями.
+"""
+from __future__ import annotations
+import json
+import os
+from pathlib import Path
+
+LADDER = (16, 32, 64, 128, 192, 254, 512, 1024, 2048, 4096)
+
+
+class FixedChunk:
+    """Фиксированный размер блока (старое поведение: размер не меняется)."""
+    def __init__(self, size: int):
+        self.size = size
+
+    def next_size(self) -> int:
+        return self.size
+
+    def record(self, size: int, seconds: float, ok: bool) -> None:
+        pass
+
+    def step_down(self) -> bool:
+        return False
+
+    def settled(self) -> int:
+        return self.size
+
+
+class AdaptiveChunker:
+    """
+    Для каждого размера копится затухающая сумма потраченного времени
+    (включая неудачные запросы) и полученных байт; их отношение — цена
+    байта с учётом ошибок. Раз в window запросов сравниваем текущий размер
+    с соседями и переходим к более дешёвому, время от времени пробуя
+    размер побольше. Две ошибки подряд — сразу шаг вниз (адаптер/ЭБУ
+    может не тянуть длинные кадры).
+    """
+
+    def __init__(self, max_size: int, start: int | None = None, min_size: int = 16,
+                 window: int = 8, decay: float = 0.9, probe_every: int = 4):
+        self.sizes = sorted({s for s in LADDER if min_size <= s <= max_size} | {max_size})
+        start = max_size if start is None else start
+        fitting = [i for i, s in enumerate(self.sizes) if s <= start]
+        self.i = fitting[-1] if fitting else 0
+        self.window = window
+        self.decay = decay
+        self.probe_every = probe_every
+        self._seconds = [0.0] * len(self.sizes)
+        self._bytes = [0.0] * len(self.sizes)
+        self._count = 0
+        self._windows = 0      # окон с последнего шага: раз в probe_every пробуем размер больше
+        self._fails_in_row = 0
+
+    def next_size(self) -> int:
+        return self.sizes[self.i]
+
+    def settled(self) -> int:
+        return self.sizes[self.i]
+
+    def record(self, size: int, seconds: float, ok: bool) -> None:
+        i = self.i
+        self._seconds[i] = self._seconds[i] * self.decay + seconds
+        self._bytes[i] = self._bytes[i] * self.decay + (size if ok else 0)
+        if not ok:
+            self._fails_in_row += 1
+            if self._fails_in_row >= 2:
+                self._fails_in_row = 0
+                self._move(i - 1)
+            return
+        self._fails_in_row = 0
+        self._count += 1
+        if self._count < self.window:
+            return
+        self._count = 0
+        self._windows += 1
+        here = self._cost(i)
+        if i > 0 and self._cost(i - 1) < 0.95 * here:
+            self._move(i - 1)
+        elif i + 1 < len(self.sizes) and (self._cost(i + 1) < here or self._bytes[i + 1] == 0
+                                          or self._windows >= self.probe_every):
+            self._move(i + 1)
+
+    def step_down(self) -> bool:
+        """Блок не прочитался и после повторов запроса — размер меньше; False — меньше некуда."""
+        i = self.i
+        self._fails_in_row = 0
+        self._move(i - 1)
+        return self.i != i
+
+    def _cost(self, i: int) -> float:
+        """Секунд на полученный байт; inf — размер ещё не пробовали или он ничего не дал."""
+        if self._bytes[i] <= 0:
+            return float("inf")
+        return self._seconds[i] / self._bytes[i]
+
+    def _move(self, i: int) -> None:
+        i = max(0, min(len(self.sizes) - 1, i))
+        if i != self.i:
+            self.i = i
+            self._count = 0
+            self._windows = 0
+
+
+class ChunkProfile:
+    """JSON-файл «ключ адаптера/ЭБУ -> размер блока»."""
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def _load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str | None) -> int | None:
+        if not key:
+            return None
+        value = self._load().get(key)
+        return value if isinstance(value, int) else None
+
+    def put(self, key: str | None, size: int) -> None:
+        if not key:
+            return
+        data = self._load()
+        data[key] = size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
@@ -0,0 +1,120 @@
+# firmware/checkpoint.py
+"""
+Чекпоинт потокового дампа: рядом с <дамп>.bin лежит <дамп>.bin.ckpt
+с битовой картой готовых блоков и их CRC32. По нему read-fw --resume
+дочитывает только недостающие или испорченные блоки.
+"""
+from __future__ import annotations
+import json
+import os
+import time
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+
+CHECKPOINT_BLOCK = 1024
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(out_path: Path) -> Path:
+    out_path = Path(out_path)
+    return out_path.with_name(out_path.name + ".ckpt")
+
+
+@dataclass
+class DumpCheckpoint:
+    path: Path
+    size: int                      # размер плоского образа (все регионы)
+    regions: list[dict]            # раскладка, с которой начинали дамп
+    block: int = CHECKPOINT_BLOCK
+    done: bytearray = field(default_factory=bytearray)
+    crc: list[int] = field(default_factory=list)
+    save_interval: float = 0.5     # как часто сбрасывать чекпоинт на диск, с
+
+    def __post_init__(self):
+        n = self.blocks
+        self.done = bytearray(self.done).ljust((n + 7) // 8, b"\0")
+        self.crc = (list(self.crc) + [0] * n)[:n]
+        self._saved_at = 0.0
+
+    @property
+    def blocks(self) -> int:
+        return (self.size + self.block - 1) // self.block
+
+    def block_len(self, b: int) -> int:
+        return min(self.block, self.size - b * self.block)
+
+    # ---------- состояние блоков ----------
+    def is_done(self, b: int) -> bool:
+        return bool(self.done[b >> 3] & (1 << (b & 7)))
+
+    def mark(self, b: int, crc: int) -> None:
+        self.done[b >> 3] |= 1 << (b & 7)
+        self.crc[b] = crc & 0xFFFFFFFF
+
+    def unmark(self, b: int) -> None:
+        self.done[b >> 3] &= ~(1 << (b & 7)) & 0xFF
+
+    def missing_runs(self) -> list[tuple[int, int]]:
+        """Непрерывные диапазоны [start, end) смещений в образе, которые надо дочитать."""
+        runs, start = [], None
+        for b in range(self.blocks):
+            if not self.is_done(b):
+                if start is None:
+                    start = b
+            elif start is not None:
+                runs.append((start * self.block, b * self.block))
+                start = None
+        if start is not None:
+            runs.append((start * self.block, self.size))
+        return runs
+
+    def verify(self, f) -> int:
+        """Сверить готовые блоки с содержимым файла; битые снова помечаются недочитанными."""
+        bad = 0
+        for b in range(self.blocks):
+            if not self.is_done(b):
+                continue
+            f.seek(b * self.block)
+            data = f.read(self.block_len(b))
+            if len(data) != self.block_len(b) or zlib.crc32(data) & 0xFFFFFFFF != self.crc[b]:
+                self.unmark(b)
+                bad += 1
+        return bad
+
+    def done_blocks(self) -> int:
+        return sum(1 for b in range(self.blocks) if self.is_done(b))
+
+    # ---------- диск ----------
+    def save(self, force: bool = True) -> None:
+        now = time.monotonic()
+        if not force and now - self._saved_at < self.save_interval:
+            return
+        payload = {
+            "version": CHECKPOINT_VERSION,
+            "size": self.size,
+            "block": self.block,
+            "regions": self.regions,
+            "done": self.done.hex(),
+            "crc": self.crc,
+        }
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(payload), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._saved_at = now
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, path: Path, size: int, regions: list[dict]) -> "DumpCheckpoint | None":
+        """Прочитать чекпоинт; None — если его нет или он от другой раскладки."""
+        path = Path(path)
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if raw.get("version") != CHECKPOINT_VERSION or raw.get("size") != size or raw.get("regions") != regions:
+            return None
+        return cls(path=path, size=size, regions=regions, block=raw["block"],
+                   done=bytearray.fromhex(raw["done"]), crc=raw["crc"])
@@ -0,0 +1,176 @@
+# firmware/diff.py
+"""
+Разница между двумя образами прошивки и компактный патч.
+
+Изменённые участки ищутся без побайтового цикла в Python: с NumPy —
+векторным сравнением, без него — сравнением срезов bytes кусками
+(сначала по CHUNK байт, затем внутри отличающихся кусков помельче).
+
+Формат патча (.fwp), всё little-endian:
+  заголовок  "FWPT", версия (1 байт), размер/CRC32 исходника,
+             размер/CRC32 результата, число участков (по 4 байта)
+  участок    varint(смещение от конца предыдущего), varint(длина), данные
+Правка параметров tune.write_params укладывается в несколько десятков байт.
+"""
+from __future__ import annotations
+import struct
+import zlib
+from dataclasses import dataclass, field
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен
+    np = None
+
+PATCH_MAGIC = b"FWPT"
+PATCH_VERSION = 1
+_HEADER = struct.Struct("<4sBIIIII")
+
+CHUNK = 256
+MERGE_GAP = 4   # разрыв до стольких одинаковых байт выгоднее переписать, чем открывать новый участок
+
+
+def _crc(data) -> int:
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+
+def changed_ranges(old, new, merge_gap: int = MERGE_GAP) -> list[tuple[int, int]]:
+    """
+    Диапазоны [start, end) в new, отличающиеся от old. Если new длиннее,
+    хвост целиком считается изменённым. Участки, между которыми не больше
+    merge_gap одинаковых байт, склеиваются.
+    """
+    common = min(len(old), len(new))
+    if np is not None:
+        diff = _diff_positions_np(old, new, common)
+    else:
+        diff = _diff_runs_bytes(old, new, common)
+    if len(new) > common:
+        diff.append((common, len(new)))
+    runs: list[tuple[int, int]] = []
+    for start, end in diff:
+        if runs and start - runs[-1][1] <= merge_gap:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+    return runs
+
+
+def _diff_positions_np(old, new, n: int) -> list[tuple[int, int]]:
+    a = np.frombuffer(old, dtype=np.uint8, count=n)
+    b = np.frombuffer(new, dtype=np.uint8, count=n)
+    ne = np.concatenate(([False], a != b, [False]))
+    edges = np.flatnonzero(ne[1:] != ne[:-1])   # чередуются начала и концы участков
+    return list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+
+
+def _diff_runs_bytes(old, new, n: int) -> list[tuple[int, int]]:
+    mo, mn = memoryview(old), memoryview(new)
+    runs: list[tuple[int, int]] = []
+    for off in range(0, n, CHUNK):
+        end = min(off + CHUNK, n)
+        if mo[off:end] == mn[off:end]:
+            continue
+        for sub in range(off, end, 16):
+            sub_end = min(sub + 16, end)
+            if mo[sub:sub_end] == mn[sub:sub_end]:
+                continue
+            # внутри 16 байт — уже можно поштучно
+            for i in range(sub, sub_end):
+                if mo[i] != mn[i]:
+                    if runs and runs[-1][1] == i:
+                        runs[-1] = (runs[-1][0], i + 1)
+                    else:
+                        runs.append((i, i + 1))
+    return runs
+
+
+@dataclass
+class Patch:
+    src_size: int
+    src_crc: int
+    tgt_size: int
+    tgt_crc: int
+    ranges: list[tuple[int, bytes]] = field(default_factory=list)   # (смещение, новые байты)
+
+    @property
+    def payload_bytes(self) -> int:
+        return sum(len(d) for _, d in self.ranges)
+
+    def to_bytes(self) -> bytes:
+        out = bytearray(_HEADER.pack(PATCH_MAGIC, PATCH_VERSION, self.src_size, self.src_crc,
+                                     self.tgt_size, self.tgt_crc, len(self.ranges)))
+        pos = 0
+        for off, data in self.ranges:
+            _put_varint(out, off - pos)
+            _put_varint(out, len(data))
+            out += data
+            pos = off + len(data)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "Patch":
+        if len(raw) < _HEADER.size:
+            raise ValueError("Патч обрезан")
+        magic, version, src_size, src_crc, tgt_size, tgt_crc, count = _HEADER.unpack_from(raw)
+        if magic != PATCH_MAGIC or version != PATCH_VERSION:
+            raise ValueError("Это не патч прошивки или неизвестная версия формата")
+        mv = memoryview(raw)
+        p, pos, ranges = _HEADER.size, 0, []
+        for _ in range(count):
+            gap, p = _get_varint(raw, p)
+            size, p = _get_varint(raw, p)
+            if p + size > len(raw):
+                raise ValueError("Патч обрезан")
+            pos += gap
+            ranges.append((pos, bytes(mv[p:p + size])))
+            p += size
+            pos += size
+        if pos > tgt_size:
+            raise ValueError("Участок патча за пределами образа")
+        return cls(src_size, src_crc, tgt_size, tgt_crc, ranges)
+
+
+def _put_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(raw: bytes, p: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        if p >= len(raw):
+            raise ValueError("Патч обрезан")
+        b = raw[p]
+        p += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, p
+        shift += 7
+
+
+def make_patch(old, new, merge_gap: int = MERGE_GAP) -> Patch:
+    mv = memoryview(new)
+    ranges = [(s, bytes(mv[s:e])) for s, e in changed_ranges(old, new, merge_gap)]
+    return Patch(len(old), _crc(old), len(new), _crc(new), ranges)
+
+
+def apply_patch(buf: bytearray, patch: Patch, verify: bool = True) -> bytearray:
+    """
+    Применить патч к buf на месте. С verify сверяются CRC исходника и
+    результата: патч от другого образа не применится молча.
+    """
+    if len(buf) != patch.src_size or (verify and _crc(buf) != patch.src_crc):
+        raise ValueError("Патч сделан для другого исходного образа")
+    if patch.tgt_size != len(buf):
+        if patch.tgt_size < len(buf):
+            del buf[patch.tgt_size:]
+        else:
+            buf.extend(b"\xFF" * (patch.tgt_size - len(buf)))
+    for off, data in patch.ranges:
+        buf[off:off + len(data)] = data
+    if verify and _crc(buf) != patch.tgt_crc:
+        raise ValueError("CRC после применения патча не совпал")
+    return buf
@@ -0,0 +1,141 @@
+# firmware/hashtree.py
+"""
+Дерево контрольных сумм по блокам образа (в духе Merkle):
+листья — CRC32 блоков, внутренние узлы — CRC32 склейки детей,
+посчитанный через crc32_combine без повторного прохода по данным.
+
+После записи пересчитываются только затронутые блоки и их предки,
+а CRC32 всего образа берётся из корня за O(1).
+"""
+from __future__ import annotations
+import zlib
+from typing import Callable, Iterable
+
+BLOCK_SIZE = 4096
+
+# ---- crc32_combine (как в zlib, которого нет в модуле zlib Python) ----
+_CRC_POLY = 0xEDB88320
+
+
+def _gf2_times(mat: list[int], vec: int) -> int:
+    s, i = 0, 0
+    while vec:
+        if vec & 1:
+            s ^= mat[i]
+        vec >>= 1
+        i += 1
+    return s
+
+
+def _gf2_square(mat: list[int]) -> list[int]:
+    return [_gf2_times(mat, mat[n]) for n in range(32)]
+
+
+def _build_shift_ops() -> list[list[int]]:
+    # оператор «дописать один нулевой бит», затем возводим в квадрат до 1 байта
+    op = [_CRC_POLY] + [1 << (n - 1) for n in range(1, 32)]
+    for _ in range(3):
+        op = _gf2_square(op)
+    ops = [op]  # ops[k] — сдвиг на 2**k байт
+    for _ in range(1, 40):
+        ops.append(_gf2_square(ops[-1]))
+    return ops
+
+
+_SHIFT_OPS = _build_shift_ops()
+
+
+def crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """CRC32(A + B) по CRC32(A), CRC32(B) и длине B."""
+    k = 0
+    while len2:
+        if len2 & 1:
+            crc1 = _gf2_times(_SHIFT_OPS[k], crc1)
+        len2 >>= 1
+        k += 1
+    return (crc1 ^ crc2) & 0xFFFFFFFF
+
+
+# ---- дерево ----
+class BlockHashTree:
+    """
+    read(offset, size) — источник данных (bytes-like), size — размер образа.
+    Изменённые блоки помечаются через touch() и пересчитываются лениво
+    при следующем запросе crc32()/block_crcs().
+
+    blank(block) -> True, если блок заведомо заполнен fill (незаписанная
+    страница разреженного образа): его CRC берётся из кэша без чтения.
+    """
+    def __init__(self, read: Callable[[int, int], bytes], size: int, block_size: int = BLOCK_SIZE,
+                 blank: Callable[[int], bool] | None = None, fill: int = 0xFF):
+        self._read = read
+        self._blank = blank
+        self._fill = fill
+        self._blank_crc: dict[int, int] = {}
+        self.size = size
+        self.block_size = block_size
+        self.blocks = (size + block_size - 1) // block_size
+        n = 1
+        while n < self.blocks:
+            n *= 2
+        self._n = n
+        # узел i: (crc, длина); листья в [n, 2n), пустые листья — (0, 0)
+        self._crc = [0] * (2 * n)
+        self._len = [0] * (2 * n)
+        for b in range(self.blocks):
+            self._crc[n + b], self._len[n + b] = self._leaf(b)
+        for i in range(n - 1, 0, -1):
+            self._pull(i)
+        self._stale: set[int] = set()
+
+    def touch(self, offset: int, length: int) -> None:
+        if length <= 0:
+            return
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        self._stale.update(range(first, min(last, self.blocks - 1) + 1))
+
+    def crc32(self) -> int:
+        self._refresh()
+        return self._crc[1]
+
+    def block_crcs(self) -> list[int]:
+        self._refresh()
+        return self._crc[self._n:self._n + self.blocks]
+
+    def changed_blocks(self, other: Iterable[int]) -> list[int]:
+        """Номера блоков, чьи CRC отличаются от other (например, из info() другого образа)."""
+        mine = self.block_crcs()
+        other = list(other)
+        diff = [i for i, (a, b) in enumerate(zip(mine, other)) if a != b]
+        diff.extend(range(min(len(mine), len(other)), max(len(mine), len(other))))
+        return diff
+
+    # ---------- внутреннее ----------
+    def _leaf(self, b: int) -> tuple[int, int]:
+        off = b * self.block_size
+        size = min(self.block_size, self.size - off)
+        if self._blank is not None and self._blank(b):
+            crc = self._blank_crc.get(size)
+            if crc is None:
+                crc = self._blank_crc[size] = zlib.crc32(bytes([self._fill]) * size) & 0xFFFFFFFF
+            return crc, size
+        return zlib.crc32(self._read(off, size)) & 0xFFFFFFFF, size
+
+    def _pull(self, i: int) -> None:
+        l, r = 2 * i, 2 * i + 1
+        self._crc[i] = crc32_combine(self._crc[l], self._crc[r], self._len[r])
+        self._len[i] = self._len[l] + self._len[r]
+
+    def _refresh(self) -> None:
+        if not self._stale:
+            return
+        parents = set()
+        for b in self._stale:
+            self._crc[self._n + b], _ = self._leaf(b)
+            parents.add((self._n + b) // 2)
+        self._stale.clear()
+        while parents:
+            for i in parents:
+                self._pull(i)
+            parents = {i // 2 for i in parents if i > 1}
@@ -1,33 +1,116 @@
 # firmware/io.py
 from __future__ import annotations
-from dataclasses import dataclass
+import os
+import time
+import zlib
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Protocol, Iterable
-from .map import FLASH
+from .map import REGIONS, Region, address_at, total_size
+from .checkpoint import DumpCheckpoint, checkpoint_path
+from .adaptive import AdaptiveChunker, ChunkProfile, FixedChunk
+from .progress import ProgressCallback, ProgressTracker
 from .simulate import SimECU
+from .timing import KLineTiming, KLineLink, MAX_FRAME_PAYLOAD
+
+try:
+    from ..ecu_transport.elm327 import KWP_HEADER
+    from ..ecu_transport.kwp2000 import KWP2000
+    from ..ecu_transport.session import KWPSession, KEEPALIVE_INTERVAL
+    from ..ecu_transport.retry import RequestExecutor, retryable
+except ImportError:
+    from ecu_transport.elm327 import KWP_HEADER
+    from ecu_transport.kwp2000 import KWP2000
+    from ecu_transport.session import KWPSession, KEEPALIVE_INTERVAL
+    from ecu_transport.retry import RequestExecutor, retryable
 
 # ---- Транспортный протокол (каркас) ----
 class MemoryBackend(Protocol):
-    def read_block(self, address: int, size: int) -> bytes: ...
+    # bytes-like: симулятор отдаёт memoryview на свой образ без копирования
+    def read_block(self, address: int, size: int) -> bytes | memoryview: ...
     def write_block(self, address: int, data: bytes) -> None: ...
     def info(self) -> dict: ...
+    # необязательно: regions: list[Region] — раскладка памяти (по умолчанию map.REGIONS)
+    #               max_block / max_write_block: int — самый большой блок за один запрос
+    #               profile_key: str — ключ адаптера/ЭБУ для запоминания размера блока
+    #               clock() -> float — часы для замеров (по умолчанию perf_counter)
 
 # ---- Реализация: DEMO / Симулятор ----
+_SIM_READ_FRAME = MAX_FRAME_PAYLOAD - 1    # данных в ответе 63 + данные
+_SIM_WRITE_FRAME = MAX_FRAME_PAYLOAD - 5   # данных в запросе 3D a2 a1 a0 size + данные
+
 @dataclass
 class SimBackend:
     path: Path
+    timing: KLineTiming | None = None  # модель K-Line; None — отвечать мгновенно
+    regions: list[Region] = field(default_factory=lambda: list(REGIONS))
 
     def __post_init__(self):
-        self.ecu = SimECU(self.path)
+        self.ecu = SimECU(self.path, self.regions)
+        self.link = KLineLink(self.timing) if self.timing else None
+        # повторы запросов при ошибках модели линии — как у KWP2000 в RealBackend;
+        # паузы перед повтором идут по часам модели
+        self.executor = RequestExecutor(sleep=self.link.idle if self.link else time.sleep)
+
+    @property
+    def max_block(self) -> int:
+        # на модели K-Line — как на линии (кадр KWP минус SID), иначе страница образа
+        return _SIM_READ_FRAME if self.link else self.ecu.cache.page_size
+
+    @property
+    def max_write_block(self) -> int:
+        # 3D a2 a1 a0 size + данные должны влезть в кадр
+        return _SIM_WRITE_FRAME if self.link else self.ecu.cache.page_size
+
+    @property
+    def profile_key(self) -> str:
+        return f"sim:{self.timing.baud}" if self.timing else "sim:instant"
 
-    def read_block(self, address: int, size: int) -> bytes:
+    def clock(self) -> float:
+        # с моделью линии замеряем виртуальное время K-Line
+        return self.link.elapsed if self.link else time.perf_counter()
+
+    def read_block(self, address: int, size: int) -> memoryview:
+        if not self.link:
+            return self.ecu.read(address, size)
+        return self.executor.run(self._read_link, address, size)
+
+    def _read_link(self, address: int, size: int) -> memoryview:
+        # 23 a2 a1 a0 size -> 63 + данные; блок больше кадра уходит несколькими запросами
+        for off in range(0, size, _SIM_READ_FRAME):
+            self.link.transact(0x23, 5, 1 + min(_SIM_READ_FRAME, size - off))
         return self.ecu.read(address, size)
 
     def write_block(self, address: int, data: bytes) -> None:
+        if self.link:
+            # 3D a2 a1 a0 size + данные -> 7D, тоже не больше кадра за запрос
+            for off in range(0, len(data), _SIM_WRITE_FRAME):
+                self.link.transact(0x3D, 5 + min(_SIM_WRITE_FRAME, len(data) - off), 1)
         self.ecu.write(address, data)
 
+    def flush(self) -> None:
+        self.ecu.flush()
+
+    def rollback(self) -> None:
+        self.ecu.rollback()
+
+    @property
+    def block_size(self) -> int:
+        return self.ecu.hashes.block_size
+
+    def block_crcs(self) -> list[int]:
+        # CRC32 блоков плоского образа — без чтения памяти по линии
+        return self.ecu.block_crcs()
+
     def info(self) -> dict:
-        return self.ecu.info()
+        info = self.ecu.info()
+        if self.link:
+            info["link"] = self.link.stats()
+            info["kwp_retry"] = self.executor.stats.snapshot()
+        return info
+
+    def close(self):
+        self.ecu.close()
 
 # ---- Заглушка под реальный ЭБУ (KWP2000) ----
 @dataclass
@@ -38,32 +121,47 @@ class RealBackend:
     """
     adapter: object  # транспорт (например, экземпляр ELM327)
     developer_mode: bool = False  # без этого запись запрещена
+    regions: list[Region] = field(default_factory=lambda: list(REGIONS))
+    max_block: int = 254        # 255 байт данных кадра KWP минус SID ответа
+    max_write_block: int = 250  # минус SID, адрес и размер в запросе записи
+
+    keepalive: float | None = KEEPALIVE_INTERVAL  # период TesterPresent в паузах; None — не слать
 
     def __post_init__(self):
-        try:
-            from ..ecu_transport.kwp2000 import KWP2000
-        except ImportError:
-            from ecu_transport.kwp2000 import KWP2000
         self.kwp = KWP2000(self.adapter)
+        # сессия держится фоновым TesterPresent; все запросы идут через её замок
+        self.session = KWPSession(self.kwp, keepalive=self.keepalive)
+        self.ecu_id = None
         try:
             self.adapter.init()
-            self.adapter.set_header("81 10 F1")
-            self.kwp.start_session()
+            self.adapter.set_header(KWP_HEADER)
+            self.session.open()
+            self.ecu_id = bytes(self.session.read_ecu_id()).hex().upper()
         except Exception:
             pass
 
-    def read_block(self, address: int, size: int) -> bytes:
-        return self.kwp.read_memory(address, size)
+    @property
+    def profile_key(self) -> str:
+        return f"{getattr(self.adapter, 'port', self.adapter)}:{self.ecu_id or 'unknown'}"
 
-    def write_block(self, address: int, data: bytes) -> None:
+    def read_block(self, address: int, size: int) -> memoryview:
+        return self.session.read_memory(address, size)
+
+    def ensure_writable(self) -> None:
         if not self.developer_mode:
             raise PermissionError("Запись в реальный ЭБУ выключена (безопасность). Включи developer_mode только для тестов на стенде.")
+
+    def write_block(self, address: int, data: bytes) -> None:
+        self.ensure_writable()
         raise NotImplementedError("WriteMemory not implemented for real backend yet.")
 
     def info(self) -> dict:
-        return {"backend": "real_kwp2000", "warning": "write disabled", "adapter": str(self.adapter)}
+        return {"backend": "real_kwp2000", "warning": "write disabled", "adapter": str(self.adapter),
+                "ecu_id": self.ecu_id, "session": self.session.stats(),
+                "kwp_retry": self.kwp.executor.stats.snapshot()}
 
     def close(self):
+        self.session.close()
         try:
             self.adapter.close()
         except Exception:
@@ -76,27 +174,222 @@ def iter_chunks(data: bytes | None, chunk_size: int) -> Iterable[bytes]:
     for i in range(0, len(data), chunk_size):
         yield data[i:i+chunk_size]
 
-def dump_firmware(backend: MemoryBackend, out_path: Path, chunk: int = 256) -> dict:
+def backend_regions(backend: MemoryBackend) -> list[Region]:
+    return list(getattr(backend, "regions", REGIONS))
+
+def backend_chunk(backend: MemoryBackend, chunk: int | None, write: bool = False) -> int:
+    """Размер блока, не больше того, что принимает бэкенд (None — самый большой)."""
+    limit = getattr(backend, "max_block", None)
+    if write:
+        limit = getattr(backend, "max_write_block", limit)
+    if chunk is None:
+        return limit or 256
+    return min(chunk, limit) if limit else chunk
+
+def dump_firmware(backend: MemoryBackend, out_path: Path, chunk: int | None = None, resume: bool = False,
+                  profile: ChunkProfile | None = None, progress: ProgressCallback | None = None) -> dict:
+    """
+    Считать все регионы памяти подряд в один плоский файл.
+    Блоки сразу пишутся в заранее выделенный файл, а прогресс — в чекпоинт
+    <out>.ckpt (карта готовых блоков + их CRC32). При обрыве чекпоинт
+    остаётся на диске, и resume=True дочитывает только недостающие
+    или испорченные блоки.
+
+    chunk=None — размер блока подбирается по ходу чтения (AdaptiveChunker)
+    и запоминается в profile для этой пары адаптер/ЭБУ.
+
+    progress — колбэк прогресса (см. firmware.progress); False из него
+    отменяет чтение (OperationCancelled), чекпоинт при этом сохраняется.
+
+    Повторяет неудачные запросы сам бэкенд (RequestExecutor: временные
+    ошибки по ecu_transport.retry.classify); если блок не прочитался и так,
+    он запрашивается ещё раз только блоком меньшего размера (sizer.step_down),
+    а отказ вроде 7F 23 31 прерывает чтение сразу. Во что обошлись
+    повторы — в result["info"]["kwp_retry"].
+    """
     out_path = Path(out_path)
-    buf = bytearray()
-    read_total = 0
-    while read_total < FLASH.size:
-        size = min(chunk, FLASH.size - read_total)
-        block = backend.read_block(FLASH.start + read_total, size)
-        buf.extend(block)
-        read_total += size
+    key = getattr(backend, "profile_key", None)
+    if chunk is None:
+        start = profile.get(key) if profile else None
+        sizer = AdaptiveChunker(backend_chunk(backend, None), start=start)
+    else:
+        sizer = FixedChunk(backend_chunk(backend, chunk))
+    regions = backend_regions(backend)
+    size = total_size(regions)
+    layout = [r.__dict__ for r in regions]
+    ckpt = None
+    if resume and out_path.exists() and out_path.stat().st_size == size:
+        ckpt = DumpCheckpoint.load(checkpoint_path(out_path), size, layout)
+    resumed = ckpt is not None
+    if ckpt is None:
+        ckpt = DumpCheckpoint(checkpoint_path(out_path), size, layout)
+
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_bytes(bytes(buf))
-    return {"bytes": read_total, "out": str(out_path), "info": backend.info()}
+    with open(out_path, "r+b" if resumed else "wb") as f:
+        if not resumed:
+            f.truncate(size)
+        bad = ckpt.verify(f) if resumed else 0
+        reused = ckpt.done_blocks()
+        read_total = 0
+        runs = ckpt.missing_runs()
+        tracker = ProgressTracker(sum(end - start for start, end in runs), progress)
+        try:
+            tracker.start()
+            for start, end in runs:
+                read_total += _dump_run(backend, regions, f, ckpt, start, end, sizer, tracker)
+        except BaseException:
+            ckpt.save()
+            raise
+        f.flush()
+        os.fsync(f.fileno())
+    ckpt.remove()
+    if chunk is None and profile:
+        profile.put(key, sizer.settled())
+    return {"bytes": size, "read": read_total, "chunk": sizer.settled(), "resumed": resumed, "reused_blocks": reused,
+            "bad_blocks": bad, "out": str(out_path), "info": backend.info()}
+
+def _dump_run(backend: MemoryBackend, regions: list[Region], f, ckpt: DumpCheckpoint,
+              start: int, end: int, sizer, tracker: ProgressTracker) -> int:
+    """Дочитать диапазон [start, end) образа; start/end — на границах блоков чекпоинта."""
+    clock = getattr(backend, "clock", time.perf_counter)
+    f.seek(start)
+    pos = start
+    b = start // ckpt.block
+    block_end = min(pos + ckpt.block, ckpt.size)
+    crc = 0
+    while pos < end:
+        address, room = address_at(regions, pos)
+        size = min(sizer.next_size(), end - pos, room)
+        t0 = clock()
+        try:
+            data = memoryview(backend.read_block(address, size))
+        except (PermissionError, NotImplementedError, ValueError):
+            raise
+        except Exception as e:
+            sizer.record(size, clock() - t0, ok=False)
+            # запрос уже повторён бэкендом; здесь — только блок поменьше
+            # (длинный кадр может не проходить по шумной линии)
+            if not retryable(e) or not sizer.step_down():
+                raise
+            continue
+        sizer.record(size, clock() - t0, ok=True)
+        if len(data) != size:
+            raise RuntimeError(f"Короткий ответ при чтении 0x{address:06X}: {len(data)} из {size} байт")
+        f.write(data)
+        while data:
+            take = min(len(data), block_end - pos)
+            crc = zlib.crc32(data[:take], crc)
+            pos += take
+            data = data[take:]
+            if pos == block_end:
+                ckpt.mark(b, crc)
+                b, crc = b + 1, 0
+                block_end = min(block_end + ckpt.block, ckpt.size)
+        ckpt.save(force=False)
+        tracker.advance(size)
+    return end - start
 
-def flash_firmware(backend: MemoryBackend, in_path: Path, chunk: int = 256) -> dict:
+def flash_firmware(backend: MemoryBackend, in_path: Path, chunk: int | None = 256,
+                   diff: bool = False, reference: Path | None = None,
+                   progress: ProgressCallback | None = None) -> dict:
+    """
+    Записать образ во все регионы памяти.
+    diff=True — писать только изменившиеся блоки, склеенные в непрерывные
+    отрезки. Текущее содержимое берётся из reference (дамп с устройства),
+    иначе из CRC блоков бэкенда (block_crcs), иначе читается обратно.
+
+    progress — колбэк прогресса; False из него отменяет запись до flush().
+    При отмене или ошибке бэкенд с rollback() (симулятор) отбрасывает
+    незафиксированные страницы — прерванная прошивка не видна.
+    """
     in_path = Path(in_path)
     data = in_path.read_bytes()
-    if len(data) != FLASH.size:
-        raise ValueError(f"Размер образа {len(data)} байт не совпадает с размером памяти {FLASH.size} байт.")
+    chunk = backend_chunk(backend, chunk, write=True)
+    regions = backend_regions(backend)
+    if len(data) != total_size(regions):
+        raise ValueError(f"Размер образа {len(data)} байт не совпадает с размером памяти {total_size(regions)} байт.")
+    # та же защита, что и у write_block: проверяем до любых чтений/сравнений
+    if hasattr(backend, "ensure_writable"):
+        backend.ensure_writable()
+    if diff:
+        runs, mode = _diff_runs(backend, regions, data, chunk, reference)
+    else:
+        runs, mode = [(0, len(data))], "full"
+    tracker = ProgressTracker(sum(end - start for start, end in runs), progress)
+    tracker.start()
     written = 0
-    for i in range(0, FLASH.size, chunk):
-        part = data[i:i+chunk]
-        backend.write_block(FLASH.start + i, part)
-        written += len(part)
-    return {"bytes": written, "source": str(in_path), "info": backend.info()}
+    try:
+        for start, end in runs:
+            written += _flash_run(backend, regions, data, start, end, chunk, tracker)
+    except BaseException:
+        # OperationCancelled, KeyboardInterrupt, ошибка линии
+        if hasattr(backend, "rollback"):
+            backend.rollback()
+        raise
+    if hasattr(backend, "flush"):
+        backend.flush()
+    return {"bytes": written, "skipped": len(data) - written, "runs": len(runs), "mode": mode,
+            "source": str(in_path), "info": backend.info()}
+
+DIFF_GRANULE = 64  # шаг сравнения с эталоном, байт
+MERGE_GAP = 64     # промежуток, который дешевле переписать, чем платить за лишний запрос
+
+def _flash_run(backend: MemoryBackend, regions: list[Region], data: bytes, start: int, end: int, chunk: int,
+               tracker: ProgressTracker) -> int:
+    pos = start
+    while pos < end:
+        address, room = address_at(regions, pos)
+        size = min(chunk, end - pos, room)
+        backend.write_block(address, data[pos:pos + size])
+        pos += size
+        tracker.advance(size)
+    return end - start
+
+def _diff_runs(backend: MemoryBackend, regions: list[Region], data: bytes, chunk: int,
+               reference: Path | None) -> tuple[list[tuple[int, int]], str]:
+    if reference is not None:
+        old = Path(reference).read_bytes()
+        if len(old) != len(data):
+            raise ValueError(f"Эталон {reference}: {len(old)} байт, образ: {len(data)} байт.")
+        return _merge_runs(_changed_ranges(old, data, DIFF_GRANULE)), "reference"
+    if hasattr(backend, "block_crcs"):
+        # CRC находят несовпавшие блоки; читаем обратно только их и сужаем
+        # до того же шага DIFF_GRANULE, что и при сравнении с эталоном
+        bs = backend.block_size
+        device = backend.block_crcs()
+        ranges = []
+        for i, off in enumerate(range(0, len(data), bs)):
+            end = min(off + bs, len(data))
+            if zlib.crc32(data[off:end]) & 0xFFFFFFFF != device[i]:
+                old = _read_back(backend, regions, off, end, chunk)
+                ranges += [(off + a, off + b) for a, b in _changed_ranges(old, data[off:end], DIFF_GRANULE)]
+        return _merge_runs(ranges), "hashes"
+    old = _read_back(backend, regions, 0, len(data), chunk)
+    return _merge_runs(_changed_ranges(old, data, DIFF_GRANULE)), "readback"
+
+def _read_back(backend: MemoryBackend, regions: list[Region], start: int, end: int, chunk: int) -> bytearray:
+    old = bytearray()
+    pos = start
+    while pos < end:
+        address, room = address_at(regions, pos)
+        size = min(chunk, end - pos, room)
+        old += backend.read_block(address, size)
+        pos += size
+    return old
+
+def _changed_ranges(old: bytes, new: bytes, granule: int) -> list[tuple[int, int]]:
+    ranges = []
+    for off in range(0, len(new), granule):
+        end = min(off + granule, len(new))
+        if old[off:end] != new[off:end]:
+            ranges.append((off, end))
+    return ranges
+
+def _merge_runs(ranges: list[tuple[int, int]], gap: int = MERGE_GAP) -> list[tuple[int, int]]:
+    runs: list[tuple[int, int]] = []
+    for start, end in ranges:
+        if runs and start - runs[-1][1] <= gap:
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+    return runs
@@ -7,9 +7,62 @@ class Region:
     start: int
     size: int
 
+    @property
+    def end(self) -> int:
+        return self.start + self.size
+
 # Заглушка под Январь 7.2 (примерный размер ПЗУ 64..128 КБ; уточнять под твою прошивку)
 # Для симулятора используем 64 КБ.
 FLASH = Region("FLASH", start=0x0000, size=64 * 1024)
 
-# Если понадобятся раздельные сегменты (boot/calibration), добавишь тут.
 REGIONS = [FLASH]
+
+# Раскладки памяти с раздельными сегментами (boot/code/calibration).
+# Адреса и размеры примерные — уточнять под конкретный блок.
+LAYOUTS = {
+    "j72": [FLASH],
+    "split128": [
+        Region("BOOT", start=0x00000, size=16 * 1024),
+        Region("CODE", start=0x04000, size=96 * 1024),
+        Region("CALIB", start=0x1C000, size=16 * 1024),
+    ],
+    "split512": [
+        Region("BOOT", start=0x000000, size=64 * 1024),
+        Region("CODE", start=0x010000, size=384 * 1024),
+        Region("CALIB", start=0x070000, size=64 * 1024),
+    ],
+}
+
+
+def layout(name: str) -> list[Region]:
+    try:
+        return LAYOUTS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестная раскладка памяти: {name} (есть: {', '.join(LAYOUTS)})") from None
+
+
+def total_size(regions: list[Region]) -> int:
+    return sum(r.size for r in regions)
+
+
+def locate(regions: list[Region], address: int, size: int) -> int:
+    """
+    Смещение адреса в плоском образе, где регионы лежат подряд в порядке списка.
+    Диапазон [address, address+size) должен целиком попадать в один регион.
+    """
+    offset = 0
+    for r in regions:
+        if r.start <= address and address + size <= r.end:
+            return offset + address - r.start
+        offset += r.size
+    raise ValueError(f"Адрес 0x{address:06X}+{size} вне регионов памяти")
+
+
+def address_at(regions: list[Region], offset: int) -> tuple[int, int]:
+    """Обратное к locate(): (адрес, сколько байт до конца региона) для смещения в образе."""
+    base = 0
+    for r in regions:
+        if offset < base + r.size:
+            return r.start + offset - base, base + r.size - offset
+        base += r.size
+    raise ValueError(f"Смещение {offset} вне образа ({base} байт)")
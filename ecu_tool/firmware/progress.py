@@ -0,0 +1,65 @@
+# firmware/progress.py
+"""
+Прогресс и отмена для долгих операций (dump_firmware / flash_firmware).
+
+Вызывающий передаёт progress(p: TransferProgress). Колбэк вызывается
+в начале и после каждого блока; если он вернёт False до конца операции,
+она прерывается исключением OperationCancelled.
+"""
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+class OperationCancelled(Exception):
+    """Операцию отменил пользователь (колбэк прогресса вернул False)."""
+
+
+@dataclass(frozen=True)
+class TransferProgress:
+    done: int        # байт обработано
+    total: int       # байт всего в этой операции
+    elapsed: float   # с начала операции, с
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def rate(self) -> float:
+        """Байт в секунду."""
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float | None:
+        """Оставшееся время, с; None — пока не из чего оценить."""
+        if self.done <= 0 or self.elapsed <= 0:
+            return None
+        return (self.total - self.done) / self.rate
+
+
+ProgressCallback = Callable[[TransferProgress], Optional[bool]]
+
+
+class ProgressTracker:
+    def __init__(self, total: int, callback: ProgressCallback | None):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self._t0 = time.perf_counter()
+
+    def start(self) -> None:
+        self._emit()
+
+    def advance(self, n: int) -> None:
+        self.done += n
+        self._emit()
+
+    def _emit(self) -> None:
+        if self.callback is None:
+            return
+        p = TransferProgress(done=self.done, total=self.total, elapsed=time.perf_counter() - self._t0)
+        # отмена после последнего блока уже ничего не экономит — операцию завершаем
+        if self.callback(p) is False and self.done < self.total:
+            raise OperationCancelled("Операция отменена")
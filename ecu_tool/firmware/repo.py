@@ -0,0 +1,147 @@
+# firmware/repo.py
+"""
+Хранилище образов прошивок с дедупликацией по содержимому.
+
+Образ режется на блоки фиксированного размера; каждый уникальный блок
+лежит один раз в objects/<2 символа>/<sha256>, при желании сжатый
+zlib/lzma. Сам образ — это манифест images/<имя>.json со списком хэшей
+блоков. Почти одинаковые дампы (dump/saved/patched) делят почти все
+блоки, так что место растёт с числом различий, а не с числом дампов.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import lzma
+import os
+import re
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+REPO_BLOCK = 4096
+MANIFEST_VERSION = 1
+
+# первый байт объекта — способ сжатия
+_CODECS = {
+    "none": (b"N", lambda b: b, lambda b: b),
+    "zlib": (b"Z", lambda b: zlib.compress(b, 9), zlib.decompress),
+    "lzma": (b"X", lzma.compress, lzma.decompress),
+}
+_BY_TAG = {tag: dec for tag, _, dec in _CODECS.values()}
+
+_NAME_RE = re.compile(r"^[\w.\-]+$")
+
+
+class FirmwareRepo:
+    def __init__(self, root: Path, block_size: int = REPO_BLOCK, compression: str = "zlib"):
+        if compression not in _CODECS:
+            raise ValueError(f"Неизвестное сжатие: {compression} (есть: {', '.join(_CODECS)})")
+        self.root = Path(root)
+        self.block_size = block_size
+        self.compression = compression
+        self.objects = self.root / "objects"
+        self.images = self.root / "images"
+
+    # ---------- объекты ----------
+    def _object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest
+
+    def _put_block(self, block: bytes) -> tuple[str, bool]:
+        """Сохранить блок, если его ещё нет. Возвращает (хэш, новый ли)."""
+        digest = hashlib.sha256(block).hexdigest()
+        path = self._object_path(digest)
+        if path.exists():
+            return digest, False
+        tag, enc, _ = _CODECS[self.compression]
+        payload = enc(block)
+        if len(payload) >= len(block):
+            tag, payload = b"N", block  # не сжимается — храним как есть
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(tag + payload)
+        os.replace(tmp, path)
+        return digest, True
+
+    def _get_block(self, digest: str) -> bytes:
+        raw = self._object_path(digest).read_bytes()
+        block = _BY_TAG[raw[:1]](raw[1:])
+        if hashlib.sha256(block).hexdigest() != digest:
+            raise ValueError(f"Повреждён блок {digest}")
+        return block
+
+    # ---------- образы ----------
+    def _manifest_path(self, name: str) -> Path:
+        if not _NAME_RE.match(name):
+            raise ValueError(f"Недопустимое имя образа: {name!r}")
+        return self.images / f"{name}.json"
+
+    def import_image(self, path: Path, name: str | None = None, force: bool = False) -> dict:
+        path = Path(path)
+        name = name or path.stem
+        manifest_path = self._manifest_path(name)
+        if manifest_path.exists() and not force:
+            raise FileExistsError(f"Образ {name} уже есть в хранилище")
+        data = path.read_bytes()
+        view = memoryview(data)
+        blocks, new, new_bytes = [], 0, 0
+        for off in range(0, len(data), self.block_size):
+            block = bytes(view[off:off + self.block_size])
+            digest, is_new = self._put_block(block)
+            blocks.append(digest)
+            if is_new:
+                new += 1
+                new_bytes += self._object_path(digest).stat().st_size
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "name": name,
+            "size": len(data),
+            "block": self.block_size,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "crc32": f"0x{zlib.crc32(data) & 0xFFFFFFFF:08X}",
+            "source": str(path),
+            "created": datetime.utcnow().isoformat() + "Z",
+            "blocks": blocks,
+        }
+        self.images.mkdir(parents=True, exist_ok=True)
+        tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+        tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, manifest_path)
+        return {"name": name, "size": len(data), "blocks": len(blocks), "new_blocks": new,
+                "reused_blocks": len(blocks) - new, "stored_bytes": new_bytes}
+
+    def manifest(self, name: str) -> dict:
+        path = self._manifest_path(name)
+        if not path.exists():
+            raise FileNotFoundError(f"Образа {name} нет в хранилище")
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def checkout(self, name: str, out_path: Path) -> Path:
+        m = self.manifest(name)
+        out_path = Path(out_path)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        tmp = out_path.with_name(out_path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            for h in m["blocks"]:
+                block = self._get_block(h)
+                digest.update(block)
+                f.write(block)
+        if digest.hexdigest() != m["sha256"]:
+            tmp.unlink()
+            raise ValueError(f"Контрольная сумма образа {name} не сошлась")
+        os.replace(tmp, out_path)
+        return out_path
+
+    def list_images(self) -> list[dict]:
+        out = []
+        for p in sorted(self.images.glob("*.json")):
+            m = json.loads(p.read_text(encoding="utf-8"))
+            out.append({k: m[k] for k in ("name", "size", "crc32", "created", "source")})
+        return out
+
+    def stats(self) -> dict:
+        files = [p for p in self.objects.glob("*/*") if not p.name.endswith(".tmp")]
+        images = list(self.images.glob("*.json"))
+        logical = sum(json.loads(p.read_text(encoding="utf-8"))["size"] for p in images)
+        return {"images": len(images), "objects": len(files),
+                "stored_bytes": sum(p.stat().st_size for p in files), "logical_bytes": logical}
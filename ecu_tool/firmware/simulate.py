@@ -1,49 +1,81 @@
 # firmware/simulate.py
-import os
-import struct
 from pathlib import Path
-from .map import FLASH, REGIONS
+from .map import REGIONS, Region, locate, total_size
+from .store import MappedImage, PageCache, create_sparse_image
+from .hashtree import BlockHashTree
 
 class SimECU:
     """
     Очень простой симулятор ЭБУ:
     - хранит "прошивку" в файле .bin (создаётся при первом запуске)
-    - умеет читать/писать байты по адресам
-    - считает примитивный CRC32 для валидации
+    - файл отображается в память (mmap): чтение идёт на месте
+    - запись копится в кэше страниц и фиксируется в flush() через журнал,
+      так что прерванная прошивка не оставляет образ наполовину записанным
+    - память может состоять из нескольких регионов (boot/code/calib):
+      в файле они лежат подряд, адреса переводятся через map.locate()
+    - новый образ разреженный: незаписанные страницы читаются как 0xFF
+      и не занимают ни памяти, ни диска
+    - держит дерево CRC32 по блокам: после записи пересчитываются
+      только затронутые блоки, CRC32 образа берётся из кэша
     """
-    def __init__(self, store: Path):
+    def __init__(self, store: Path, regions: list[Region] | None = None):
         self.store = Path(store)
-        self.store.parent.mkdir(parents=True, exist_ok=True)
+        self.regions = list(regions or REGIONS)
+        size = total_size(self.regions)
         if not self.store.exists():
-            # создаём "прошивку": 0xFF + сигнатура
-            image = bytearray([0xFF] * FLASH.size)
-            sign = b"SIM-J72\0"
-            image[0:len(sign)] = sign
-            self.store.write_bytes(image)
-
-    def read(self, addr: int, size: int) -> bytes:
-        data = bytearray(self.store.read_bytes())
-        end = addr + size
-        if addr < 0 or end > len(data):
-            raise ValueError("Read out of range")
-        return bytes(data[addr:end])
+            # создаём "прошивку": 0xFF (дыры) + сигнатура
+            create_sparse_image(self.store, size)
+            cache = PageCache(MappedImage(self.store))
+            cache.write(0, b"SIM-J72\0")
+            cache.commit()
+            cache.close()
+        self.image = MappedImage(self.store)
+        if self.image.size != size:
+            self.image.close()
+            raise ValueError(f"Образ {self.store} ({self.image.size} байт) не совпадает "
+                             f"с раскладкой памяти ({size} байт)")
+        self.cache = PageCache(self.image)
+        self.hashes = BlockHashTree(self.cache.read, self.cache.size,
+                                    block_size=self.cache.page_size, blank=self.cache.is_blank)
+
+    def read(self, addr: int, size: int) -> memoryview:
+        # срез без копирования (если не задеты грязные/пустые страницы); действителен до close()
+        return self.cache.read(locate(self.regions, addr, size), size)
 
     def write(self, addr: int, chunk: bytes):
-        data = bytearray(self.store.read_bytes())
-        end = addr + len(chunk)
-        if addr < 0 or end > len(data):
-            raise ValueError("Write out of range")
-        data[addr:end] = chunk
-        self.store.write_bytes(bytes(data))
+        off = locate(self.regions, addr, len(chunk))
+        self.cache.write(off, chunk)
+        self.hashes.touch(off, len(chunk))
+
+    def flush(self) -> int:
+        return self.cache.commit()
+
+    def rollback(self) -> int:
+        """Отбросить незафиксированные записи (отмена/ошибка прошивки); возвращает число страниц."""
+        pages = self.cache.dirty_pages()
+        self.cache.rollback()
+        # CRC затронутых блоков снова должны совпасть с образом
+        for p in pages:
+            self.hashes.touch(p * self.cache.page_size, self.cache.page_size)
+        return len(pages)
+
+    def close(self):
+        # незафиксированные записи отбрасываются
+        self.cache.close()
 
     def crc32(self) -> int:
-        import zlib
-        return zlib.crc32(self.store.read_bytes()) & 0xFFFFFFFF
+        return self.hashes.crc32()
+
+    def block_crcs(self) -> list[int]:
+        return self.hashes.block_crcs()
 
     def info(self) -> dict:
         return {
-            "regions": [r.__dict__ for r in REGIONS],
-            "size": FLASH.size,
+            "regions": [r.__dict__ for r in self.regions],
+            "size": self.cache.size,
+            "pages_written": len(self.cache.present_pages()),
             "crc32": f"0x{self.crc32():08X}",
+            "block_size": self.hashes.block_size,
+            "block_crc32": [f"0x{c:08X}" for c in self.block_crcs()],
             "store": str(self.store)
         }
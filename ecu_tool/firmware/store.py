@@ -0,0 +1,267 @@
+# firmware/store.py
+from __future__ import annotations
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+
+class MappedImage:
+    """
+    Образ памяти в файле, отображённый в адресное пространство через mmap:
+    - view() отдаёт memoryview на срез без копирования
+    - write() меняет байты на месте, файл целиком не перезаписывается
+    - flush() явно сбрасывает изменения на диск (msync + fsync)
+
+    Срезы, выданные view(), действительны до close().
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._f = open(self.path, "r+b")
+        self.size = os.fstat(self._f.fileno()).st_size
+        if self.size == 0:
+            self._f.close()
+            raise ValueError(f"Пустой файл образа: {self.path}")
+        self._mm = mmap.mmap(self._f.fileno(), self.size)
+        self._view = memoryview(self._mm)
+
+    def view(self, offset: int, size: int) -> memoryview:
+        end = offset + size
+        if offset < 0 or size < 0 or end > self.size:
+            raise ValueError("Read out of range")
+        return self._view[offset:end]
+
+    def write(self, offset: int, data: bytes) -> None:
+        end = offset + len(data)
+        if offset < 0 or end > self.size:
+            raise ValueError("Write out of range")
+        self._view[offset:end] = data
+
+    def flush(self) -> None:
+        self._mm.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self.flush()
+        self._view.release()
+        try:
+            self._mm.close()
+        except BufferError:
+            # снаружи ещё живут срезы view(): отображение освободится вместе с ними
+            pass
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+PAGE_SIZE = 4096
+_JOURNAL_MAGIC = b"SIMJ"
+_JOURNAL_HEAD = struct.Struct("<4sII")   # magic, page_size, число страниц
+_JOURNAL_PAGE = struct.Struct("<II")     # номер страницы, длина данных
+_JOURNAL_TAIL = struct.Struct("<I")      # CRC32 всего, что выше
+
+
+class PageCache:
+    """
+    Кэш страниц с отложенной записью поверх MappedImage.
+    - write() меняет только копии страниц в памяти и помечает их «грязными»
+    - commit() пишет грязные страницы пачкой через журнал:
+      <образ>.journal.tmp -> fsync -> rename в <образ>.journal -> применяем
+      к образу -> fsync -> удаляем журнал
+    - при открытии полный журнал докатывается, неполный отбрасывается
+
+    Так прерванная запись не оставляет образ «наполовину» изменённым,
+    а стоимость commit() пропорциональна числу грязных страниц.
+    Незакоммиченные изменения при close() отбрасываются.
+
+    Разреженный образ (см. create_sparse_image) ведёт рядом карту
+    записанных страниц <образ>.pages: незаписанные страницы читаются как
+    fill и не занимают ни памяти, ни места на диске (дыры в файле).
+    Образ без карты считается плотным — все страницы записаны.
+    """
+    def __init__(self, image: MappedImage, page_size: int = PAGE_SIZE, fill: int = 0xFF):
+        self.image = image
+        self.page_size = page_size
+        self.size = image.size
+        self.pages = (self.size + page_size - 1) // page_size
+        self.journal = image.path.with_name(image.path.name + ".journal")
+        self.page_map = image.path.with_name(image.path.name + ".pages")
+        self._blank = bytes([fill]) * page_size
+        self._dirty: dict[int, bytearray] = {}
+        self._present: bytearray | None = None
+        if self.page_map.exists():
+            self._present = bytearray(self.page_map.read_bytes()).ljust((self.pages + 7) // 8, b"\0")
+        self._recover()
+
+    # ---------- чтение / запись ----------
+    def read(self, offset: int, size: int) -> memoryview:
+        end = offset + size
+        if offset < 0 or size < 0 or end > self.size:
+            raise ValueError("Read out of range")
+        pages = range(offset // self.page_size, (end - 1) // self.page_size + 1) if size else ()
+        if not any(p in self._dirty or not self.is_present(p) for p in pages):
+            return self.image.view(offset, size)
+        # диапазон задевает грязные или незаписанные страницы: собираем копию
+        out = bytearray(size)
+        for p in pages:
+            base = p * self.page_size
+            lo, hi = max(offset, base), min(end, base + self.page_size)
+            out[lo - offset:hi - offset] = self._page(p)[lo - base:hi - base]
+        return memoryview(out)
+
+    def write(self, offset: int, data: bytes) -> None:
+        end = offset + len(data)
+        if offset < 0 or end > self.size:
+            raise ValueError("Write out of range")
+        src = memoryview(data)
+        pos = offset
+        while pos < end:
+            p = pos // self.page_size
+            base = p * self.page_size
+            hi = min(end, base + self.page_size)
+            page = self._dirty.get(p)
+            if page is None:
+                page = self._dirty[p] = bytearray(self._page(p))
+            page[pos - base:hi - base] = src[pos - offset:hi - offset]
+            pos = hi
+
+    def is_present(self, page: int) -> bool:
+        """Страница когда-либо записывалась (для плотного образа — всегда)."""
+        return self._present is None or bool(self._present[page >> 3] & (1 << (page & 7)))
+
+    def is_blank(self, page: int) -> bool:
+        """Страница гарантированно заполнена fill: не записана и не грязная."""
+        return page not in self._dirty and not self.is_present(page)
+
+    def present_pages(self) -> list[int]:
+        return [p for p in range(self.pages) if self.is_present(p)]
+
+    def dirty_pages(self) -> list[int]:
+        return sorted(self._dirty)
+
+    # ---------- фиксация ----------
+    def commit(self) -> int:
+        """Атомарно записать грязные страницы. Возвращает их количество."""
+        # страницы, так и оставшиеся пустыми, на диск не пишем — образ остаётся разреженным
+        pages = [(p, data) for p, data in sorted(self._dirty.items())
+                 if self.is_present(p) or data != self._blank[:len(data)]]
+        if not pages:
+            self._dirty.clear()
+            return 0
+        tmp = self.journal.with_name(self.journal.name + ".tmp")
+        crc = 0
+        with open(tmp, "wb") as f:
+            def put(chunk):
+                nonlocal crc
+                crc = zlib.crc32(chunk, crc)
+                f.write(chunk)
+            put(_JOURNAL_HEAD.pack(_JOURNAL_MAGIC, self.page_size, len(pages)))
+            for p, data in pages:
+                put(_JOURNAL_PAGE.pack(p, len(data)))
+                put(data)
+            f.write(_JOURNAL_TAIL.pack(crc & 0xFFFFFFFF))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal)
+        _fsync_dir(self.journal.parent)
+        self._apply([(p * self.page_size, data) for p, data in pages])
+        self._dirty.clear()
+        return len(pages)
+
+    def rollback(self) -> None:
+        self._dirty.clear()
+
+    def close(self) -> None:
+        self.rollback()
+        self.image.close()
+
+    # ---------- внутреннее ----------
+    def _page(self, p: int):
+        page = self._dirty.get(p)
+        if page is not None:
+            return page
+        length = min(self.page_size, self.size - p * self.page_size)
+        if not self.is_present(p):
+            return memoryview(self._blank)[:length]
+        return self.image.view(p * self.page_size, length)
+
+    def _apply(self, pages) -> None:
+        for offset, data in pages:
+            self.image.write(offset, data)
+        self.image.flush()
+        if self._present is not None:
+            for offset, _ in pages:
+                p = offset // self.page_size
+                self._present[p >> 3] |= 1 << (p & 7)
+            tmp = self.page_map.with_name(self.page_map.name + ".tmp")
+            with open(tmp, "wb") as f:
+                f.write(self._present)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.page_map)
+        self.journal.unlink()
+        _fsync_dir(self.journal.parent)
+
+    def _recover(self) -> None:
+        tmp = self.journal.with_name(self.journal.name + ".tmp")
+        if tmp.exists():
+            tmp.unlink()  # журнал не дописан -> образ не трогали
+        if not self.journal.exists():
+            return
+        pages = _read_journal(self.journal.read_bytes())
+        if pages is None:
+            self.journal.unlink()
+            return
+        self._apply(pages)
+
+
+def create_sparse_image(path: Path, size: int) -> None:
+    """
+    Создать разреженный образ: файл нужного размера без данных (дыры)
+    и пустую карту страниц. Писать в него — через PageCache.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.with_name(path.name + ".pages").write_bytes(b"")
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _read_journal(raw: bytes):
+    """Разобрать журнал в [(смещение, данные)]; None — если он битый или неполный."""
+    if len(raw) < _JOURNAL_HEAD.size + _JOURNAL_TAIL.size:
+        return None
+    body, (crc,) = raw[:-_JOURNAL_TAIL.size], _JOURNAL_TAIL.unpack(raw[-_JOURNAL_TAIL.size:])
+    if zlib.crc32(body) & 0xFFFFFFFF != crc:
+        return None
+    magic, page_size, count = _JOURNAL_HEAD.unpack_from(body)
+    if magic != _JOURNAL_MAGIC:
+        return None
+    pages, pos = [], _JOURNAL_HEAD.size
+    for _ in range(count):
+        p, n = _JOURNAL_PAGE.unpack_from(body, pos)
+        pos += _JOURNAL_PAGE.size
+        pages.append((p * page_size, body[pos:pos + n]))
+        pos += n
+    return pages
+
+
+def _fsync_dir(path: Path) -> None:
+    # на Windows каталог так не открыть — там rename и так атомарен
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,116 @@
+# firmware/timing.py
+"""
+Модель таймингов K-Line (ISO 14230 / KWP2000) для симулятора.
+
+Симулятор отвечает мгновенно, а на машине каждый запрос стоит:
+накладные адаптера + передача запроса побайтно на скорости линии
++ пауза ЭБУ P2 + передача ответа + пауза тестера P3 перед следующим
+запросом. Модель считает это время (виртуальные часы или реальный sleep)
+и по желанию вбрасывает таймауты/отрицательные ответы с фиксированным
+seed, чтобы прогоны повторялись.
+"""
+from __future__ import annotations
+import random
+import time
+from dataclasses import dataclass
+
+MAX_FRAME_PAYLOAD = 255  # длина данных кадра KWP (SID + параметры) — один байт
+
+
+@dataclass
+class KLineTiming:
+    baud: int = 10400
+    bits_per_byte: int = 10        # 8N1: старт + 8 бит + стоп
+    request_overhead: float = 0.0  # накладные на запрос (USB, прошивка ELM), с
+    p1: float = 0.0                # межбайтовая пауза ЭБУ в ответе, с
+    p2: float = 0.025              # пауза ЭБУ перед ответом (P2min), с
+    p2_max: float = 0.050          # сколько ждём ответа до таймаута, с
+    p3: float = 0.055              # пауза перед следующим запросом (P3min), с
+    p4: float = 0.0                # межбайтовая пауза тестера в запросе, с
+    header_bytes: int = 3          # fmt + target + source
+    error_rate: float = 0.0        # доля запросов без ответа
+    negative_rate: float = 0.0     # доля отрицательных ответов (7F xx NRC)
+    negative_code: int = 0x21      # busyRepeatRequest
+    seed: int = 0
+    realtime: bool = False         # True — реально ждать, иначе виртуальные часы
+
+    @property
+    def byte_time(self) -> float:
+        return self.bits_per_byte / self.baud
+
+    def frame_bytes(self, payload: int) -> int:
+        # при данных > 63 байт длина идёт отдельным байтом; +1 — контрольная сумма
+        return self.header_bytes + (1 if payload > 63 else 0) + payload + 1
+
+
+class SimLinkTimeout(TimeoutError):
+    """ЭБУ не ответил за P2max (вброшенная ошибка линии)."""
+
+
+class SimNegativeResponse(RuntimeError):
+    """Вброшенный отрицательный ответ 7F <sid> <nrc>."""
+    def __init__(self, sid: int, nrc: int):
+        super().__init__(f"Negative response: 7F {sid:02X} {nrc:02X}")
+        self.sid = sid
+        self.nrc = nrc
+
+
+class KLineLink:
+    """Счётчик времени и статистики обмена по модели KLineTiming."""
+    def __init__(self, timing: KLineTiming):
+        self.timing = timing
+        self._rng = random.Random(timing.seed)
+        self.elapsed = 0.0
+        self.requests = 0
+        self.bytes_tx = 0
+        self.bytes_rx = 0
+        self.errors = 0
+        self.negative = 0
+
+    def transact(self, sid: int, req_payload: int, resp_payload: int) -> None:
+        """
+        Учесть один запрос/ответ. Бросает SimLinkTimeout/SimNegativeResponse,
+        если модель решила вбросить ошибку (время при этом тоже тратится).
+        """
+        t = self.timing
+        if max(req_payload, resp_payload) > MAX_FRAME_PAYLOAD:
+            raise ValueError(f"KWP frame too long: {max(req_payload, resp_payload)} > {MAX_FRAME_PAYLOAD} bytes")
+        req = t.frame_bytes(req_payload)
+        dt = t.request_overhead + req * t.byte_time + max(0, req - 1) * t.p4
+        self.requests += 1
+        self.bytes_tx += req
+        roll = self._rng.random()
+        if roll < t.error_rate:
+            self.errors += 1
+            self._spend(dt + t.p2_max + t.p3)
+            raise SimLinkTimeout(f"No response to SID {sid:02X} within P2max")
+        if roll < t.error_rate + t.negative_rate:
+            self.negative += 1
+            resp = t.frame_bytes(3)
+            self.bytes_rx += resp
+            self._spend(dt + t.p2 + resp * t.byte_time + t.p3)
+            raise SimNegativeResponse(sid, t.negative_code)
+        resp = t.frame_bytes(resp_payload)
+        self.bytes_rx += resp
+        dt += t.p2 + resp * t.byte_time + max(0, resp - 1) * t.p1 + t.p3
+        self._spend(dt)
+
+    def idle(self, seconds: float) -> None:
+        """Пауза тестера между запросами (напр. перед повтором) — по часам модели."""
+        self._spend(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "baud": self.timing.baud,
+            "requests": self.requests,
+            "bytes_tx": self.bytes_tx,
+            "bytes_rx": self.bytes_rx,
+            "errors": self.errors,
+            "negative": self.negative,
+            "elapsed_s": round(self.elapsed, 3),
+        }
+
+    def _spend(self, dt: float) -> None:
+        self.elapsed += dt
+        if self.timing.realtime:
+            time.sleep(dt)
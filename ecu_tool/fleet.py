@@ -0,0 +1,129 @@
+# fleet.py
+"""
+Операции сразу на всех адаптерах стенда.
+
+Каждый порт обслуживается корутиной на AsyncELM327; все они крутятся в
+одном цикле событий, одновременно не больше limit штук. Общее время —
+примерно как у самого медленного блока, а не сумма по всем.
+Для каждого порта пишется <out_dir>/<порт>.json: результат + протокол
+обмена (команда, ответ, время).
+"""
+from __future__ import annotations
+import asyncio
+import json
+import re
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from serial.tools import list_ports
+
+try:
+    from .ecu_transport.aio import AsyncELM327, AsyncKWP2000
+    from .ecu_transport.elm327 import KWP_HEADER
+    from .diag.dtc import parse_obd_dtc
+    from .firmware.map import REGIONS, Region
+except ImportError:
+    from ecu_transport.aio import AsyncELM327, AsyncKWP2000
+    from ecu_transport.elm327 import KWP_HEADER
+    from diag.dtc import parse_obd_dtc
+    from firmware.map import REGIONS, Region
+
+DEFAULT_LIMIT = 8
+PROBE_TIMEOUT = 0.5     # ATI: живой адаптер отвечает за десятки мс
+READ_BLOCK = 254
+
+
+class _LoggedELM327(AsyncELM327):
+    """AsyncELM327, который ведёт протокол обмена для отчёта по порту."""
+    def __init__(self, port: str, **kw):
+        super().__init__(port, **kw)
+        self.log: list[dict] = []
+        self._t0 = time.monotonic()
+
+    async def _command(self, cmd: str, timeout: float) -> str:
+        resp = await super()._command(cmd, timeout)
+        # ответы на чтение памяти длинные — в протокол только начало
+        self.log.append({"t": round(time.monotonic() - self._t0, 3), "cmd": cmd,
+                         "resp": resp if len(resp) <= 80 else resp[:80] + "…"})
+        return resp
+
+
+def discover_ports() -> list[str]:
+    return [p.device for p in list_ports.comports()]
+
+
+def port_slug(port: str) -> str:
+    """'/dev/ttyUSB0' -> 'ttyUSB0', '/dev/pts/3' -> 'pts_3', 'COM3' -> 'COM3' (для имён файлов)."""
+    return re.sub(r"[^\w.-]", "_", port.removeprefix("/dev/"))
+
+
+async def _connect(elm: AsyncELM327) -> AsyncKWP2000:
+    await elm.init()
+    await elm.set_header(KWP_HEADER)
+    kwp = AsyncKWP2000(elm)
+    await kwp.start_session()
+    return kwp
+
+
+async def probe(elm: AsyncELM327) -> dict:
+    resp = await elm.send_at("ATI", PROBE_TIMEOUT)
+    # до init() эхо ещё включено — первая строка может быть самой командой
+    lines = [l.strip() for l in resp.replace(">", "").splitlines() if l.strip() and l.strip() != "ATI"]
+    ident = lines[-1] if lines else ""
+    if "ELM" not in ident.upper():
+        raise RuntimeError("адаптер не отвечает")
+    kwp = await _connect(elm)
+    ecu_id = bytes(await kwp.read_ecu_id())
+    return {"adapter": ident, "ecu_id": ecu_id.hex().upper()}
+
+
+async def read_dtc(elm: AsyncELM327) -> dict:
+    await elm.init()
+    raw = await elm.send_obd("03")
+    dtcs, _ = parse_obd_dtc(raw)
+    return {"dtcs": dtcs, "raw": raw}
+
+
+def read_fw(out_dir: Path, regions: list[Region] | None = None):
+    async def op(elm: AsyncELM327) -> dict:
+        kwp = await _connect(elm)
+        image = bytearray()
+        for r in regions or REGIONS:
+            for address in range(r.start, r.end, READ_BLOCK):
+                # повторы (0x21, нет ответа) и ожидание 7F 23 78 — внутри kwp.executor
+                image += await kwp.read_memory(address, size=min(READ_BLOCK, r.end - address))
+        out = Path(out_dir) / f"{port_slug(elm.port)}.bin"
+        out.write_bytes(image)
+        return {"out": str(out), "bytes": len(image), "retries": kwp.executor.stats.retries}
+    return op
+
+
+async def run_fleet(ports: list[str], op: Callable[[AsyncELM327], Awaitable[dict]],
+                    limit: int = DEFAULT_LIMIT, out_dir: Path | None = None) -> list[dict]:
+    """Выполнить op на всех портах параллельно (не больше limit одновременно)."""
+    sem = asyncio.Semaphore(limit)
+
+    async def one(port: str) -> dict:
+        async with sem:
+            t0 = time.monotonic()
+            elm = _LoggedELM327(port)
+            result = {"port": port, "ok": False}
+            try:
+                await elm.open()
+                result.update(await op(elm))
+                result["ok"] = True
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                await elm.close()
+            result["elapsed_s"] = round(time.monotonic() - t0, 3)
+            if out_dir is not None:
+                report = dict(result, log=elm.log)
+                (Path(out_dir) / f"{port_slug(port)}.json").write_text(
+                    json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+            return result
+
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    return list(await asyncio.gather(*(one(p) for p in ports)))
@@ -7,9 +7,9 @@ from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QTabWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QFileDialog, QComboBox, QCheckBox, QMessageBox,
     QSpinBox, QSlider, QLineEdit, QToolBar, QStatusBar, QGroupBox, QSplitter, QFrame,
-    QTextEdit, QTableView, QProgressDialog
+    QTextEdit, QTableView, QProgressDialog, QTableWidget, QTableWidgetItem
 )
-from PySide6.QtCore import Qt, QModelIndex, QPointF, Signal
+from PySide6.QtCore import Qt, QModelIndex, QPointF, Signal, QThread, QTimer
 from PySide6.QtGui import (
     QAction,
     QFontDatabase,
@@ -30,22 +30,30 @@ from PySide6.QtDataVisualization import (
 
 # ---- Пакетные импорты (работают и в .exe, и из исходников)
 try:
-    from ..config import LOG_FILE
+    from ..config import CHUNK_PROFILE_FILE, log_event
     from ..diag.dtc import parse_obd_dtc
     from ..ai_assistant.engine import Assistant
     from ..ecu_transport.elm327 import ELM327
     from ..firmware.io import SimBackend, RealBackend, dump_firmware, flash_firmware
+    from ..firmware.progress import OperationCancelled
+    from ..firmware.adaptive import ChunkProfile
     from ..firmware.tune import read_params, write_params, TuneParams, blank_params
+    from ..ecu_transport.metrics import LINK_STATS
     from ..kwp_tools import kwp_ping
+    from ..daemon import DaemonClient, DaemonBackend
     from .hex_model import HexTableModel, BYTES_PER_ROW
 except ImportError:
-    from config import LOG_FILE
+    from config import CHUNK_PROFILE_FILE, log_event
     from diag.dtc import parse_obd_dtc
     from ai_assistant.engine import Assistant
     from ecu_transport.elm327 import ELM327
     from firmware.io import SimBackend, RealBackend, dump_firmware, flash_firmware
+    from firmware.progress import OperationCancelled
+    from firmware.adaptive import ChunkProfile
     from firmware.tune import read_params, write_params, TuneParams, blank_params
+    from ecu_transport.metrics import LINK_STATS
     from kwp_tools import kwp_ping
+    from daemon import DaemonClient, DaemonBackend
     from gui.hex_model import HexTableModel, BYTES_PER_ROW
 
 # ---------- ресурсы (rules.json) ----------
@@ -145,6 +153,36 @@ class MixChartView(QChartView):
         self._drag_index = None
         super().mouseReleaseEvent(event)
 
+class FirmwareWorker(QThread):
+    """Подключается к ЭБУ и выполняет dump_firmware/flash_firmware вне UI-потока."""
+
+    progress = Signal(object)   # TransferProgress
+    done = Signal(dict)
+    failed = Signal(str)
+    cancelled = Signal()
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self._job = job          # job(progress_callback) -> dict
+        self._cancel = False
+
+    def cancel(self):
+        self._cancel = True
+
+    def run(self):
+        try:
+            result = self._job(self._on_progress)
+        except OperationCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.done.emit(result)
+
+    def _on_progress(self, p) -> bool:
+        self.progress.emit(p)
+        return not self._cancel
+
 # ---------- MainWindow ----------
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -157,10 +195,12 @@ class MainWindow(QMainWindow):
         act_gui = QAction("Главная", self)
         act_hex = QAction("Hex-редактор", self)
         act_tune = QAction("Тюнинг", self)
-        tb.addAction(act_gui); tb.addAction(act_hex); tb.addAction(act_tune)
+        act_stats = QAction("Статистика линии", self)
+        tb.addAction(act_gui); tb.addAction(act_hex); tb.addAction(act_tune); tb.addAction(act_stats)
         act_gui.triggered.connect(lambda: self.tabs.setCurrentWidget(self.page_dash))
         act_hex.triggered.connect(lambda: self.tabs.setCurrentWidget(self.page_hex))
         act_tune.triggered.connect(lambda: self.tabs.setCurrentWidget(self.page_tune))
+        act_stats.triggered.connect(lambda: self.tabs.setCurrentWidget(self.page_stats))
 
         self.setStatusBar(QStatusBar())
 
@@ -169,6 +209,7 @@ class MainWindow(QMainWindow):
         self._build_dashboard()
         self._build_hex_editor()
         self._build_tune_tab()
+        self._build_stats_tab()
 
         # state
         self.current_fw_path: Path | None = None
@@ -183,7 +224,8 @@ class MainWindow(QMainWindow):
         self.cb_ports = QComboBox()
         self.btn_refresh = QPushButton("Обновить порты")
         self.chk_demo = QCheckBox("Демо"); self.chk_demo.setChecked(True)
-        self.sp_chunk = QSpinBox(); self.sp_chunk.setRange(64, 8192); self.sp_chunk.setValue(512)
+        self.sp_chunk = QSpinBox(); self.sp_chunk.setRange(0, 8192); self.sp_chunk.setValue(0)
+        self.sp_chunk.setSpecialValueText("авто")  # 0 — подбирать размер блока по линии
         layc.addWidget(QLabel("Порт:")); layc.addWidget(self.cb_ports, 1)
         layc.addWidget(self.btn_refresh); layc.addWidget(self.chk_demo)
         layc.addWidget(QLabel("Блок, байт:")); layc.addWidget(self.sp_chunk)
@@ -378,6 +420,60 @@ class MainWindow(QMainWindow):
         self.tune_params = blank_params()
         self._refresh_tune_graph()
 
+    # ----------- Статистика обмена с адаптером -----------
+    STATS_COLUMNS = ("Слой", "Сервис", "Запросов", "Ошибок", "Таймаутов", "Повторов",
+                     "p50, мс", "p95, мс", "p99, мс", "Байт ↑", "Байт ↓", "NRC")
+
+    def _build_stats_tab(self):
+        w = QWidget(); root = QVBoxLayout(w)
+        controls = QHBoxLayout()
+        btn_reset = QPushButton("Сбросить")
+        btn_export = QPushButton("Записать в журнал")
+        self.lbl_stats = QLabel("")
+        controls.addWidget(btn_reset); controls.addWidget(btn_export); controls.addWidget(self.lbl_stats, 1)
+        root.addLayout(controls)
+
+        self.tbl_stats = QTableWidget(0, len(self.STATS_COLUMNS))
+        self.tbl_stats.setHorizontalHeaderLabels(self.STATS_COLUMNS)
+        self.tbl_stats.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        root.addWidget(self.tbl_stats, 1)
+
+        btn_reset.clicked.connect(lambda: (LINK_STATS.reset(), self._refresh_stats()))
+        btn_export.clicked.connect(self._export_stats)
+        # обновляем, только пока вкладка на экране
+        self.stats_timer = QTimer(self); self.stats_timer.setInterval(1000)
+        self.stats_timer.timeout.connect(self._refresh_stats)
+        self.tabs.currentChanged.connect(
+            lambda _: self.stats_timer.start() if self.tabs.currentWidget() is self.page_stats
+            else self.stats_timer.stop())
+
+        self.page_stats = w
+        self.tabs.addTab(w, "Статистика линии")
+
+    def _refresh_stats(self):
+        snap = LINK_STATS.snapshot()
+        rows = [(layer, key, st) for layer, services in snap.items() for key, st in services.items()]
+        self.tbl_stats.setRowCount(len(rows))
+        for r, (layer, key, st) in enumerate(rows):
+            nrc = " ".join(f"{k}×{v}" for k, v in st["nrc"].items())
+            name = f"{key} {st['name']}" if st["name"] != key else key
+            values = (layer, name, st["count"], st["errors"], st["timeouts"], st["retries"],
+                      f"{st['p50_ms']:.1f}", f"{st['p95_ms']:.1f}", f"{st['p99_ms']:.1f}",
+                      st["bytes_tx"], st["bytes_rx"], nrc)
+            for c, v in enumerate(values):
+                self.tbl_stats.setItem(r, c, QTableWidgetItem(str(v)))
+        # время хоста: kwp − elm по сервису
+        kwp, elm = snap.get("kwp", {}), snap.get("elm", {})
+        parts = [f"{kwp[k]['name']}: линия+ЭБУ {elm[k]['mean_ms']:.1f} мс, хост "
+                 f"{kwp[k]['mean_ms'] - elm[k]['mean_ms']:.2f} мс" for k in sorted(kwp.keys() & elm.keys())]
+        self.lbl_stats.setText(" · ".join(parts))
+
+    def _export_stats(self):
+        if LINK_STATS.empty():
+            self._log("<span style='color:#d7ba7d'>Статистики пока нет.</span>"); return
+        log_event("link_stats", LINK_STATS.snapshot())
+        self._log("<span style='color:#7ed321'>Статистика обмена записана в журнал.</span>")
+
     def _chart_point_moved(self, idx: int, val: int):
         """Обновить параметры при перетаскивании точки на графике."""
         if 0 <= idx < len(self.tune_params.mixture):
@@ -411,14 +507,30 @@ class MainWindow(QMainWindow):
         import re
         return re.sub("<[^<]+?>", "", html)
 
-    def _backend(self):
+    def _backend_factory(self):
+        """
+        Как открыть бэкенд — по состоянию окна; само открытие (ATZ, инициализация
+        шины, сессия — до нескольких секунд) идёт в FirmwareWorker.
+        None — порт не выбран.
+        """
         if self.chk_demo.isChecked():
-            return SimBackend(Path("logs/sim_ecu.bin"))
+            return lambda: SimBackend(Path("logs/sim_ecu.bin"))
         port = self._current_port()
         if not port:
-            raise RuntimeError("COM-порт не выбран")
-        elm = ELM327(port)
-        return RealBackend(adapter=elm, developer_mode=False)
+            return None
+
+        def make():
+            # запущен демон — адаптер и сессия уже открыты там
+            client = DaemonClient.connect()
+            if client:
+                return DaemonBackend(client, port)
+            elm = ELM327(port)
+            try:
+                return RealBackend(adapter=elm, developer_mode=False)
+            except Exception:
+                elm.close()
+                raise
+        return make
 
     def _current_port(self) -> str | None:
         return self.cb_ports.currentData() if self.cb_ports.count() else None
@@ -442,6 +554,15 @@ class MainWindow(QMainWindow):
         port = self._current_port()
         if not port:
             QMessageBox.warning(self, "Порт", "Выбери COM-порт."); return
+        client = DaemonClient.connect()
+        if client:
+            try:
+                with client:
+                    res = client.call("ping", port=port)
+                self._log(f"<span style='color:#7ed321'>ECU ответил на KWP за {res['ms']:.1f} мс (через демон).</span>")
+            except Exception as e:
+                QMessageBox.critical(self, "KWP-ping", str(e))
+            return
         elm = ELM327(port)
         try:
             self._log("<b>Инициализация адаптера…</b>")
@@ -463,61 +584,108 @@ class MainWindow(QMainWindow):
             port = self._current_port()
             if not port:
                 QMessageBox.warning(self, "Порт", "Выбери COM-порт."); return
-            elm = ELM327(port)
-            try:
-                elm.init(); raw = elm.send_obd("03"); dtcs, _ = parse_obd_dtc(raw)
-            finally:
-                elm.close()
+            client = DaemonClient.connect()
+            if client:
+                with client:
+                    dtcs = client.call("read_dtc", port=port)["dtcs"]
+            else:
+                elm = ELM327(port)
+                try:
+                    elm.init(); raw = elm.send_obd("03"); dtcs, _ = parse_obd_dtc(raw)
+                finally:
+                    elm.close()
         if dtcs:
-            adv = assistant.advise_for_dtcs(dtcs)
+            adv = assistant.advise_batch(dtcs)
             html = f"<b>Найдены DTC:</b> {', '.join(dtcs)}<br><br><b>Рекомендации:</b><br>" + \
-                   "<br>".join([f"{a['code'] or '-'} — {a['title']}" for a in adv])
+                   "<br>".join([f"{', '.join(a['codes']) or '-'} — {a['title']}" for a in adv])
             self._log(html)
         else:
             self._log("<span style='color:#7ed321'>Коды неисправностей не обнаружены.</span>")
 
     def _do_ecu_info(self):
-        backend = self._backend()
-        try:
-            info = backend.info()
-            self._log("<b>Инфо ЭБУ:</b><br><pre style='margin-top:6px'>" +
-                      json.dumps(info, ensure_ascii=False, indent=2) + "</pre>")
-        finally:
-            if hasattr(backend, "close"):
-                backend.close()
+        make_backend = self._backend_factory()
+        if make_backend is None:
+            QMessageBox.warning(self, "Порт", "Выбери COM-порт."); return
+        self._run_fw_job(
+            "Чтение информации ЭБУ…", make_backend,
+            lambda backend, progress: backend.info(),
+            lambda info: self._log("<b>Инфо ЭБУ:</b><br><pre style='margin-top:6px'>" +
+                                   json.dumps(info, ensure_ascii=False, indent=2) + "</pre>"))
 
     def _do_read_fw(self):
+        make_backend = self._backend_factory()
+        if make_backend is None:
+            QMessageBox.warning(self, "Порт", "Выбери COM-порт."); return
         out, _ = QFileDialog.getSaveFileName(self, "Куда сохранить дамп", "logs/dump.bin", "BIN (*.bin)")
         if not out: return
-        backend = self._backend()
-        try:
-            prog = QProgressDialog("Чтение прошивки…", "Отмена", 0, 0, self); prog.setWindowModality(Qt.WindowModal); prog.show()
-            result = dump_firmware(backend, Path(out), self.sp_chunk.value())
-            prog.close()
-            self._log(f"<b>Дамп сохранён:</b> {result['out']} ({result['bytes']} байт)")
+        chunk = self.sp_chunk.value() or None
+
+        def done(result):
+            self._log(f"<b>Дамп сохранён:</b> {result['out']} ({result['bytes']} байт, блок {result['chunk']})")
             self._load_fw_to_hex(Path(out))
-        except Exception as e:
-            QMessageBox.critical(self, "Чтение прошивки", str(e))
-        finally:
-            if hasattr(backend, "close"):
-                backend.close()
+
+        self._run_fw_job(
+            "Чтение прошивки…", make_backend,
+            lambda backend, progress: dump_firmware(backend, Path(out), chunk,
+                                                    profile=ChunkProfile(CHUNK_PROFILE_FILE), progress=progress),
+            done)
 
     def _do_write_fw(self):
         if not self.current_fw_path or not self.current_fw_path.exists():
             QMessageBox.warning(self, "Нет файла", "Сначала открой/считай прошивку на вкладке Hex."); return
         if not self.chk_demo.isChecked():
             QMessageBox.critical(self, "Безопасность", "Запись на реальном ЭБУ отключена."); return
-        backend = self._backend()
-        try:
-            prog = QProgressDialog("Запись прошивки…", "Отмена", 0, 0, self); prog.setWindowModality(Qt.WindowModal); prog.show()
-            result = flash_firmware(backend, self.current_fw_path, self.sp_chunk.value())
+        make_backend = self._backend_factory()
+        chunk = self.sp_chunk.value() or None
+        path = self.current_fw_path
+        self._run_fw_job(
+            "Запись прошивки…", make_backend,
+            lambda backend, progress: flash_firmware(backend, path, chunk, progress=progress),
+            lambda result: self._log(f"<b>Записано:</b> {result['bytes']} байт из {result['source']}"))
+
+    def _run_fw_job(self, title: str, make_backend, job, on_done):
+        """
+        Открыть бэкенд make_backend() и выполнить job(backend, progress) в фоне:
+        живой прогресс, рабочая «Отмена», окно не замирает и на подключении.
+        Ошибка подключения приходит тем же сигналом failed.
+        """
+        def run(progress):
+            backend = make_backend()
+            try:
+                return job(backend, progress)
+            finally:
+                if hasattr(backend, "close"):
+                    backend.close()
+
+        prog = QProgressDialog(title, "Отмена", 0, 1000, self)
+        prog.setWindowModality(Qt.WindowModal)
+        prog.setAutoClose(False); prog.setAutoReset(False); prog.setMinimumDuration(0)
+        worker = FirmwareWorker(run, self)
+        self._fw_worker = worker  # держим ссылку, пока поток жив
+        for b in (self.btn_read, self.btn_write):
+            b.setEnabled(False)
+
+        def on_progress(p):
+            prog.setValue(int(p.fraction * 1000))
+            eta = f"{p.eta:.0f} с" if p.eta is not None else "—"
+            prog.setLabelText(f"{title}\n{p.done / 1024:.1f} из {p.total / 1024:.1f} КБ · "
+                              f"{p.rate / 1024:.2f} КБ/с · осталось {eta}")
+
+        def finish():
             prog.close()
-            self._log(f"<b>Записано:</b> {result['bytes']} байт из {result['source']}")
-        except Exception as e:
-            QMessageBox.critical(self, "Запись прошивки", str(e))
-        finally:
-            if hasattr(backend, "close"):
-                backend.close()
+            for b in (self.btn_read, self.btn_write):
+                b.setEnabled(True)
+            self._fw_worker = None
+
+        worker.progress.connect(on_progress)
+        worker.done.connect(on_done)
+        worker.failed.connect(lambda msg: QMessageBox.critical(self, title.rstrip("…"), msg))
+        worker.cancelled.connect(lambda: self._log("<span style='color:#d7ba7d'>Операция отменена.</span>"))
+        worker.finished.connect(finish)
+        worker.finished.connect(worker.deleteLater)
+        prog.canceled.connect(worker.cancel)
+        prog.show()
+        worker.start()
 
     def _open_fw_into_hex(self):
         path, _ = QFileDialog.getOpenFileName(self, "Открыть прошивку", "logs", "BIN (*.bin)")
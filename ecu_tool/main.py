@@ -1,27 +1,62 @@
 from __future__ import annotations
-import json, sys
+import asyncio, json, os, sys, time
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 
 import typer
 from rich import print
+from rich.table import Table
+from rich.progress import (
+    Progress, TextColumn, BarColumn, DownloadColumn, TransferSpeedColumn, TimeRemainingColumn,
+)
 from serial.tools import list_ports
 
 # --- сначала пакетные импорты (когда модуль загружается как ecu_tool.main),
 #     затем fallback для запуска файла напрямую из папки ecu_tool ---
 try:
-    from .config import LOG_FILE
+    from .config import LOG_FILE, CHUNK_PROFILE_FILE, FW_REPO_DIR, DAEMON_SOCKET, log_event
     from .diag.dtc import parse_obd_dtc
+    from .diag.live import LiveLogger, DatalogWriter, select_signals, OBD_BATCH
     from .ai_assistant.engine import Assistant
     from .ecu_transport.elm327 import ELM327
+    from .ecu_transport.emulator import ELM327Emulator
+    from .ecu_transport.metrics import LINK_STATS
+    from .ecu_transport.capture import CaptureWriter, ReplayELM327, read_capture, exchanges
+    from .firmware.simulate import SimECU
     from .firmware.io import SimBackend, RealBackend, dump_firmware, flash_firmware
+    from .firmware.progress import OperationCancelled
+    from .firmware.timing import KLineTiming
+    from .firmware.map import layout as memory_layout
+    from .firmware.checkpoint import checkpoint_path
+    from .firmware.adaptive import ChunkProfile
+    from .firmware.repo import FirmwareRepo
+    from .firmware.diff import make_patch, apply_patch, Patch
+    from .daemon import DaemonClient, DaemonBackend, DaemonServer
+    from .fleet import discover_ports, run_fleet, probe as fleet_probe, read_dtc as fleet_read_dtc, read_fw as fleet_read_fw, DEFAULT_LIMIT
+    from .analytics import analyze, log_files
     from .kwp_tools import kwp_ping          # <<< ВАЖНО: относительный импорт
 except ImportError:
-    from config import LOG_FILE
+    from config import LOG_FILE, CHUNK_PROFILE_FILE, FW_REPO_DIR, DAEMON_SOCKET, log_event
     from diag.dtc import parse_obd_dtc
+    from diag.live import LiveLogger, DatalogWriter, select_signals, OBD_BATCH
     from ai_assistant.engine import Assistant
     from ecu_transport.elm327 import ELM327
+    from ecu_transport.emulator import ELM327Emulator
+    from ecu_transport.metrics import LINK_STATS
+    from ecu_transport.capture import CaptureWriter, ReplayELM327, read_capture, exchanges
+    from firmware.simulate import SimECU
     from firmware.io import SimBackend, RealBackend, dump_firmware, flash_firmware
+    from firmware.progress import OperationCancelled
+    from firmware.timing import KLineTiming
+    from firmware.map import layout as memory_layout
+    from firmware.checkpoint import checkpoint_path
+    from firmware.adaptive import ChunkProfile
+    from firmware.repo import FirmwareRepo
+    from firmware.diff import make_patch, apply_patch, Patch
+    from daemon import DaemonClient, DaemonBackend, DaemonServer
+    from fleet import discover_ports, run_fleet, probe as fleet_probe, read_dtc as fleet_read_dtc, read_fw as fleet_read_fw, DEFAULT_LIMIT
+    from analytics import analyze, log_files
     from kwp_tools import kwp_ping           # fallback для запуска main.py напрямую
 
 # путь к rules.json, который работает и в exe (PyInstaller), и в исходниках
@@ -31,16 +66,90 @@ BASE_RES = Path(getattr(sys, "_MEIPASS", PKG_ROOT))
 DEFAULT_RULES_PATH = BASE_RES / "ai_assistant" / "rules.json"
 
 app = typer.Typer(add_completion=False, help="ECU CLI: DTC, dump/flash (DEMO), KWP-ping.")
+repo_app = typer.Typer(help="Хранилище прошивок с дедупликацией блоков.")
+app.add_typer(repo_app, name="repo")
+fleet_app = typer.Typer(help="Операции сразу на всех адаптерах стенда.")
+app.add_typer(fleet_app, name="fleet")
+daemon_app = typer.Typer(help="Фоновый процесс, который держит адаптеры и сессии KWP открытыми.")
+app.add_typer(daemon_app, name="daemon")
 
-def _log_event(kind: str, payload: dict):
-    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-    record = {
-        "ts": datetime.utcnow().isoformat() + "Z",
-        "kind": kind,
-        "payload": payload,
-    }
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+@app.callback()
+def main_options(
+    ctx: typer.Context,
+    stats: bool = typer.Option(False, "--stats", help="Записать статистику обмена с адаптером в журнал сессии"),
+    capture: Path = typer.Option(None, "--capture", help="Записать весь обмен с адаптером в файл (.ecap)"),
+    replay: Path = typer.Option(None, "--replay", help="Вместо адаптера проиграть записанный обмен (.ecap)"),
+    replay_realtime: bool = typer.Option(False, help="С --replay: выдерживать исходные задержки ответов"),
+    no_daemon: bool = typer.Option(False, "--no-daemon", help="Открыть порт напрямую, даже если запущен демон"),
+):
+    """ECU CLI: DTC, dump/flash (DEMO), KWP-ping."""
+    if stats:
+        ctx.call_on_close(_export_link_stats)
+    if capture:
+        _TRANSPORT["capture"] = CaptureWriter(capture)
+        ctx.call_on_close(_TRANSPORT["capture"].close)
+    if replay:
+        _TRANSPORT["replay"] = replay
+        _TRANSPORT["realtime"] = replay_realtime
+    _TRANSPORT["daemon"] = not no_daemon
+
+# как открывать адаптер в этом запуске: с записью обмена, проигрыванием записи или через демон
+_TRANSPORT = {"capture": None, "replay": None, "realtime": False, "daemon": True}
+
+def _daemon() -> DaemonClient | None:
+    """Клиент демона, если он запущен и обмен не пишется/не проигрывается (это делается только напрямую)."""
+    if not _TRANSPORT["daemon"] or _TRANSPORT["capture"] or _TRANSPORT["replay"]:
+        return None
+    return DaemonClient.connect()
+
+def _real_backend(port: str | None):
+    client = _daemon()
+    if client:
+        print(f"[dim]Через демон ({DAEMON_SOCKET})[/]")
+        return DaemonBackend(client, port)
+    return RealBackend(adapter=_open_adapter(port), developer_mode=False)
+
+def _open_adapter(port: str | None) -> ELM327:
+    if _TRANSPORT["replay"]:
+        return ReplayELM327(_TRANSPORT["replay"], realtime=_TRANSPORT["realtime"])
+    return ELM327(port, capture=_TRANSPORT["capture"])
+
+def _need_port(port: str | None, hint: str = "[red]Укажи COM-порт.[/]"):
+    if not port and not _TRANSPORT["replay"]:
+        print(hint)
+        raise typer.Exit(code=2)
+
+def _export_link_stats():
+    if not LINK_STATS.empty():
+        log_event("link_stats", LINK_STATS.snapshot())
+        print("[dim]Статистика обмена записана в журнал — смотри команду stats.[/]")
+
+def _sim_backend(layout: str, sim_timing: bool = False) -> SimBackend:
+    # у каждой раскладки свой образ симулятора; j72 — исторический logs/sim_ecu.bin
+    name = "sim_ecu.bin" if layout == "j72" else f"sim_ecu_{layout}.bin"
+    return SimBackend(Path("logs") / name, timing=KLineTiming() if sim_timing else None,
+                      regions=memory_layout(layout))
+
+@contextmanager
+def _progress_bar(label: str):
+    """Живой прогресс для dump/flash: байты, скорость, ETA. Ctrl+C прерывает операцию."""
+    columns = (TextColumn("{task.description}"), BarColumn(), DownloadColumn(),
+               TransferSpeedColumn(), TimeRemainingColumn())
+    with Progress(*columns, transient=True) as bar:
+        task = bar.add_task(label, total=None)
+        yield lambda p: bar.update(task, completed=p.done, total=p.total)
+
+def _print_link_estimate(info: dict):
+    link = info.get("link")
+    if link:
+        print(f"[dim]Модель K-Line {link['baud']} бод: {link['requests']} запросов, "
+              f"~{link['elapsed_s']:.1f} с на линии[/]")
+
+def _print_retry_cost(st: dict | None):
+    if st and (st["retries"] or st["pending"] or st["failed"]):
+        nrc = ", ".join(f"{k}×{v}" for k, v in st["nrc"].items()) or "-"
+        print(f"[dim]Повторы запросов KWP: {st['retries']}, ожиданий 7F 78: {st['pending']}, "
+              f"таймаутов: {st['timeouts']}, NRC: {nrc}; потеряно ~{st['cost_s']:.2f} с[/]")
 
 @app.command()
 def ports():
@@ -52,6 +161,14 @@ def ports():
     for p in found:
         print(f"[cyan]{p.device}[/] - {p.description}")
 
+def _print_advice(advice: list[dict]):
+    # коды под одним правилом — одной подсказкой
+    print("\n[bold]Подсказки по диагностике:[/]")
+    for item in advice:
+        print(f"[cyan]{', '.join(item['codes']) or '-'}[/]: {item['title']}")
+        for step in item["checks"]:
+            print(f"  • {step}")
+
 @app.command("read-dtc")
 def read_dtc(
     port: str = typer.Argument(None, help="Напр. COM3 или /dev/ttyUSB0"),
@@ -64,38 +181,39 @@ def read_dtc(
         print("[yellow]Демо-режим: используем пример ответа адаптера.[/]")
         raw = "43 01 71 00 00 00\r\n>"
         dtcs, _ = parse_obd_dtc(raw)
-        _log_event("demo_response", {"raw": raw, "dtcs": dtcs})
+        log_event("demo_response", {"raw": raw, "dtcs": dtcs})
     else:
-        if not port:
-            print("[red]Укажи порт, например: python main.py read-dtc COM3[/]")
-            raise typer.Exit(code=2)
-
-        print(f"[green]Подключение к адаптеру {port}...[/]")
-        elm = ELM327(port)
-        try:
-            init_resp = elm.init()
-            _log_event("elm_init", {"port": port, "resp": init_resp})
-            print("[green]Инициализация завершена. Запрос DTC (Mode 03)...[/]")
-            raw = elm.send_obd("03")
-            _log_event("elm_resp", {"raw": raw})
-            dtcs, _ = parse_obd_dtc(raw)
-        finally:
-            elm.close()
+        _need_port(port, "[red]Укажи порт, например: python main.py read-dtc COM3[/]")
+
+        client = _daemon()
+        if client:
+            print(f"[green]Запрос DTC (Mode 03) через демон, порт {port}...[/]")
+            with client:
+                res = client.call("read_dtc", port=port)
+            raw, dtcs = res["raw"], res["dtcs"]
+            log_event("elm_resp", {"port": port, "raw": raw, "daemon": True})
+        else:
+            print(f"[green]Подключение к адаптеру {port}...[/]")
+            elm = _open_adapter(port)
+            try:
+                init_resp = elm.init()
+                log_event("elm_init", {"port": port, "resp": init_resp})
+                print("[green]Инициализация завершена. Запрос DTC (Mode 03)...[/]")
+                raw = elm.send_obd("03")
+                log_event("elm_resp", {"port": port, "raw": raw})
+                dtcs, _ = parse_obd_dtc(raw)
+            finally:
+                elm.close()
 
     if dtcs:
         print(f"[bold green]Найдено DTC:[/] {dtcs}")
     else:
         print("[bold yellow]Коды неисправностей не обнаружены или не распознаны.[/]")
 
-    advice = assistant.advise_for_dtcs(dtcs)
-    print("\n[bold]Подсказки по диагностике:[/]")
-    for item in advice:
-        code = item["code"] or "-"
-        print(f"[cyan]{code}[/]: {item['title']}")
-        for step in item["checks"]:
-            print(f"  • {step}")
+    advice = assistant.advise_batch(dtcs)
+    _print_advice(advice)
 
-    _log_event("advice", {"dtcs": dtcs, "advice": advice})
+    log_event("advice", {"dtcs": dtcs, "advice": advice})
     print(f"\n[dim]Логи записаны в: {LOG_FILE}[/]")
 
 # -------- НОВЫЕ КОМАНДЫ: INFO / READ-FW / WRITE-FW ----------
@@ -104,25 +222,23 @@ def read_dtc(
 def ecu_info(
     port: str = typer.Option(None, help="COM-порт, напр. COM3"),
     demo: bool = typer.Option(False, help="Демо/симулятор вместо реального ЭБУ"),
+    layout: str = typer.Option("j72", help="Демо: раскладка памяти (j72, split128, split512)"),
 ):
     """
     Показать базовую информацию о памяти/прошивке (демо: из симулятора).
     """
     if demo:
-        backend = SimBackend(Path("logs/sim_ecu.bin"))
+        backend = _sim_backend(layout)
     else:
-        if not port:
-            print("[red]Укажи COM-порт.[/]")
-            raise typer.Exit(code=2)
-        elm = ELM327(port)
-        backend = RealBackend(adapter=elm, developer_mode=False)
+        _need_port(port)
+        backend = _real_backend(port)
 
     try:
         info = backend.info()
         print("[bold]Информация об ЭБУ/памяти:[/]")
         print(json.dumps(info, ensure_ascii=False, indent=2))
     finally:
-        if not demo and hasattr(backend, "close"):
+        if hasattr(backend, "close"):
             backend.close()
 
 @app.command("read-fw")
@@ -130,31 +246,46 @@ def read_fw(
     out_file: Path = typer.Argument(Path("logs/dump.bin"), help="Куда сохранить дамп"),
     port: str = typer.Option(None, help="COM-порт для подключения"),
     demo: bool = typer.Option(False, help="Демо/симулятор вместо реального ЭБУ"),
-    chunk: int = typer.Option(256, help="Размер блока чтения")
+    chunk: int = typer.Option(0, help="Размер блока чтения (0 — подбирать автоматически)"),
+    resume: bool = typer.Option(False, help="Дочитать прерванный дамп по чекпоинту <файл>.ckpt"),
+    sim_timing: bool = typer.Option(False, help="Демо: моделировать тайминги K-Line 10400 бод"),
+    layout: str = typer.Option("j72", help="Демо: раскладка памяти (j72, split128, split512)"),
 ):
     """
     Считать прошивку из памяти ЭБУ (демо-симулятор полностью работает).
     На реальном ЭБУ read пока не реализован.
     """
     if demo:
-        backend = SimBackend(Path("logs/sim_ecu.bin"))
+        backend = _sim_backend(layout, sim_timing)
     else:
-        if not port:
-            print("[red]Укажи COM-порт.[/]")
-            raise typer.Exit(code=2)
-        elm = ELM327(port)
-        backend = RealBackend(adapter=elm, developer_mode=False)
+        _need_port(port)
+        backend = _real_backend(port)
 
     try:
-        result = dump_firmware(backend, out_file, chunk)
-        _log_event("read_fw", result)
-        print(f"[green]Готово:[/] сохранено {result['bytes']} байт -> {result['out']}")
+        with _progress_bar("Чтение") as progress:
+            # при проигрывании размер блока подбирается заново, как в записи, — иначе запросы разойдутся
+            profile = None if _TRANSPORT["replay"] else ChunkProfile(CHUNK_PROFILE_FILE)
+            result = dump_firmware(backend, out_file, chunk or None, resume=resume,
+                                   profile=profile, progress=progress)
+        log_event("read_fw", result)
+        print(f"[green]Готово:[/] сохранено {result['bytes']} байт -> {result['out']} (блок {result['chunk']} байт)")
+        if result["resumed"]:
+            print(f"[dim]Продолжение: взято из чекпоинта {result['reused_blocks']} блоков, "
+                  f"дочитано {result['read']} байт (битых блоков: {result['bad_blocks']})[/]")
+        _print_link_estimate(result["info"])
+        _print_retry_cost(result["info"].get("kwp_retry"))
     except NotImplementedError as e:
         print(f"[red]{e}[/]")
+    except (OperationCancelled, KeyboardInterrupt):
+        print("[yellow]Чтение прервано.[/]")
+        if checkpoint_path(out_file).exists():
+            print("[yellow]Прогресс сохранён — повтори команду с --resume, чтобы дочитать.[/]")
     except Exception as e:
         print(f"[red]Ошибка чтения:[/] {e}")
+        if checkpoint_path(out_file).exists():
+            print("[yellow]Прогресс сохранён — повтори команду с --resume, чтобы дочитать.[/]")
     finally:
-        if not demo and hasattr(backend, "close"):
+        if hasattr(backend, "close"):
             backend.close()
 
 @app.command("write-fw")
@@ -162,8 +293,12 @@ def write_fw(
     in_file: Path = typer.Argument(..., help="Образ прошивки для записи"),
     port: str = typer.Option(None, help="COM-порт для подключения"),
     demo: bool = typer.Option(False, help="Демо/симулятор вместо реального ЭБУ"),
-    chunk: int = typer.Option(256, help="Размер блока записи"),
-    force: bool = typer.Option(False, help="Подтверждение, что понимаешь риск записи")
+    chunk: int = typer.Option(0, help="Размер блока записи (0 — самый большой, что принимает ЭБУ)"),
+    force: bool = typer.Option(False, help="Подтверждение, что понимаешь риск записи"),
+    diff: bool = typer.Option(False, help="Писать только изменившиеся блоки"),
+    reference: Path = typer.Option(None, help="С --diff: дамп текущего содержимого ЭБУ для сравнения"),
+    sim_timing: bool = typer.Option(False, help="Демо: моделировать тайминги K-Line 10400 бод"),
+    layout: str = typer.Option("j72", help="Демо: раскладка памяти (j72, split128, split512)"),
 ):
     """
     Записать прошивку в память.
@@ -173,34 +308,447 @@ def write_fw(
         print(f"[red]Файл не найден:[/] {in_file}")
         raise typer.Exit(code=2)
 
-    if demo:
-        backend = SimBackend(Path("logs/sim_ecu.bin"))
-    else:
-        if not port:
-            print("[red]Укажи COM-порт.[/]")
-            raise typer.Exit(code=2)
-        elm = ELM327(port)
-        backend = RealBackend(adapter=elm, developer_mode=False)
-
     if not demo and not force:
+        # до открытия порта/демона: иначе выход оставил бы открытыми адаптер и сессию с keepalive
         print("[red]На реальном ЭБУ запись отключена по безопасности.[/]")
         print("Если ты действительно на стенде и понимаешь риск — работаем в DEMO сейчас.")
         raise typer.Exit(code=3)
 
+    if demo:
+        backend = _sim_backend(layout, sim_timing)
+    else:
+        _need_port(port)
+        backend = _real_backend(port)
+
     try:
-        result = flash_firmware(backend, in_file, chunk)
-        _log_event("write_fw", result)
+        with _progress_bar("Запись") as progress:
+            result = flash_firmware(backend, in_file, chunk or None, diff=diff, reference=reference,
+                                    progress=progress)
+        log_event("write_fw", result)
         print(f"[green]Готово:[/] записано {result['bytes']} байт из {result['source']}")
+        if diff:
+            print(f"[dim]Дифф ({result['mode']}): пропущено {result['skipped']} байт, "
+                  f"отрезков записи: {result['runs']}[/]")
+        _print_link_estimate(result["info"])
     except PermissionError as e:
         print(f"[red]{e}[/]")
     except NotImplementedError as e:
         print(f"[red]{e}[/]")
+    except (OperationCancelled, KeyboardInterrupt):
+        print("[yellow]Запись прервана, незафиксированные изменения отброшены.[/]")
     except Exception as e:
         print(f"[red]Ошибка записи:[/] {e}")
     finally:
-        if not demo and hasattr(backend, "close"):
+        if hasattr(backend, "close"):
             backend.close()
 
+@app.command("diff")
+def diff_cmd(
+    old_file: Path = typer.Argument(..., help="Исходный образ"),
+    new_file: Path = typer.Argument(..., help="Изменённый образ"),
+    patch_out: Path = typer.Option(None, "--out", "-o", help="Сохранить патч (.fwp)"),
+    show: int = typer.Option(20, help="Сколько участков показать"),
+):
+    """Чем отличаются два образа; с --out — записать компактный патч."""
+    patch = make_patch(old_file.read_bytes(), new_file.read_bytes())
+    for off, data in patch.ranges[:show]:
+        print(f"  0x{off:06X}..0x{off + len(data):06X}  {len(data):>6} байт")
+    if len(patch.ranges) > show:
+        print(f"  … ещё {len(patch.ranges) - show}")
+    print(f"[green]Участков:[/] {len(patch.ranges)}, изменённых байт: {patch.payload_bytes}")
+    if patch_out:
+        raw = patch.to_bytes()
+        patch_out.parent.mkdir(parents=True, exist_ok=True)
+        patch_out.write_bytes(raw)
+        log_event("diff", {"old": str(old_file), "new": str(new_file), "patch": str(patch_out),
+                            "ranges": len(patch.ranges), "size": len(raw)})
+        print(f"[green]Патч:[/] {patch_out} ({len(raw)} байт)")
+
+@app.command("apply-patch")
+def apply_patch_cmd(
+    image: Path = typer.Argument(..., help="Образ, к которому применить патч"),
+    patch_file: Path = typer.Argument(..., help="Патч (.fwp) от команды diff"),
+    out_file: Path = typer.Option(None, "--out", "-o", help="Куда сохранить (по умолчанию — поверх образа)"),
+):
+    """Применить патч от команды diff (с проверкой CRC до и после)."""
+    buf = bytearray(image.read_bytes())
+    try:
+        apply_patch(buf, Patch.from_bytes(patch_file.read_bytes()))
+    except ValueError as e:
+        print(f"[red]{e}[/]")
+        raise typer.Exit(code=2)
+    target = out_file or image
+    target.write_bytes(buf)
+    print(f"[green]Готово:[/] {target}")
+
+@repo_app.command("import")
+def repo_import(
+    image: Path = typer.Argument(..., help="Файл прошивки (дамп)"),
+    name: str = typer.Option(None, help="Имя образа в хранилище (по умолчанию — имя файла)"),
+    compression: str = typer.Option("zlib", help="Сжатие новых блоков: none, zlib, lzma"),
+    force: bool = typer.Option(False, help="Перезаписать образ с тем же именем"),
+    root: Path = typer.Option(FW_REPO_DIR, help="Каталог хранилища"),
+):
+    """Положить дамп в хранилище: сохраняются только блоки, которых там ещё нет."""
+    try:
+        result = FirmwareRepo(root, compression=compression).import_image(image, name=name, force=force)
+    except (OSError, ValueError) as e:
+        print(f"[red]{e}[/]")
+        raise typer.Exit(code=2)
+    log_event("repo_import", result)
+    print(f"[green]Образ {result['name']}:[/] {result['size']} байт, блоков {result['blocks']}, "
+          f"новых {result['new_blocks']} (+{result['stored_bytes']} байт на диске), "
+          f"общих {result['reused_blocks']}")
+
+@repo_app.command("checkout")
+def repo_checkout(
+    name: str = typer.Argument(..., help="Имя образа в хранилище"),
+    out_file: Path = typer.Argument(..., help="Куда собрать файл прошивки"),
+    root: Path = typer.Option(FW_REPO_DIR, help="Каталог хранилища"),
+):
+    """Собрать образ из хранилища в файл (с проверкой SHA-256)."""
+    try:
+        path = FirmwareRepo(root).checkout(name, out_file)
+    except (OSError, ValueError) as e:
+        print(f"[red]{e}[/]")
+        raise typer.Exit(code=2)
+    print(f"[green]Готово:[/] {name} -> {path}")
+
+@repo_app.command("list")
+def repo_list(root: Path = typer.Option(FW_REPO_DIR, help="Каталог хранилища")):
+    """Образы в хранилище и сколько места они реально занимают."""
+    repo = FirmwareRepo(root)
+    images = repo.list_images()
+    if not images:
+        print("[yellow]Хранилище пусто.[/]")
+        return
+    for m in images:
+        print(f"  {m['name']:<24} {m['size']:>8} байт  CRC32 {m['crc32']}  {m['created'][:19]}")
+    st = repo.stats()
+    print(f"[dim]Образов: {st['images']}, уникальных блоков: {st['objects']}, "
+          f"на диске {st['stored_bytes']} байт из {st['logical_bytes']}[/]")
+
+@app.command("emulate")
+def emulate(
+    layout: str = typer.Option("j72", help="Раскладка памяти образа (j72, split128, split512)"),
+    sim_timing: bool = typer.Option(False, help="Отвечать с таймингами K-Line 10400 бод (реальные паузы)"),
+    error_rate: float = typer.Option(0.0, help="Доля запросов без ответа (NO DATA)"),
+    negative_rate: float = typer.Option(0.0, help="Доля отрицательных ответов (код — --nrc)"),
+    nrc: str = typer.Option("0x21", help="Код вброшенных отрицательных ответов: 0x21 busy, 0x78 pending, 0x31 ..."),
+    dtc: list[str] = typer.Option(["P0300", "P0171"], help="Коды неисправностей для Mode 03"),
+):
+    """
+    Эмулятор ELM327 + ЭБУ KWP2000 на псевдотерминале (Linux/macOS).
+    Выведенный путь порта передаётся в read-dtc / kwp-ping / read-fw --port.
+    """
+    name = "sim_ecu.bin" if layout == "j72" else f"sim_ecu_{layout}.bin"
+    timing = None
+    if sim_timing or error_rate or negative_rate:
+        timing = KLineTiming(realtime=sim_timing, error_rate=error_rate, negative_rate=negative_rate,
+                             negative_code=int(nrc, 0))
+    emu = ELM327Emulator(SimECU(Path("logs") / name, memory_layout(layout)), timing=timing, dtcs=dtc)
+    port = emu.open()
+    print(f"[green]Эмулятор ELM327 на порту[/] [bold]{port}[/] (Ctrl+C — выход)")
+    print(f"[dim]Пример: python -m ecu_tool.main read-fw logs/dump_emu.bin --port {port}[/]")
+    try:
+        emu.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emu.stop()
+        emu.ecu.close()
+        if emu.link:
+            print(f"[dim]{emu.stats()}[/]")
+
+def _fleet_dir(out_dir: Path | None) -> Path:
+    # у каждого запуска свой подкаталог с отчётами по портам
+    return (out_dir or Path("logs") / "fleet") / datetime.now().strftime("%Y%m%d-%H%M%S")
+
+def _fleet_run(kind: str, op, ports: list[str] | None, limit: int, out_dir: Path) -> list[dict]:
+    ports = ports or discover_ports()
+    if not ports:
+        print("[yellow]Порты не найдены.[/]")
+        raise typer.Exit(code=2)
+    print(f"[green]{len(ports)} порт(ов), одновременно до {limit}…[/]")
+    t0 = time.monotonic()
+    results = asyncio.run(run_fleet(ports, op, limit=limit, out_dir=out_dir))
+    wall = time.monotonic() - t0
+    for r in results:
+        status = "[green]OK[/]" if r["ok"] else f"[red]{r.get('error')}[/]"
+        print(f"  [cyan]{r['port']}[/] {r['elapsed_s']:.1f} с  {status}")
+    slowest = max(r["elapsed_s"] for r in results)
+    total = sum(r["elapsed_s"] for r in results)
+    print(f"[dim]Всего {wall:.1f} с (самый медленный {slowest:.1f} с, последовательно было бы ~{total:.1f} с). "
+          f"Отчёты: {out_dir}[/]")
+    log_event(f"fleet_{kind}", {"results": results, "wall_s": round(wall, 3), "out_dir": str(out_dir)})
+    return results
+
+@fleet_app.command("scan")
+def fleet_scan(
+    port: list[str] = typer.Option(None, help="Порты (по умолчанию — все найденные)"),
+    limit: int = typer.Option(DEFAULT_LIMIT, help="Сколько портов обслуживать одновременно"),
+    out_dir: Path = typer.Option(None, help="Каталог отчётов (по умолчанию logs/fleet)"),
+):
+    """Найти отвечающие адаптеры и ЭБУ на всех портах."""
+    for r in _fleet_run("scan", fleet_probe, port, limit, _fleet_dir(out_dir)):
+        if r["ok"]:
+            print(f"  [cyan]{r['port']}[/]: {r['adapter']}, ЭБУ {r['ecu_id']}")
+
+@fleet_app.command("read-dtc")
+def fleet_read_dtc_cmd(
+    port: list[str] = typer.Option(None, help="Порты (по умолчанию — все найденные)"),
+    limit: int = typer.Option(DEFAULT_LIMIT, help="Сколько портов обслуживать одновременно"),
+    out_dir: Path = typer.Option(None, help="Каталог отчётов (по умолчанию logs/fleet)"),
+    rules: Path = typer.Option(DEFAULT_RULES_PATH, help="Файл правил для помощника"),
+):
+    """Считать коды неисправностей (Mode 03) со всех портов."""
+    dtcs = []
+    for r in _fleet_run("read_dtc", fleet_read_dtc, port, limit, _fleet_dir(out_dir)):
+        if r["ok"]:
+            print(f"  [cyan]{r['port']}[/]: {r['dtcs'] or 'нет кодов'}")
+            dtcs += r["dtcs"]
+    if dtcs:
+        # один и тот же код с разных машин — одна подсказка
+        _print_advice(Assistant(rules).advise_batch(dtcs))
+
+@fleet_app.command("read-fw")
+def fleet_read_fw_cmd(
+    port: list[str] = typer.Option(None, help="Порты (по умолчанию — все найденные)"),
+    limit: int = typer.Option(DEFAULT_LIMIT, help="Сколько портов обслуживать одновременно"),
+    out_dir: Path = typer.Option(None, help="Каталог отчётов и дампов (по умолчанию logs/fleet)"),
+    layout: str = typer.Option("j72", help="Раскладка памяти (j72, split128, split512)"),
+):
+    """Считать прошивки со всех портов; дамп каждого — <каталог>/<порт>.bin."""
+    run_dir = _fleet_dir(out_dir)
+    op = fleet_read_fw(run_dir, memory_layout(layout))
+    for r in _fleet_run("read_fw", op, port, limit, run_dir):
+        if r["ok"]:
+            print(f"  [cyan]{r['port']}[/]: {r['bytes']} байт -> {r['out']} (повторов {r['retries']})")
+
+def _print_link_stats(snapshot: dict):
+    table = Table(show_lines=False)
+    for col in ("слой", "сервис", "n", "ошиб", "тайм", "повт", "p50 мс", "p95 мс", "p99 мс",
+                "↑ байт", "↓ байт", "NRC"):
+        table.add_column(col, justify="left" if col in ("слой", "сервис", "NRC") else "right")
+    for layer, services in snapshot.items():
+        for key, st in services.items():
+            nrc = " ".join(f"{k}×{v}" for k, v in st["nrc"].items())
+            table.add_row(layer, f"{key} {st['name']}" if st["name"] != key else key,
+                          str(st["count"]), str(st["errors"]), str(st["timeouts"]), str(st["retries"]),
+                          f"{st['p50_ms']:.1f}", f"{st['p95_ms']:.1f}", f"{st['p99_ms']:.1f}",
+                          str(st["bytes_tx"]), str(st["bytes_rx"]), nrc)
+    print(table)
+    # где теряется время: kwp − elm по одному сервису — наш код (разбор, проверки)
+    kwp, elm = snapshot.get("kwp", {}), snapshot.get("elm", {})
+    for key in kwp.keys() & elm.keys():
+        host = kwp[key]["mean_ms"] - elm[key]["mean_ms"]
+        print(f"[dim]{kwp[key]['name']}: линия+ЭБУ {elm[key]['mean_ms']:.1f} мс, хост {host:.2f} мс на запрос[/]")
+
+@app.command("datalog")
+def datalog(
+    out_file: Path = typer.Argument(Path("logs/live.edl"), help="Куда писать отсчёты (.edl)"),
+    port: str = typer.Option(None, help="COM-порт адаптера"),
+    demo: bool = typer.Option(False, help="Эмулятор ЭБУ с таймингами K-Line 10400 бод (Linux/macOS)"),
+    source: str = typer.Option("obd", help="obd — PID режима 01, kwp — блоки KWP 0x21"),
+    signal: list[str] = typer.Option(None, "--signal", "-s", help="Параметр (можно несколько): rpm, speed, coolant, ..."),
+    duration: float = typer.Option(10.0, help="Сколько секунд писать (0 — до Ctrl+C)"),
+    batch: int = typer.Option(OBD_BATCH, help="PID-ов в одном запросе режима 01 (только на CAN; на K-Line — по одному)"),
+):
+    """
+    Живые данные: опрос параметров (быстрые чаще медленных), запись в .edl
+    и итог — сколько отсчётов в секунду удалось снять.
+    """
+    try:
+        signals = select_signals(source, signal)
+    except (KeyError, ValueError) as e:
+        print(f"[red]{e if isinstance(e, ValueError) else f'Неизвестный источник {source}'}[/]")
+        raise typer.Exit(code=2)
+    emu = None
+    if demo:
+        emu = ELM327Emulator(SimECU(Path("logs") / "sim_ecu.bin"), timing=KLineTiming(realtime=True))
+        port = emu.start()
+    else:
+        _need_port(port)
+    elm = _open_adapter(port)
+    try:
+        elm.init()
+        if source == "kwp":
+            elm.set_header("81 10 F1")
+        logger = LiveLogger(elm, signals, batch=batch)
+        logger.start()
+        names = ", ".join(s.name for s in logger.signals)
+        print(f"[green]Запись живых данных[/] ({source}: {names}) -> {out_file}"
+              + (f" на {duration:g} с" if duration else " до Ctrl+C"))
+        with DatalogWriter(out_file, logger.signals) as writer:
+            result = logger.run(duration or None, writer)
+    finally:
+        elm.close()
+        if emu:
+            emu.stop()
+            emu.ecu.close()
+
+    result.update(out=str(out_file), source=source, port=port)
+    log_event("datalog", result)
+    table = Table(title="Живые данные")
+    for col in ("Параметр", "Отсчётов", "В секунду", "Последнее"):
+        table.add_column(col, justify="left" if col == "Параметр" else "right")
+    for name, st in result["signals"].items():
+        last = "-" if st["last"] is None else f"{st['last']:.1f} {st['unit']}"
+        table.add_row(name, str(st["count"]), f"{st['per_s']:.1f}", last)
+    print(table)
+    print(f"[bold green]{result['samples_per_s']:.1f} отсчётов/с[/] "
+          f"({result['samples']} за {result['elapsed_s']:.1f} с; {result['requests_per_s']:.1f} запросов/с, "
+          + (f"до {result['batch']} PID в запросе, " if source == "obd" else "")
+          + f"ошибок {result['errors']})")
+    if result["dropped"]:
+        print(f"[yellow]Потеряно отсчётов (файл не успевал): {result['dropped']}[/]")
+
+@app.command("capture-info")
+def capture_info(
+    capture_file: Path = typer.Argument(..., help="Файл захвата (.ecap)"),
+    show: int = typer.Option(20, help="Сколько обменов показать"),
+):
+    """Что записано в файле захвата: команды, ответы, задержки."""
+    started, records = read_capture(capture_file)
+    pairs = exchanges(records)
+    duration = records[-1].t if records else 0.0
+    print(f"[bold]{capture_file}[/]: начало {datetime.utcfromtimestamp(started).isoformat()}Z, "
+          f"{len(pairs)} обменов за {duration:.1f} с")
+    for cmd, resp, dt in pairs[:show]:
+        short = resp.replace("\r", " ").strip()
+        print(f"  [cyan]{cmd:<16}[/] {dt * 1000:7.1f} мс  {short[:60]}{'…' if len(short) > 60 else ''}")
+    if len(pairs) > show:
+        print(f"  … ещё {len(pairs) - show}")
+
+@app.command("stats")
+def stats_cmd(
+    last: int = typer.Option(1, help="Сколько последних записей показать"),
+):
+    """Статистика обмена с адаптером/ЭБУ из журнала (команды, запущенные с --stats)."""
+    records = []
+    if LOG_FILE.exists():
+        with open(LOG_FILE, encoding="utf-8") as f:
+            for line in f:
+                if '"link_stats"' in line:
+                    rec = json.loads(line)
+                    if rec.get("kind") == "link_stats":
+                        records.append(rec)
+    if not records:
+        print("[yellow]В журнале нет статистики. Запусти команду с --stats, напр.: "
+              "python -m ecu_tool.main --stats read-fw --port COM3[/]")
+        return
+    for rec in records[-last:]:
+        print(f"[bold]{rec['ts']}[/]")
+        _print_link_stats(rec["payload"])
+
+@app.command("analytics")
+def analytics_cmd(
+    logs: list[Path] = typer.Argument(None, help="Журналы .jsonl / .jsonl.gz или каталоги с ними (по умолчанию — текущий журнал)"),
+    workers: int = typer.Option(1, help="Процессов для разбора файлов (0 — по числу ядер)"),
+    top: int = typer.Option(15, help="Сколько строк в таблицах"),
+    json_out: Path = typer.Option(None, "--json", help="Сохранить полную сводку в JSON"),
+):
+    """Какие коды неисправностей встречаются чаще, вместе и на каких машинах (по журналам сессий)."""
+    files = log_files(logs or [LOG_FILE])
+    missing = [f for f in files if not f.exists()]
+    if missing or not files:
+        print(f"[red]Нет журналов: {', '.join(map(str, missing)) or 'каталог пуст'}[/]")
+        raise typer.Exit(code=2)
+    t0 = time.monotonic()
+    stats = analyze(files, workers=workers or os.cpu_count() or 1)
+    wall = time.monotonic() - t0
+    size = sum(f.stat().st_size for f in files)
+    print(f"[bold]{stats.files}[/] файл(ов), {size / 1e6:.1f} МБ за {wall:.1f} с: "
+          f"{stats.readings} чтений кодов, {len(stats.codes)} разных кодов, {len(stats.vehicles)} машин"
+          + (f", битых строк {stats.bad_lines}" if stats.bad_lines else ""))
+    if not stats.readings:
+        return
+
+    table = Table(title="Частые коды")
+    for col in ("Код", "Чтений", "Машин", "Первое", "Последнее"):
+        table.add_column(col, justify="left" if col == "Код" else "right")
+    for code, seen, vehicles in stats.top_codes(top):
+        table.add_row(code, str(seen.count), str(vehicles), seen.first[:19], seen.last[:19])
+    print(table)
+
+    pairs = stats.top_pairs(top)
+    if pairs:
+        table = Table(title="Коды вместе (в одном чтении)")
+        table.add_column("Коды")
+        table.add_column("Раз", justify="right")
+        for (a, b), n in pairs:
+            table.add_row(f"{a} + {b}", str(n))
+        print(table)
+
+    table = Table(title="По машинам")
+    for col in ("Машина/порт", "Чтений", "Кодов", "Первое", "Последнее", "Частые"):
+        table.add_column(col, justify="right" if col in ("Чтений", "Кодов") else "left")
+    ranked = sorted(stats.vehicles.items(), key=lambda kv: -kv[1].count)[:top]
+    for vehicle, seen in ranked:
+        codes = stats.by_vehicle.get(vehicle, {})
+        frequent = sorted(codes.items(), key=lambda kv: -kv[1].count)[:3]
+        table.add_row(vehicle, str(seen.count), str(len(codes)), seen.first[:19], seen.last[:19],
+                      " ".join(f"{c}×{s.count}" for c, s in frequent))
+    print(table)
+
+    if json_out:
+        json_out.write_text(json.dumps(stats.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"[dim]Сводка: {json_out}[/]")
+    log_event("analytics", {"files": [str(f) for f in files], "readings": stats.readings,
+                             "codes": len(stats.codes), "vehicles": len(stats.vehicles), "wall_s": round(wall, 3)})
+
+# -------- ДЕМОН ----------
+
+@daemon_app.callback(invoke_without_command=True)
+def daemon_run(ctx: typer.Context,
+               socket_path: Path = typer.Option(DAEMON_SOCKET, "--socket", help="Путь Unix-сокета")):
+    """
+    Запустить демон (без подкоманды): адаптеры открываются при первом
+    обращении и остаются открытыми; read-dtc, ecu-info, read-fw, write-fw
+    и kwp-ping сами идут через него. Ctrl+C — остановить.
+    """
+    if ctx.invoked_subcommand:
+        return
+    try:
+        server = DaemonServer(socket_path)
+    except (RuntimeError, OSError) as e:
+        print(f"[red]{e}[/]")
+        raise typer.Exit(code=1)
+    print(f"[green]Демон слушает[/] [bold]{socket_path}[/] (Ctrl+C — выход)")
+    log_event("daemon_start", {"socket": str(socket_path)})
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        log_event("daemon_stop", {"socket": str(socket_path)})
+
+@daemon_app.command("status")
+def daemon_status(socket_path: Path = typer.Option(DAEMON_SOCKET, "--socket", help="Путь Unix-сокета")):
+    """Запущен ли демон и какие адаптеры он держит."""
+    client = DaemonClient.connect(socket_path)
+    if client is None:
+        print("[yellow]Демон не запущен.[/]")
+        raise typer.Exit(code=1)
+    with client:
+        st = client.call("status")
+    print(f"[green]Демон работает[/] (pid {st['pid']}, {st['uptime_s']:.0f} с), адаптеров: {len(st['adapters'])}")
+    for a in st["adapters"]:
+        print(f"  [cyan]{a['port']}[/] ЭБУ {a['ecu_id'] or '?'}, запросов {a['requests']}, "
+              f"открыт {a['open_s']:.0f} с, keepalive {a['session']['keepalives']}")
+
+@daemon_app.command("stop")
+def daemon_stop(socket_path: Path = typer.Option(DAEMON_SOCKET, "--socket", help="Путь Unix-сокета")):
+    """Остановить демон (адаптеры закрываются)."""
+    client = DaemonClient.connect(socket_path)
+    if client is None:
+        print("[yellow]Демон не запущен.[/]")
+        return
+    with client:
+        client.call("shutdown")
+    print("[green]Демон остановлен.[/]")
+
 # ... внизу рядом с другими командами:
 
 @app.command("kwp-ping")
@@ -209,7 +757,19 @@ def kwp_ping_cmd(port: str = typer.Argument(..., help="COM-порт, напр. C
     """
     Безопасный тест KWP2000: 10 81 + 3E 00. Ничего не пишет в ЭБУ.
     """
-    elm = ELM327(port)
+    client = _daemon()
+    if client:
+        # через демон сессия уже открыта — достаточно TesterPresent
+        with client:
+            try:
+                res = client.call("ping", port=port, header=header)
+            except Exception as e:
+                print(f"[red]Ошибка KWP-ping через демон:[/] {e}")
+                raise typer.Exit(code=1)
+        print(f"[bold green]Связь по KWP есть (ECU {res['ecu_id'] or '?'} ответил за {res['ms']:.1f} мс, "
+              f"заголовок {header}, через демон).[/]")
+        return
+    elm = _open_adapter(port)
     try:
         print("[green]Инициализация адаптера…[/]")
         elm.init()